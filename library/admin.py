@@ -7,8 +7,9 @@
 """
 
 from django.contrib import admin
+from django.utils import timezone
 
-from .models import Book, Reservation
+from .models import ArchivePartition, Book, BookStats, Job, Reservation
 from .models import Purchase
 
 
@@ -35,6 +36,7 @@ class ReservationAdmin(admin.ModelAdmin):
     list_filter = ("status", "reserved_at")
     search_fields = ("book__title", "user__username")
     raw_id_fields = ("book", "user")
+    list_select_related = ("book", "user")
 
 
 @admin.register(Purchase)
@@ -43,4 +45,64 @@ class PurchaseAdmin(admin.ModelAdmin):
 
     list_display = ("book", "user", "price", "purchased_at")
     list_filter = ("purchased_at",)
+    list_select_related = ("book", "user")
     search_fields = ("book__title", "user__username")
+
+
+@admin.register(BookStats)
+class BookStatsAdmin(admin.ModelAdmin):
+    """Counters are maintained by the code; the admin only shows them."""
+
+    list_display = (
+        "book",
+        "active_reservations",
+        "total_reservations",
+        "total_purchases",
+        "revenue",
+    )
+    list_select_related = ("book",)
+    search_fields = ("book__title",)
+    ordering = ("-total_reservations",)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    """Queued and failed background jobs; finished ones are deleted."""
+
+    list_display = ("name", "status", "attempts", "run_after", "claimed_by")
+    list_filter = ("status", "name")
+    readonly_fields = ("claimed_by", "claimed_at", "last_error", "created_at")
+    actions = ("retry",)
+
+    @admin.action(description="Запустить заново")
+    def retry(self, request, queryset):
+        queryset.update(
+            status=Job.QUEUED,
+            attempts=0,
+            run_after=timezone.now(),
+            claimed_by="",
+            claimed_at=None,
+        )
+
+
+@admin.register(ArchivePartition)
+class ArchivePartitionAdmin(admin.ModelAdmin):
+    """Month tables of the reservation archive; archivereservations fills them."""
+
+    list_display = ("month", "table", "rows", "created_at")
+    ordering = ("-month",)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
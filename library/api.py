@@ -0,0 +1,330 @@
+"""
+JSON API каталога и истории пользователя (только чтение).
+
+Адреса::
+
+    /api/books/                  книги, по названию
+    /api/books/<id>/             одна книга
+    /api/reservations/           бронирования текущего пользователя
+    /api/purchases/              покупки текущего пользователя
+
+Параметры списков:
+
+* ``?fields=id,title`` — какие поля вернуть (по умолчанию — основные);
+* ``?limit=`` — размер страницы (не больше ``MAX_LIMIT``);
+* ``?cursor=`` — курсор из поля ``next`` предыдущего ответа.
+
+Каждый успешный ответ несёт сильный ``ETag``, построенный из метки
+версии: поколения каталога для книг, версии книги для одной книги и
+версии истории пользователя для его бронирований и покупок.  Метки
+лежат в кэше, поэтому повторный опрос с ``If-None-Match`` получает
+``304`` без обращения к ORM (для истории нужен только вход
+пользователя).  Ответы с ошибкой ``ETag`` не получают.
+
+Строки читаются через ``values_list()`` и сразу складываются в словари,
+объекты моделей не создаются.
+"""
+
+import hashlib
+from functools import wraps
+from operator import attrgetter
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.utils.http import quote_etag
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import require_GET
+
+from . import archive, caching
+from .models import Book, Purchase, Reservation
+from .pagination import decode_cursor, encode_cursor
+
+MAX_LIMIT = 200
+
+# Public field name -> column passed to values_list().
+BOOK_FIELDS = {
+    "id": "id",
+    "title": "title",
+    "author": "author",
+    "description": "description",
+    "available_copies": "available_copies",
+    "is_vip": "is_vip",
+    "price": "price",
+    "cover": "cover_image",
+}
+BOOK_DEFAULT = ("id", "title", "author", "available_copies", "is_vip", "price")
+
+RESERVATION_FIELDS = {
+    "id": "id",
+    "book_id": "book_id",
+    "book_title": "book__title",
+    "status": "status",
+    "reserved_at": "reserved_at",
+    "return_date": "return_date",
+}
+PURCHASE_FIELDS = {
+    "id": "id",
+    "book_id": "book_id",
+    "book_title": "book__title",
+    "price": "price",
+    "purchased_at": "purchased_at",
+}
+
+
+class BadRequest(ValueError):
+    """A query parameter the API cannot accept."""
+
+
+def _error(message: str, status: int) -> JsonResponse:
+    return JsonResponse({"error": message}, status=status)
+
+
+def _fields(request, allowed, default):
+    raw = request.GET.get("fields", "")
+    if not raw:
+        return list(default or allowed)
+    names = [name.strip() for name in raw.split(",") if name.strip()]
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise BadRequest(f"unknown fields: {', '.join(unknown)}")
+    return list(dict.fromkeys(names))
+
+
+def _limit(request) -> int:
+    default = getattr(settings, "LIBRARY_API_PAGE_SIZE", 50)
+    try:
+        limit = int(request.GET.get("limit", default))
+    except ValueError:
+        raise BadRequest("limit must be a number")
+    if not 1 <= limit <= MAX_LIMIT:
+        raise BadRequest(f"limit must be between 1 and {MAX_LIMIT}")
+    return limit
+
+
+def _rows(request, queryset, allowed, default, key, descending=False):
+    """
+    One page of ``queryset`` ordered by ``(key, id)`` as a list of dicts
+    plus the URL of the next page.  ``key`` and ``id`` are fetched even
+    when not requested, because the cursor is built from them.
+    """
+    names = _fields(request, allowed, default)
+    limit = _limit(request)
+    sign = "-" if descending else ""
+    queryset = queryset.order_by(sign + key, sign + "pk")
+
+    cursor = decode_cursor(request.GET.get("cursor", ""))
+    if request.GET.get("cursor") and cursor is None:
+        raise BadRequest("malformed cursor")
+    if cursor is not None:
+        value, pk = cursor
+        if descending:
+            queryset = queryset.filter(**{f"{key}__lte": value}).exclude(
+                **{key: value, "pk__gte": pk}
+            )
+        else:
+            queryset = queryset.filter(**{f"{key}__gte": value}).exclude(
+                **{key: value, "pk__lte": pk}
+            )
+
+    columns = [allowed[name] for name in names]
+    extra = [column for column in (key, "id") if column not in columns]
+    rows = list(queryset.values_list(*columns, *extra)[: limit + 1])
+    key_at = (columns + extra).index(key)
+    id_at = (columns + extra).index("id")
+
+    next_url = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        value = last[key_at]
+        value = value if isinstance(value, str) else value.isoformat()
+        params = request.GET.copy()
+        params["cursor"] = encode_cursor(value, last[id_at])
+        next_url = f"{request.path}?{params.urlencode()}"
+    # zip() stops at the requested names and drops the extra columns.
+    return [dict(zip(names, row)) for row in rows], next_url
+
+
+def _merged_rows(request, history, allowed):
+    """
+    :func:`_rows` for an :class:`~library.archive.MergedHistory`: the same
+    fields and ``(reserved_at, id)`` cursor, read from the hot and the
+    archive tables.
+    """
+    names = _fields(request, allowed, None)
+    limit = _limit(request)
+    before = None
+    if request.GET.get("cursor"):
+        cursor = decode_cursor(request.GET["cursor"])
+        value = parse_datetime(cursor[0]) if cursor else None
+        if value is None:
+            raise BadRequest("malformed cursor")
+        before = (value, cursor[1])
+    rows = history.rows(limit + 1, before=before)
+    next_url = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        params = request.GET.copy()
+        params["cursor"] = encode_cursor(rows[-1].reserved_at.isoformat(), rows[-1].pk)
+        next_url = f"{request.path}?{params.urlencode()}"
+    getters = [attrgetter(allowed[name].replace("__", ".")) for name in names]
+    return [
+        {name: getter(row) for name, getter in zip(names, getters)} for row in rows
+    ], next_url
+
+
+def _cover_urls(items):
+    storage = Book._meta.get_field("cover_image").storage
+    for item in items:
+        if "cover" in item:
+            item["cover"] = storage.url(item["cover"]) if item["cover"] else None
+    return items
+
+
+def _etag(*parts) -> str:
+    return hashlib.sha1(":".join(map(str, parts)).encode()).hexdigest()
+
+
+def _query(request) -> str:
+    return urlencode(sorted(request.GET.items()))
+
+
+def _catalog_etag(request, *args, **kwargs):
+    return _etag("books", caching.catalog_generation(), _query(request))
+
+
+def _book_etag(request, pk):
+    return _etag("book", pk, caching.book_version(pk), _query(request))
+
+
+def _history_etag(request, *args, **kwargs):
+    # Book titles appear in the history, so the catalog stamp counts too.
+    return _etag(
+        request.path,
+        request.user.pk,
+        caching.history_version(request.user.pk),
+        caching.catalog_generation(),
+        _query(request),
+    )
+
+
+def _condition(etag_func):
+    """
+    Like Django's ``condition(etag_func=...)``, but only a ``200`` gets
+    the ``ETag``: the stamp does not describe an error, and a client
+    revalidating a ``400`` must not be told it is still valid.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            etag = quote_etag(etag_func(request, *args, **kwargs))
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code == 200:
+                    response.headers.setdefault("ETag", etag)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def _api_view(view):
+    """Turn :class:`BadRequest` into a JSON ``400``."""
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except BadRequest as exc:
+            return _error(str(exc), 400)
+
+    return wrapper
+
+
+def _login_required(view):
+    """Answer anonymous API calls with ``401`` instead of a redirect."""
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return _error("authentication required", 401)
+        return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+@require_GET
+@cache_control(no_cache=True)
+@_condition(_catalog_etag)
+@_api_view
+def books(request):
+    """The catalog, ordered by title."""
+    items, next_url = _rows(
+        request, Book.objects.all(), BOOK_FIELDS, BOOK_DEFAULT, "title"
+    )
+    return JsonResponse({"results": _cover_urls(items), "next": next_url})
+
+
+@require_GET
+@cache_control(no_cache=True)
+@_condition(_book_etag)
+@_api_view
+def book(request, pk: int):
+    """One book with the requested fields."""
+    names = _fields(request, BOOK_FIELDS, BOOK_DEFAULT)
+    row = (
+        Book.objects.filter(pk=pk)
+        .values_list(*(BOOK_FIELDS[name] for name in names))
+        .first()
+    )
+    if row is None:
+        return _error("not found", 404)
+    return JsonResponse(_cover_urls([dict(zip(names, row))])[0])
+
+
+@require_GET
+@_login_required
+@cache_control(private=True, no_cache=True)
+@_condition(_history_etag)
+@_api_view
+def reservations(request):
+    """The current user's reservations, archived ones included, newest first."""
+    found = archive.partitions()
+    if found:
+        items, next_url = _merged_rows(
+            request, archive.MergedHistory(request.user, found), RESERVATION_FIELDS
+        )
+        return JsonResponse({"results": items, "next": next_url})
+    items, next_url = _rows(
+        request,
+        Reservation.objects.filter(user=request.user),
+        RESERVATION_FIELDS,
+        None,
+        "reserved_at",
+        descending=True,
+    )
+    return JsonResponse({"results": items, "next": next_url})
+
+
+@require_GET
+@_login_required
+@cache_control(private=True, no_cache=True)
+@_condition(_history_etag)
+@_api_view
+def purchases(request):
+    """The current user's purchases, newest first."""
+    items, next_url = _rows(
+        request,
+        Purchase.objects.filter(user=request.user),
+        PURCHASE_FIELDS,
+        None,
+        "purchased_at",
+        descending=True,
+    )
+    return JsonResponse({"results": items, "next": next_url})
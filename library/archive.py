@@ -0,0 +1,326 @@
+"""
+Архив закрытых бронирований по месяцам.
+
+Таблица ``library_reservation`` растёт с каждой бронью, хотя почти все
+её строки — давно закрытые (возвращено, отменено, просрочено).
+:func:`archive_closed` (команда ``python manage.py archivereservations``)
+переносит закрытые бронирования старше ``LIBRARY_ARCHIVE_AFTER_DAYS``
+дней в таблицы ``library_reservation_archive_ГГГГ_ММ`` — по одной на
+месяц бронирования, — поэтому основная таблица остаётся размером с
+активные выдачи и недавнюю историю.
+
+Перенос идёт пачками по ``batch_size`` строк; каждая пачка — одна
+транзакция (``INSERT ... SELECT`` в архив и ``DELETE`` из основной
+таблицы), поэтому прерванный перенос ничего не теряет и не удваивает, а
+повторный запуск продолжает с того же места.  Таблица месяца создаётся
+при первом переносе в неё и записывается в реестр ``ArchivePartition``.
+Строки сохраняют свои ``id``: ``AUTOINCREMENT`` не выдаёт их снова.
+
+История пользователя (:func:`history_page`, страница «Мои бронирования»
+и ``/api/reservations/``) читает основную таблицу и все архивные одним
+запросом ``UNION ALL``, каждая ветвь — по индексу ``(user_id,
+reserved_at)``.  Пока архив пуст, история строится прежним ORM-запросом.
+Список таблиц архива хранится в кэше; реплика, снятая раньше, чем
+появилась самая новая таблица, для истории не используется.
+
+Внешних ключей у архивных таблиц нет: строки удалённых книг и
+пользователей удаляют сигналы (``library.signals``).  Счётчики
+``BookStats`` архив не меняет, а :mod:`library.stats` учитывает его при
+пересчёте.
+"""
+
+import time
+from datetime import date, timedelta, timezone as dt_timezone
+from typing import NamedTuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import DEFAULT_DB_ALIAS, connection, connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ArchivePartition, Book, Reservation
+from .replicas import COMMIT_MARGIN_NS, snapshot_times, use_primary
+
+TABLE_PREFIX = "library_reservation_archive_"
+COLUMNS = ("id", "user_id", "book_id", "reserved_at", "return_date", "status")
+CLOSED_STATUSES = ("returned", "cancelled", "expired")
+PARTITIONS_KEY = "library:archive:partitions"
+
+
+class Partition(NamedTuple):
+    month: date
+    table: str
+    created_ns: int
+
+
+def archive_after_days() -> int:
+    """Age of the closed reservations to archive (``LIBRARY_ARCHIVE_AFTER_DAYS``)."""
+    return getattr(settings, "LIBRARY_ARCHIVE_AFTER_DAYS", 180)
+
+
+def month_of(moment) -> date:
+    """First day of the UTC month of ``moment``: the partition it goes to."""
+    moment = moment.astimezone(dt_timezone.utc)
+    return date(moment.year, moment.month, 1)
+
+
+def table_name(month: date) -> str:
+    return f"{TABLE_PREFIX}{month:%Y_%m}"
+
+
+def _load_partitions() -> list:
+    rows = ArchivePartition.objects.values_list("month", "table", "created_at")
+    return [
+        Partition(month, table, int(created_at.timestamp() * 1_000_000_000))
+        for month, table, created_at in rows
+    ]
+
+
+def partitions() -> list:
+    """The archive tables as :class:`Partition` tuples, newest month first."""
+    found = cache.get(PARTITIONS_KEY)
+    if found is None:
+        with use_primary():
+            found = _load_partitions()
+        # add(): never overwrite the list _publish_partitions() has just set.
+        cache.add(PARTITIONS_KEY, found, None)
+    return found
+
+
+def _publish_partitions() -> None:
+    cache.set(PARTITIONS_KEY, _load_partitions(), None)
+
+
+def _quote(name: str) -> str:
+    return connection.ops.quote_name(name)
+
+
+def _create_table(table: str) -> None:
+    q = _quote
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {q(table)} ("
+            f"{q('id')} integer NOT NULL PRIMARY KEY, "
+            f"{q('user_id')} integer NOT NULL, "
+            f"{q('book_id')} bigint NOT NULL, "
+            f"{q('reserved_at')} datetime NOT NULL, "
+            f"{q('return_date')} date NULL, "
+            f"{q('status')} varchar(10) NOT NULL)"
+        )
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {q(table + '_user_date')} "
+            f"ON {q(table)} ({q('user_id')}, {q('reserved_at')})"
+        )
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {q(table + '_book')} "
+            f"ON {q(table)} ({q('book_id')})"
+        )
+
+
+def _ensure_partition(month: date) -> ArchivePartition:
+    """Registry row of ``month``, creating its table on first use."""
+    partition, created = ArchivePartition.objects.get_or_create(
+        month=month, defaults={"table": table_name(month)}
+    )
+    if created:
+        _create_table(partition.table)
+        transaction.on_commit(_publish_partitions)
+    return partition
+
+
+def candidates(now=None, days=None):
+    """Closed reservations old enough to be archived."""
+    days = archive_after_days() if days is None else days
+    cutoff = (now or timezone.now()) - timedelta(days=days)
+    return Reservation.objects.filter(
+        status__in=CLOSED_STATUSES, reserved_at__lt=cutoff
+    ).order_by()
+
+
+def archive_closed(now=None, days=None, batch_size: int = 500, pause: float = 0.0) -> int:
+    """
+    Move closed reservations older than ``days`` to the month tables, one
+    transaction per batch.  Returns how many rows were moved.
+    """
+    queryset = candidates(now, days)
+    hot = _quote(Reservation._meta.db_table)
+    columns = ", ".join(map(_quote, COLUMNS))
+    total = 0
+    while True:
+        with transaction.atomic():
+            batch = list(queryset.values_list("id", "reserved_at")[:batch_size])
+            by_month = {}
+            for pk, reserved_at in batch:
+                by_month.setdefault(month_of(reserved_at), []).append(pk)
+            with connection.cursor() as cursor:
+                for month, ids in sorted(by_month.items()):
+                    partition = _ensure_partition(month)
+                    marks = ", ".join(["%s"] * len(ids))
+                    cursor.execute(
+                        f"INSERT INTO {_quote(partition.table)} ({columns}) "
+                        f"SELECT {columns} FROM {hot} WHERE {_quote('id')} IN ({marks})",
+                        ids,
+                    )
+                    ArchivePartition.objects.filter(pk=partition.pk).update(
+                        rows=F("rows") + len(ids)
+                    )
+                    # Plain DELETE: the rows stay in the history, so none of
+                    # the Reservation signals should fire.
+                    cursor.execute(
+                        f"DELETE FROM {hot} WHERE {_quote('id')} IN ({marks})", ids
+                    )
+        total += len(batch)
+        if len(batch) < batch_size:
+            return total
+        if pause:
+            time.sleep(pause)
+
+
+def book_totals() -> dict:
+    """``{book_id: archived reservations}``; every archived one is closed."""
+    totals = {}
+    tables = ArchivePartition.objects.values_list("table", flat=True)
+    with connection.cursor() as cursor:
+        for table in tables:
+            cursor.execute(
+                f"SELECT {_quote('book_id')}, COUNT(*) FROM {_quote(table)} "
+                f"GROUP BY {_quote('book_id')}"
+            )
+            for book_id, count in cursor.fetchall():
+                totals[book_id] = totals.get(book_id, 0) + count
+    return totals
+
+
+def delete_archived(column: str, value) -> None:
+    """Delete the archived rows whose ``column`` (book_id/user_id) is ``value``."""
+    tables = ArchivePartition.objects.values_list("pk", "table")
+    with connection.cursor() as cursor:
+        for pk, table in tables:
+            cursor.execute(
+                f"DELETE FROM {_quote(table)} WHERE {_quote(column)} = %s", [value]
+            )
+            if cursor.rowcount:
+                ArchivePartition.objects.filter(pk=pk).update(
+                    rows=F("rows") - cursor.rowcount
+                )
+
+
+def _read_alias(found) -> str:
+    """
+    Where to read a merged history: the routed alias, unless it is a
+    replica copied before the newest archive table was created.
+    """
+    alias = router.db_for_read(Reservation)
+    if alias == DEFAULT_DB_ALIAS:
+        return alias
+    newest = max(partition.created_ns for partition in found)
+    snapshot = snapshot_times([alias]).get(alias)
+    if snapshot is None or snapshot < newest + COMMIT_MARGIN_NS:
+        return DEFAULT_DB_ALIAS
+    return alias
+
+
+class MergedHistory:
+    """
+    The reservations of ``user`` from the hot table and the archive
+    tables, newest first.  Supports ``count()`` and slicing, so it can be
+    handed to a :class:`~django.core.paginator.Paginator`.
+    """
+
+    def __init__(self, user, found=None, using=None):
+        self.user_id = user.pk
+        found = partitions() if found is None else found
+        self.tables = [Reservation._meta.db_table] + [p.table for p in found]
+        self.using = using or (_read_alias(found) if found else DEFAULT_DB_ALIAS)
+
+    def count(self) -> int:
+        q = connections[self.using].ops.quote_name
+        sql = "SELECT " + " + ".join(
+            f"(SELECT COUNT(*) FROM {q(table)} WHERE {q('user_id')} = %s)"
+            for table in self.tables
+        )
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(sql, [self.user_id] * len(self.tables))
+            return cursor.fetchone()[0]
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step is not None:
+            raise TypeError("MergedHistory supports only plain slices")
+        start = index.start or 0
+        if index.stop is None:
+            raise TypeError("MergedHistory needs a slice with a stop")
+        return self.rows(max(index.stop - start, 0), offset=start)
+
+    def rows(self, limit: int, offset: int = 0, before=None) -> list:
+        """
+        ``limit`` reservations after skipping ``offset``; with ``before``,
+        a ``(reserved_at, id)`` key, only the rows older than that key.
+        Each row has its book attached with only ``id`` and ``title``.
+        """
+        if limit <= 0:
+            return []
+        ops = connections[self.using].ops
+        q = ops.quote_name
+        columns = ", ".join(q(column) for column in COLUMNS)
+        order = f"{q('reserved_at')} DESC, {q('id')} DESC"
+        condition = ""
+        extra = []
+        if before is not None:
+            value, pk = before
+            value = ops.adapt_datetimefield_value(value)
+            condition = (
+                f" AND ({q('reserved_at')} < %s"
+                f" OR ({q('reserved_at')} = %s AND {q('id')} < %s))"
+            )
+            extra = [value, value, pk]
+        branches, params = [], []
+        for table in self.tables:
+            # Each branch stops after the rows the page can need, reading
+            # the (user_id, reserved_at) index backwards.
+            branches.append(
+                f"SELECT * FROM (SELECT {columns} FROM {q(table)} "
+                f"WHERE {q('user_id')} = %s{condition} ORDER BY {order} LIMIT %s)"
+            )
+            params += [self.user_id, *extra, offset + limit]
+        outer = ", ".join(f"h.{q(column)}" for column in COLUMNS)
+        sql = (
+            f"SELECT {outer}, b.{q('title')} AS {q('book_title')} "
+            f"FROM ({' UNION ALL '.join(branches)}) AS h "
+            f"INNER JOIN {q(Book._meta.db_table)} AS b ON b.{q('id')} = h.{q('book_id')} "
+            f"ORDER BY h.{q('reserved_at')} DESC, h.{q('id')} DESC LIMIT %s OFFSET %s"
+        )
+        params += [limit, offset]
+        rows = list(Reservation.objects.raw(sql, params, using=self.using))
+        for row in rows:
+            row.book = Book.from_db(
+                self.using, ["id", "title"], [row.book_id, row.book_title]
+            )
+        return rows
+
+
+def _per_page(per_page):
+    return per_page or getattr(settings, "LIBRARY_HISTORY_PAGE_SIZE", 50)
+
+
+def history_page(user, number=None, per_page=None, found=None):
+    """
+    One :class:`~django.core.paginator.Page` of ``user``'s reservations,
+    archived ones included.
+    """
+    found = partitions() if found is None else found
+    if not found:
+        return Reservation.objects.history_page(user, number, per_page)
+    return Paginator(MergedHistory(user, found), _per_page(per_page)).get_page(number)
+
+
+async def ahistory_page(user, number=None, per_page=None):
+    """Async :func:`history_page`."""
+    found = await cache.aget(PARTITIONS_KEY)
+    if found is None:
+        found = await sync_to_async(partitions)()
+    if not found:
+        return await Reservation.objects.ahistory_page(user, number, per_page)
+    return await sync_to_async(history_page)(user, number, per_page, found)
@@ -0,0 +1,91 @@
+"""
+Бэкенд аутентификации, который берёт пользователя из кэша.
+
+``AuthenticationMiddleware`` на каждом запросе вошедшего пользователя
+загружает его из ``auth_user`` по id из сессии.  ``CachedModelBackend``
+хранит объект ``User`` в кэше ``SESSION_CACHE_ALIAS`` (тот же, где лежат
+сессии ``cached_db``), поэтому при тёплом кэше ни сессия, ни пользователь
+не стоят ни одного SQL-запроса.
+
+Ключ записи включает метку пользователя, которую сигналы
+(``library.signals``) меняют после фиксации сохранения или удаления
+пользователя — в том числе смены пароля и обновления ``last_login`` при
+входе, — а также при выходе.  Метка читается раньше строки из базы,
+поэтому запрос, прочитавший строку до изменения, кладёт её под старой
+меткой, которую уже никто не спросит.  После смены пароля
+``django.contrib.auth`` сравнивает хэш в сессии со свежим объектом и
+разлогинивает остальные сессии, как и без кэша.  Изменения через
+``QuerySet.update()`` сигналов не вызывают: после них нужно вызвать
+:func:`forget_user`.
+
+В кэш кладётся только что прочитанный из базы объект, без
+закэшированных прав доступа, поэтому права проверяются как обычно.
+"""
+
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+
+USER_KEY = "library:user:{}:{}"
+# Kept on the shared tier only (SHARED_ONLY_PREFIXES), like the stamps
+# of library.caching.
+STAMP_KEY = "library:stamp:user:{}"
+USER_TIMEOUT = 3600
+
+
+def _cache():
+    return caches[settings.SESSION_CACHE_ALIAS]
+
+
+def forget_user(user_id) -> None:
+    """Make the cached ``User`` stale so the next request reads it again."""
+    _cache().set(STAMP_KEY.format(user_id), time.time_ns(), None)
+
+
+def user_key(user_id) -> str:
+    """The cache key of ``user_id``'s current row."""
+    key = STAMP_KEY.format(user_id)
+    stamp = _cache().get(key)
+    if stamp is None:
+        stamp = time.time_ns()
+        if not _cache().add(key, stamp, None):
+            stamp = _cache().get(key)
+    return USER_KEY.format(user_id, stamp)
+
+
+async def auser_key(user_id) -> str:
+    """Async :func:`user_key`."""
+    stamp = await _cache().aget(STAMP_KEY.format(user_id))
+    if stamp is None:
+        return await sync_to_async(user_key)(user_id)
+    return USER_KEY.format(user_id, stamp)
+
+
+class CachedModelBackend(ModelBackend):
+    """``ModelBackend`` whose ``get_user()`` reads through the cache."""
+
+    def get_user(self, user_id):
+        key = user_key(user_id)
+        user = _cache().get(key)
+        if user is None:
+            try:
+                user = get_user_model()._default_manager.get(pk=user_id)
+            except get_user_model().DoesNotExist:
+                return None
+            _cache().set(key, user, USER_TIMEOUT)
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        key = await auser_key(user_id)
+        user = await _cache().aget(key)
+        if user is None:
+            try:
+                user = await get_user_model()._default_manager.aget(pk=user_id)
+            except get_user_model().DoesNotExist:
+                return None
+            await _cache().aset(key, user, USER_TIMEOUT)
+        return user if self.user_can_authenticate(user) else None
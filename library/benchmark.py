@@ -0,0 +1,532 @@
+"""
+Нагрузочные замеры для страниц библиотеки.
+
+Модуль заполняет базу синтетическими данными нужного объёма, затем
+прогоняет все адреса из ``library/urls.py`` и смешанную нагрузку
+(чтение каталога вперемешку с бронированиями) двумя способами:
+
+* через тестовый клиент Django, по одному запросу, — чтобы посчитать
+  число SQL-запросов на страницу;
+* через WSGI-приложение из нескольких потоков или через
+  ASGI-приложение из нескольких задач в одном цикле событий (как под
+  uvicorn), без сети — чтобы получить задержки (p50/p95/p99) и
+  пропускную способность.
+
+Результат — словарь, который команда ``python manage.py benchmark``
+сохраняет в JSON как эталон и с которым сравнивает следующие прогоны.
+"""
+
+import asyncio
+import io
+import logging
+import math
+import os
+import random
+import statistics
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from decimal import Decimal
+from urllib.parse import urlencode
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Count, F
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from . import replicas, search, stats
+from .models import Book, Purchase, Reservation
+
+BENCH_PASSWORD = "bench-password"
+# Requests are addressed to a host that the default ALLOWED_HOSTS accepts.
+HOST = "localhost"
+
+
+def seed(books=1000, users=100, reservations=2000, purchases=500, rng=None):
+    """
+    Fill the (empty) database with a synthetic catalog and user history.
+    Every fifth book is VIP.  Reservations and purchases are spread
+    randomly over users; only the newest reservation per pair is active.
+    """
+    rng = rng or random.Random(0)
+    words = (
+        "война мир роман история любовь город море ночь дорога сад дом "
+        "зима лето весна осень река песня сон звезда ветер"
+    ).split()
+    Book.objects.bulk_create(
+        (
+            Book(
+                title=f"{rng.choice(words).capitalize()} {rng.choice(words)} {i}",
+                author=f"Автор {i % 97}",
+                description=" ".join(rng.choices(words, k=20)),
+                available_copies=1_000_000,
+                is_vip=i % 5 == 0,
+                price=Decimal("9.99") if i % 5 == 0 else None,
+            )
+            for i in range(books)
+        ),
+        batch_size=1000,
+    )
+    search.rebuild_index()
+    password = make_password(BENCH_PASSWORD)
+    User = get_user_model()
+    User.objects.bulk_create(
+        (User(username=f"bench{i}", password=password) for i in range(users)),
+        batch_size=1000,
+    )
+    user_ids = list(User.objects.values_list("pk", flat=True))
+    regular = list(Book.objects.filter(is_vip=False).values_list("pk", flat=True))
+    vip = list(Book.objects.filter(is_vip=True).values_list("pk", flat=True))
+
+    pairs = {}
+    for _ in range(reservations):
+        pairs.setdefault((rng.choice(user_ids), rng.choice(regular)), []).append(
+            rng.choice(["returned", "cancelled"])
+        )
+    rows = []
+    for (user_id, book_id), statuses in pairs.items():
+        statuses[-1] = "reserved"
+        rows += [Reservation(user_id=user_id, book_id=book_id, status=s) for s in statuses]
+    Reservation.objects.bulk_create(rows, batch_size=1000)
+
+    bought = set()
+    if vip:
+        bought = {(rng.choice(user_ids), rng.choice(vip)) for _ in range(purchases)}
+    Purchase.objects.bulk_create(
+        (Purchase(user_id=u, book_id=b, price=Decimal("9.99")) for u, b in bought),
+        batch_size=1000,
+    )
+    # bulk_create bypasses the counters; count them once.
+    stats.reconcile()
+
+
+class Scenario:
+    """A named route plus a function that builds a URL for one request."""
+
+    def __init__(self, name, url, login=False):
+        self.name = name
+        self.url = url
+        self.login = login
+
+
+def scenarios(rng):
+    """Return one :class:`Scenario` for every route in ``library/urls.py``."""
+    regular = list(Book.objects.filter(is_vip=False).values_list("pk", flat=True)[:500])
+    vip = list(Book.objects.filter(is_vip=True).values_list("pk", flat=True)[:500])
+    books = regular + vip
+    reservation_ids = list(
+        Reservation.objects.filter(status="reserved").values_list("pk", flat=True)[:500]
+    )
+
+    def pick(ids):
+        return rng.choice(ids or [0])
+
+    return [
+        Scenario("home", lambda: reverse("home")),
+        Scenario(
+            "search",
+            lambda: reverse("search")
+            + "?"
+            + urlencode({"q": rng.choice(["вой", "море", "сад ночь"])}),
+        ),
+        Scenario("popular", lambda: reverse("popular")),
+        Scenario("book_detail", lambda: reverse("book_detail", args=[pick(books)])),
+        # Only the snapshot: a long-lived stream would never finish.
+        Scenario(
+            "book_events",
+            lambda: reverse("book_events")
+            + "?"
+            + urlencode({"book": f"{pick(regular)},{pick(regular)}", "timeout": 0}),
+        ),
+        Scenario(
+            "reserve_book",
+            lambda: reverse("reserve_book", args=[pick(regular)]),
+            login=True,
+        ),
+        Scenario(
+            "purchase_book",
+            lambda: reverse("purchase_book", args=[pick(vip)]),
+            login=True,
+        ),
+        Scenario("user_reservations", lambda: reverse("user_reservations"), login=True),
+        Scenario("user_purchases", lambda: reverse("user_purchases"), login=True),
+        # Active reservations belong to random users, so these mostly hit
+        # the 404 path; they still exercise routing, auth and the lookup.
+        Scenario(
+            "cancel_reservation",
+            lambda: reverse("cancel_reservation", args=[pick(reservation_ids)]),
+            login=True,
+        ),
+        Scenario(
+            "return_book",
+            lambda: reverse("return_book", args=[pick(reservation_ids)]),
+            login=True,
+        ),
+        Scenario("register", lambda: reverse("register")),
+        Scenario("api_books", lambda: reverse("api_books")),
+        Scenario("api_book", lambda: reverse("api_book", args=[pick(books)])),
+        Scenario("api_reservations", lambda: reverse("api_reservations"), login=True),
+        Scenario("api_purchases", lambda: reverse("api_purchases"), login=True),
+    ]
+
+
+def mixed_scenario(rng, write_share=0.2):
+    """
+    Catalog and history reads interleaved with reservations, so readers
+    and writers hit the database at the same time.
+    """
+    routes = {scenario.name: scenario for scenario in scenarios(rng)}
+    reads = [
+        routes[name] for name in ("home", "search", "book_detail", "user_reservations")
+    ]
+    write = routes["reserve_book"]
+
+    def url():
+        if rng.random() < write_share:
+            return write.url()
+        return rng.choice(reads).url()
+
+    return Scenario("mixed", url, login=True)
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def count_queries(scenario, client, repeat=5):
+    """
+    Median number of SQL queries one request of ``scenario`` makes, on
+    the primary and the replicas together.
+    """
+    counts = []
+    for _ in range(repeat):
+        with ExitStack() as stack:
+            contexts = [
+                stack.enter_context(CaptureQueriesContext(connections[alias]))
+                for alias in connections
+            ]
+            client.get(scenario.url())
+        counts.append(sum(len(ctx) for ctx in contexts))
+    return int(statistics.median(counts))
+
+
+@contextmanager
+def replica_copies(count, directory, interval=1.0):
+    """
+    Route reads to ``count`` fresh copies of the (seeded) ``default``
+    database in ``directory``, refreshed every ``interval`` seconds by a
+    background thread, the way ``refreshreplicas`` does in production.
+    """
+    default = connections[DEFAULT_DB_ALIAS].settings_dict
+    aliases = [f"bench_replica{number}" for number in range(1, count + 1)]
+    for alias in aliases:
+        connections.settings[alias] = {
+            **default,
+            "NAME": os.path.join(directory, f"{alias}.sqlite3"),
+            "OPTIONS": {
+                key: value
+                for key, value in default["OPTIONS"].items()
+                if key != "transaction_mode"
+            },
+            "TEST": {**default["TEST"], "MIRROR": None},
+        }
+    stop = threading.Event()
+    try:
+        with override_settings(LIBRARY_READ_REPLICAS=aliases):
+            replicas.refresh()
+            refresher = threading.Thread(
+                target=replicas.refresh_periodically, args=(interval, stop)
+            )
+            refresher.start()
+            try:
+                yield aliases
+            finally:
+                stop.set()
+                refresher.join()
+    finally:
+        # Worker threads closed theirs; the next run reuses the aliases.
+        for alias in aliases:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+
+
+def _session_cookies(users):
+    """Log users in once and return their ``Cookie`` header values."""
+    cookies = []
+    for user in users:
+        client = Client(SERVER_NAME=HOST)
+        client.force_login(user)
+        cookies.append("; ".join(f"{k}={v.value}" for k, v in client.cookies.items()))
+    return cookies
+
+
+def _environ(path, cookie):
+    path, _, query = path.partition("?")
+    return {
+        "REQUEST_METHOD": "GET",
+        "PATH_INFO": path,
+        "QUERY_STRING": query,
+        "SERVER_NAME": HOST,
+        "SERVER_PORT": "80",
+        "HTTP_HOST": HOST,
+        "HTTP_COOKIE": cookie,
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": "http",
+        "wsgi.input": io.BytesIO(),
+        "wsgi.errors": io.StringIO(),
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+
+
+def load(scenario, handler, cookies, requests=200, threads=4):
+    """
+    Fire ``requests`` GETs of ``scenario`` at the WSGI ``handler`` from
+    ``threads`` threads and return latency samples, errors and throughput.
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    per_thread = max(1, requests // threads)
+
+    def worker(seed):
+        rng = random.Random(seed)
+        local, failed = [], 0
+        try:
+            for _ in range(per_thread):
+                cookie = rng.choice(cookies) if scenario.login else ""
+                environ = _environ(scenario.url(), cookie)
+                started = time.perf_counter()
+                status = []
+                body = handler(environ, lambda s, h, exc_info=None: status.append(s))
+                for _chunk in body:
+                    pass
+                if hasattr(body, "close"):
+                    body.close()
+                local.append((time.perf_counter() - started) * 1000)
+                if status and status[0].startswith("5"):
+                    failed += 1
+        finally:
+            connections.close_all()
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return latencies, errors[0], len(latencies) / elapsed if elapsed else 0.0
+
+
+def _scope(path, cookie):
+    path, _, query = path.partition("?")
+    headers = [(b"host", HOST.encode())]
+    if cookie:
+        headers.append((b"cookie", cookie.encode("latin-1")))
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode("latin-1"),
+        "root_path": "",
+        "headers": headers,
+        "client": ("127.0.0.1", 50000),
+        "server": (HOST, 80),
+    }
+
+
+def aload(scenario, application, cookies, requests=200, concurrency=4):
+    """
+    Like :func:`load`, but for an ASGI ``application``: ``concurrency``
+    tasks share one event loop, the way uvicorn serves connections.
+    """
+    latencies = []
+    errors = 0
+
+    def receiver():
+        messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            # The client never disconnects; Django cancels this wait
+            # once the response is sent.
+            await asyncio.Future()
+
+        return receive
+
+    async def worker(seed):
+        nonlocal errors
+        rng = random.Random(seed)
+        for _ in range(max(1, requests // concurrency)):
+            cookie = rng.choice(cookies) if scenario.login else ""
+            status = []
+
+            async def send(message, status=status):
+                if message["type"] == "http.response.start":
+                    status.append(message["status"])
+
+            started = time.perf_counter()
+            await application(_scope(scenario.url(), cookie), receiver(), send)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if status and status[0] >= 500:
+                errors += 1
+
+    async def main():
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+
+    started = time.perf_counter()
+    asyncio.run(main())
+    elapsed = time.perf_counter() - started
+    return latencies, errors, len(latencies) / elapsed if elapsed else 0.0
+
+
+def run(requests=200, threads=4, names=None, rng=None, write_share=0.2, server="wsgi"):
+    """
+    Measure every scenario and return the results as a dict.  ``server``
+    is ``"wsgi"`` (a thread per client) or ``"asgi"`` (``threads``
+    concurrent tasks on one event loop).
+    """
+    rng = rng or random.Random(1)
+    users = list(get_user_model().objects.filter(username__startswith="bench")[:20])
+    cookies = _session_cookies(users)
+    client = Client(SERVER_NAME=HOST)
+    client.force_login(users[0])
+    anonymous = Client(SERVER_NAME=HOST)
+    if server == "asgi":
+        handler, loader = ASGIHandler(), aload
+    else:
+        handler, loader = WSGIHandler(), load
+    results = {}
+    # Expected 404s would otherwise flood the output with warnings.
+    request_logger = logging.getLogger("django.request")
+    previous_level = request_logger.level
+    request_logger.setLevel(logging.ERROR)
+    try:
+        for scenario in scenarios(rng) + [mixed_scenario(rng, write_share)]:
+            if names and scenario.name not in names:
+                continue
+            results[scenario.name] = _measure(
+                scenario,
+                client if scenario.login else anonymous,
+                loader,
+                handler,
+                cookies,
+                requests,
+                threads,
+            )
+    finally:
+        request_logger.setLevel(previous_level)
+    return results
+
+
+def _measure(scenario, client, loader, handler, cookies, requests, threads):
+    queries = count_queries(scenario, client)
+    latencies, errors, rps = loader(scenario, handler, cookies, requests, threads)
+    return {
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "queries": queries,
+        "rps": round(rps, 1),
+        "errors": errors,
+    }
+
+
+def read_throughput(readers=4, seconds=3.0):
+    """
+    Database-bound reads routed like a request's (see ``library.replicas``)
+    from ``readers`` threads, while one more thread keeps rewriting the
+    catalog on the primary in long transactions.  Returns a result row
+    like :func:`run` does, named ``replica_reads`` by the command.
+
+    SQLite runs the query without the GIL, so reads spread over replicas
+    scale with the CPU cores; even on one core they stop queueing behind
+    the writer's locks on the primary file.
+    """
+    stop = threading.Event()
+    latencies = []
+    lock = threading.Lock()
+
+    def read():
+        return list(
+            Reservation.objects.values("book")
+            .annotate(total=Count("pk"))
+            .order_by("-total")[:20]
+        )
+
+    def reader():
+        local = []
+        try:
+            while not stop.is_set():
+                with replicas.routing():
+                    started = time.perf_counter()
+                    read()
+                local.append((time.perf_counter() - started) * 1000)
+        finally:
+            connections.close_all()
+        with lock:
+            latencies.extend(local)
+
+    def writer():
+        try:
+            while not stop.is_set():
+                with transaction.atomic():
+                    Book.objects.update(available_copies=F("available_copies"))
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    stop.wait(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return {
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "queries": 1,
+        "rps": round(len(latencies) / seconds, 1),
+        "errors": 0,
+    }
+
+
+def compare(baseline, current, tolerance=0.25):
+    """
+    Return human-readable regressions of ``current`` against ``baseline``:
+    p95 latency above ``baseline * (1 + tolerance)``, more queries per
+    request, or new server errors.
+    """
+    problems = []
+    for name, base in baseline.items():
+        now = current.get(name)
+        if now is None:
+            continue
+        if now["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            problems.append(f"{name}: p95 {base['p95_ms']} → {now['p95_ms']} мс")
+        if now["queries"] > base["queries"]:
+            problems.append(f"{name}: запросов {base['queries']} → {now['queries']}")
+        if now["errors"] > base.get("errors", 0):
+            problems.append(f"{name}: ошибок {base.get('errors', 0)} → {now['errors']}")
+    return problems
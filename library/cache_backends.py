@@ -0,0 +1,281 @@
+"""
+Двухуровневый кэш без внешних сервисов.
+
+Первый уровень — LRU-словарь в памяти процесса с ограничением по числу
+записей и по объёму.  Второй — файловый кэш Django на общем диске,
+который видят все рабочие процессы.  Чтение сначала идёт в память,
+промах подтягивает значение с диска; запись идёт в оба уровня.
+
+Записи первого уровня живут не дольше ``LOCAL_TIMEOUT`` секунд: так
+изменение, сделанное другим процессом, становится видно здесь с
+ограниченной задержкой.  Для ключей, которые должны обновляться сразу,
+используйте версионированные ключи (см. ``library.caching``).  Сами
+метки версий первый уровень не хранит: ключи, начинающиеся с одного из
+``SHARED_ONLY_PREFIXES``, всегда читаются с диска.
+
+Пример настройки::
+
+    CACHES = {
+        "default": {
+            "BACKEND": "library.cache_backends.TieredCache",
+            "LOCATION": BASE_DIR / "cache",
+            "OPTIONS": {
+                "LOCAL_MAX_ENTRIES": 5000,
+                "LOCAL_MAX_BYTES": 32 * 1024 * 1024,
+                "LOCAL_TIMEOUT": 5,
+                "SHARED_ONLY_PREFIXES": ("library:stamp:",),
+                "MAX_ENTRIES": 100000,
+            },
+        }
+    }
+"""
+
+import os
+import pickle
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.files import locks
+
+
+class LocalLRU:
+    """
+    Thread-safe LRU of pickled values bounded by entry count and bytes.
+    Values are kept pickled so callers never share mutable objects.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()  # key -> (expires_at, pickled)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return ``(found, pickled)``."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return False, None
+            expires_at, pickled = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._pop(key)
+                return False, None
+            self._data.move_to_end(key)
+            return True, pickled
+
+    def set(self, key, pickled: bytes, ttl):
+        if len(pickled) > self.max_bytes:
+            self.delete(key)
+            return
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._pop(key)
+            self._data[key] = (expires_at, pickled)
+            self._bytes += len(pickled)
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._data))
+                self._pop(oldest)
+
+    def delete(self, key):
+        with self._lock:
+            return self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def _pop(self, key) -> bool:
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return False
+        self._bytes -= len(entry[1])
+        return True
+
+
+# Held while an expired entry is replaced by add(); see TieredCache.add.
+ADD_LOCK = "add.lock"
+
+
+def _made_key(key, key_prefix, version):
+    return key
+
+
+class TieredCache(BaseCache):
+    """Per-process LRU in front of a shared file-based cache."""
+
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self.local_timeout = options.get("LOCAL_TIMEOUT", 5)
+        self.local = LocalLRU(
+            max_entries=options.get("LOCAL_MAX_ENTRIES", 5000),
+            max_bytes=options.get("LOCAL_MAX_BYTES", 32 * 1024 * 1024),
+        )
+        self.shared_only = tuple(options.get("SHARED_ONLY_PREFIXES", ()))
+        # Keys reach the shared tier already prefixed and versioned.
+        self.shared = FileBasedCache(
+            location, {**params, "KEY_FUNCTION": _made_key}
+        )
+
+    # Helpers -------------------------------------------------------------
+
+    def _local_ttl(self, timeout):
+        """Keep a local copy no longer than the value itself lives."""
+        expiry = self.get_backend_timeout(timeout)
+        if expiry is None:
+            return self.local_timeout
+        return max(0, min(self.local_timeout, expiry - time.time()))
+
+    def _is_local(self, key) -> bool:
+        """Whether copies of ``key`` (as given by the caller) are kept locally."""
+        return not key.startswith(self.shared_only)
+
+    def _remember(self, key, value, timeout):
+        pickled = pickle.dumps(value, self.pickle_protocol)
+        self.local.set(key, pickled, self._local_ttl(timeout))
+
+    def _read_shared(self, key):
+        """Return ``(pickled, expiry)`` from the shared tier, or ``None``."""
+        fname = self.shared._key_to_file(key)
+        try:
+            with open(fname, "rb") as f:
+                expiry = pickle.load(f)
+                if expiry is not None and expiry < time.time():
+                    return None
+                return zlib.decompress(f.read()), expiry
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError, zlib.error):
+            return None
+
+    # Cache API -----------------------------------------------------------
+
+    def get(self, key, default=None, version=None):
+        local = self._is_local(key)
+        key = self.make_and_validate_key(key, version=version)
+        if local:
+            found, pickled = self.local.get(key)
+            if found:
+                return pickle.loads(pickled)
+        entry = self._read_shared(key)
+        if entry is None:
+            return default
+        pickled, expiry = entry
+        if local:
+            ttl = self.local_timeout
+            if expiry is not None:
+                ttl = max(0, min(ttl, expiry - time.time()))
+            self.local.set(key, pickled, ttl)
+        return pickle.loads(pickled)
+
+    async def aget(self, key, default=None, version=None):
+        """
+        Answer local hits on the event loop; only a miss pays for the
+        thread hop that reading the shared tier needs.
+        """
+        made_key = self.make_and_validate_key(key, version=version)
+        if not self._is_local(key):
+            # A stamp is a few bytes of a local file: reading it here is
+            # cheaper than the thread hop.
+            entry = self._read_shared(made_key)
+            return default if entry is None else pickle.loads(entry[0])
+        found, pickled = self.local.get(made_key)
+        if found:
+            return pickle.loads(pickled)
+        get = sync_to_async(self.get, thread_sensitive=False)
+        return await get(key, default, version)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local = self._is_local(key)
+        key = self.make_and_validate_key(key, version=version)
+        self.shared.set(key, value, timeout)
+        if local:
+            self._remember(key, value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+        Atomic across processes: the file is created with ``os.link``,
+        which fails if another worker got there first.  This is what makes
+        the cache usable for stampede locks.  An expired entry is replaced
+        under an exclusive file lock, so of several workers that find it
+        expired only one gets to add.
+        """
+        local = self._is_local(key)
+        key = self.make_and_validate_key(key, version=version)
+        fname = self.shared._key_to_file(key)
+        self.shared._createdir()
+        fd, tmp_path = tempfile.mkstemp(dir=self.shared._dir)
+        try:
+            with open(fd, "wb") as f:
+                self.shared._write_content(f, timeout, value)
+            try:
+                os.link(tmp_path, fname)
+            except FileExistsError:
+                if not self._replace_expired(tmp_path, fname):
+                    return False
+            if local:
+                self._remember(key, value, timeout)
+            return True
+        finally:
+            os.remove(tmp_path)
+
+    def _replace_expired(self, tmp_path, fname) -> bool:
+        """
+        Link ``tmp_path`` in place of ``fname`` if that entry has expired.
+        Without the lock, two workers could both see it expired and the
+        second could delete the entry the first had just added.
+        """
+        with open(os.path.join(self.shared._dir, ADD_LOCK), "ab") as lock:
+            locks.lock(lock, locks.LOCK_EX)
+            try:
+                if self._is_live(fname):
+                    return False
+                try:
+                    os.remove(fname)
+                except FileNotFoundError:
+                    pass
+                try:
+                    # An add() that found no file at all may still win.
+                    os.link(tmp_path, fname)
+                except FileExistsError:
+                    return False
+                return True
+            finally:
+                locks.unlock(lock)
+
+    def _is_live(self, fname) -> bool:
+        # Unlike FileBasedCache._is_expired(), never deletes: the path may
+        # name a fresh entry by the time an expired one would be removed.
+        try:
+            with open(fname, "rb") as f:
+                expiry = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return False
+        return expiry is None or expiry >= time.time()
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self.local.delete(key)
+        return self.shared.touch(key, timeout)
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self.local.delete(key)
+        return self.shared._delete(self.shared._key_to_file(key))
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        found, _ = self.local.get(key)
+        return found or self._is_live(self.shared._key_to_file(key))
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
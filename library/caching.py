@@ -0,0 +1,229 @@
+"""
+Вспомогательные функции кэширования для приложения библиотеки.
+
+* Версии книг.  У каждой книги в кэше лежит метка версии, которая
+  меняется при любом изменении книги (сигналы и ``inventory``).  Ключи
+  производных данных — карточек, самих объектов ``Book`` — включают эту
+  версию, поэтому устаревшие значения не нужно удалять: их просто
+  перестают спрашивать.  Дополнительно меняется общее «поколение»
+  каталога, по которому можно быстро понять, что не изменилось ничего.
+  Метки (ключи ``library:stamp:``) не копируются в память процесса
+  (``SHARED_ONLY_PREFIXES`` в настройках кэша), поэтому новую метку
+  сразу видят все рабочие процессы.
+
+* Версия истории пользователя меняется при любом изменении его
+  бронирований и покупок; по ней API отвечает ``304 Not Modified``.
+
+* Защита от «набега» (cache stampede).  :func:`get_or_compute` хранит
+  вместе со значением время его вычисления и заранее, с небольшой
+  вероятностью, пересчитывает значение до истечения срока (алгоритм
+  XFetch).  Если значения нет совсем, считать его идёт только тот, кто
+  взял блокировку через атомарный ``cache.add``; остальные коротко ждут
+  готового результата.
+"""
+
+import math
+import random
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.http import Http404
+
+from .models import Book
+from .replicas import use_primary
+
+VERSION_KEY = "library:stamp:book:{}"
+GENERATION_KEY = "library:stamp:catalog"
+BOOK_KEY = "library:book:{}:{}"
+HISTORY_VERSION_KEY = "library:stamp:history:{}"
+
+BOOK_TIMEOUT = 300
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 2.0
+LOCK_POLL = 0.01
+# How eagerly XFetch recomputes before expiry; 1.0 is the usual choice.
+EARLY_RECOMPUTE_BETA = 1.0
+
+
+def _new_version() -> int:
+    return time.time_ns()
+
+
+def bump_book_version(book_id: int) -> None:
+    """Mark everything cached for ``book_id`` as stale."""
+    bump_book_versions([book_id])
+
+
+def bump_book_versions(book_ids) -> None:
+    """Mark everything cached for several books as stale in one call."""
+    versions = {VERSION_KEY.format(pk): _new_version() for pk in book_ids}
+    if versions:
+        # The generation goes first: whoever sees a new version then
+        # sees the new generation too (library.cards relies on it).
+        cache.set_many({GENERATION_KEY: _new_version(), **versions}, None)
+
+
+def bump_catalog_generation() -> None:
+    """Mark the catalog as changed without touching any book's version."""
+    cache.set(GENERATION_KEY, _new_version(), None)
+
+
+def catalog_generation() -> int:
+    """A stamp that changes whenever any book changes."""
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        generation = _new_version()
+        cache.add(GENERATION_KEY, generation, None)
+    return generation
+
+
+async def acatalog_generation() -> int:
+    """Async :func:`catalog_generation`."""
+    generation = await cache.aget(GENERATION_KEY)
+    if generation is None:
+        generation = await sync_to_async(catalog_generation)()
+    return generation
+
+
+def book_versions(book_ids) -> dict:
+    """
+    Return ``{book_id: version}``.  A book without a stored version gets
+    a fresh one, so a value cached before the version was evicted can
+    never be served again.
+    """
+    keys = {VERSION_KEY.format(pk): pk for pk in book_ids}
+    found = cache.get_many(keys)
+    versions = {keys[key]: value for key, value in found.items()}
+    missing = {key: _new_version() for key, pk in keys.items() if pk not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update({keys[key]: value for key, value in missing.items()})
+    return versions
+
+
+def book_version(book_id: int) -> int:
+    return book_versions([book_id])[book_id]
+
+
+async def abook_version(book_id: int) -> int:
+    """Async :func:`book_version`."""
+    version = await cache.aget(VERSION_KEY.format(book_id))
+    if version is None:
+        version = await sync_to_async(book_version)(book_id)
+    return version
+
+
+def bump_history_version(user_id: int) -> None:
+    """Mark ``user_id``'s reservations and purchases as changed."""
+    cache.set(HISTORY_VERSION_KEY.format(user_id), _new_version(), None)
+
+
+def history_version(user_id: int) -> int:
+    """A stamp that changes whenever the user's history changes."""
+    key = HISTORY_VERSION_KEY.format(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = _new_version()
+        cache.add(key, version, None)
+    return version
+
+
+def _is_fresh(entry) -> bool:
+    """
+    XFetch: report a value as stale early, with a probability that grows
+    as the expiry approaches and with how expensive the value was.
+    """
+    value, delta, expires_at = entry
+    early = delta * EARLY_RECOMPUTE_BETA * -math.log(1.0 - random.random())
+    return time.time() + early < expires_at
+
+
+def get_or_compute(key: str, compute, timeout: int):
+    """
+    Return the cached value for ``key`` or compute and store it, making
+    sure that only one worker recomputes a missing value at a time.
+    """
+    entry = cache.get(key)
+    if entry is not None:
+        if _is_fresh(entry):
+            return entry[0]
+        lock = _take_lock(key)
+        if lock is None:
+            return entry[0]  # somebody else is already refreshing it
+        return _compute_and_store(key, compute, timeout, lock)
+
+    lock = _take_lock(key)
+    if lock is not None:
+        return _compute_and_store(key, compute, timeout, lock)
+    deadline = time.monotonic() + LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[0]
+    # The lock holder is too slow; do not keep the request waiting.
+    with use_primary():
+        return compute()
+
+
+def _take_lock(key):
+    """
+    Take the recompute lock of ``key`` and return what releases it, or
+    ``None`` if another worker holds it.
+    """
+    token = uuid.uuid4().hex
+    expires = time.monotonic() + LOCK_TIMEOUT
+    if cache.add(key + ":lock", token, LOCK_TIMEOUT):
+        return token, expires
+    return None
+
+
+def _release_lock(key, lock) -> None:
+    token, expires = lock
+    # A slow recompute outlives its lock, which another worker may hold
+    # by now: release only our own.
+    if time.monotonic() < expires and cache.get(key + ":lock") == token:
+        cache.delete(key + ":lock")
+
+
+def _compute_and_store(key, compute, timeout, lock):
+    try:
+        started = time.time()
+        # A replica may lag behind the version in ``key``.
+        with use_primary():
+            value = compute()
+        delta = time.time() - started
+        cache.set(key, (value, delta, time.time() + timeout), timeout)
+        return value
+    finally:
+        _release_lock(key, lock)
+
+
+def get_book(pk: int) -> Book:
+    """
+    Cached ``get_object_or_404(Book, pk=pk)``.  The key carries the book
+    version, so a reservation or an admin edit is visible immediately.
+    """
+    key = BOOK_KEY.format(pk, book_version(pk))
+    book = get_or_compute(key, lambda: Book.objects.filter(pk=pk).first(), BOOK_TIMEOUT)
+    if book is None:
+        raise Http404("Книга не найдена.")
+    return book
+
+
+async def aget_book(pk: int) -> Book:
+    """
+    Async :func:`get_book`.  A fresh cached copy is served from the event
+    loop; a miss, an early refresh or a missing version falls back to
+    :func:`get_book` in a worker thread.
+    """
+    version = await cache.aget(VERSION_KEY.format(pk))
+    if version is not None:
+        entry = await cache.aget(BOOK_KEY.format(pk, version))
+        if entry is not None and _is_fresh(entry):
+            if entry[0] is None:
+                raise Http404("Книга не найдена.")
+            return entry[0]
+    return await sync_to_async(get_book)(pk)
@@ -0,0 +1,117 @@
+"""
+Кэширование карточек книг в каталоге.
+
+Каждая карточка из ``home.html`` рендерится один раз и кладётся в кэш
+под ключом ``(id книги, версия)``; версии книг ведёт ``library.caching``.
+Старые карточки просто перестают запрашиваться и вытесняются из кэша
+сами, поэтому перерисовываются только изменившиеся книги.
+
+Книги, прочитанные с реплики (``library.replicas``), могут быть старше
+версии, под которой легла бы их карточка.  Такая карточка отдаётся, но
+в кэш попадает, только если копия реплики снята позже, чем появилась
+версия книги.
+
+Поколение каталога читается до строк книг.  Если к моменту чтения
+версий оно сменилось, книга могла измениться после чтения строк, и
+нарисованные карточки в кэш не кладутся.
+
+Сетка каталога собирается из готовых кусков двумя обращениями к кэшу:
+одно за версиями, второе за карточками.  Пока общее «поколение»
+каталога не менялось, процесс отдаёт уже собранную сетку из своей
+памяти, сделав всего одно обращение к кэшу.
+"""
+
+import threading
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .caching import book_versions, catalog_generation
+from .replicas import COMMIT_MARGIN_NS, snapshot_times
+
+CARD_TEMPLATE = "library/_book_card.html"
+CARD_KEY = "library:card:{}:{}"
+
+# Rendered cards do not expire on their own; a new version replaces them.
+CARD_TIMEOUT = None
+
+# Assembled grids of this process keyed by (generation, book ids).
+GRID_MEMO_SIZE = 64
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+_grids = OrderedDict()
+
+
+def stats() -> dict:
+    """Return a snapshot of the card cache hit and miss counters."""
+    with _lock:
+        return dict(_stats)
+
+
+def reset_stats() -> None:
+    """Zero the counters and forget this process's assembled grids."""
+    with _lock:
+        _stats["hits"] = _stats["misses"] = 0
+        _grids.clear()
+
+
+def render_cards(books) -> str:
+    """Return the HTML of all ``books`` cards, rendering only cache misses."""
+    # Read before the rows: any change made after this bumps it.
+    generation = catalog_generation()
+    books = list(books)
+    if not books:
+        return ""
+    memo_key = (generation, tuple(book.pk for book in books))
+    with _lock:
+        grid = _grids.get(memo_key)
+        if grid is not None:
+            _grids.move_to_end(memo_key)
+            _stats["hits"] += len(books)
+            return grid
+    versions = book_versions(book.pk for book in books)
+    keys = [CARD_KEY.format(book.pk, versions[book.pk]) for book in books]
+    cached = cache.get_many(keys)
+    rendered = {}
+    for book, key in zip(books, keys):
+        if key not in cached:
+            rendered[key] = render_to_string(CARD_TEMPLATE, {"book": book})
+    if catalog_generation() == generation:
+        cacheable = _cacheable(books, keys, versions, rendered)
+    else:
+        # A book changed after the rows were read, so a version may be
+        # newer than the row it would label.
+        cacheable = {}
+    if cacheable:
+        cache.set_many(cacheable, CARD_TIMEOUT)
+    grid = mark_safe("".join(cached.get(key) or rendered[key] for key in keys))
+    with _lock:
+        _stats["hits"] += len(books) - len(rendered)
+        _stats["misses"] += len(rendered)
+        if len(cacheable) == len(rendered):
+            _grids[memo_key] = grid
+            while len(_grids) > GRID_MEMO_SIZE:
+                _grids.popitem(last=False)
+    return grid
+
+
+def _cacheable(books, keys, versions, rendered) -> dict:
+    """The ``rendered`` cards that were not drawn from a lagging replica."""
+    aliases = {book._state.db for book in books} - {DEFAULT_DB_ALIAS, None}
+    if not aliases:
+        return rendered
+    snapshots = snapshot_times(aliases)
+    return {
+        key: html
+        for book, key in zip(books, keys)
+        if (html := rendered.get(key)) is not None
+        and (
+            book._state.db in (DEFAULT_DB_ALIAS, None)
+            or versions[book.pk] + COMMIT_MARGIN_NS
+            < snapshots.get(book._state.db, 0)
+        )
+    }
@@ -0,0 +1,278 @@
+"""
+Поток изменений наличия книг (server-sent events).
+
+Страница книги подписывается на ``/books/events/?book=<id>`` (можно
+передать несколько ``book``) и получает событие ``availability`` при
+каждом изменении ``available_copies`` вместо того, чтобы обновлять
+страницу.
+
+Как события доходят до подписчиков:
+
+* ``library.inventory`` в транзакции, которая меняет число экземпляров
+  (бронирование, отмена, возврат, истечение срока), вызывает
+  :func:`publish`: тот добавляет строку ``AvailabilityEvent`` и после
+  фиксации будит брокеров своего процесса.
+* У каждого цикла событий процесса свой :class:`Broker`.  Пока у него
+  есть подписчики, он читает новые строки ``AvailabilityEvent`` —
+  сразу, если его разбудили, и раз в ``LIBRARY_EVENTS_POLL_INTERVAL``
+  секунд, чтобы увидеть изменения из других процессов.  Одно чтение на
+  процесс, а не на соединение.  Номера строк растут в порядке фиксации:
+  SQLite пишет транзакции по одной.
+* Строки старше ``RETENTION`` секунд удаляет сам :func:`publish` — не
+  чаще раза в ``PRUNE_EVERY`` секунд на процесс, — поэтому таблица не
+  растёт, даже если потоки никто не слушает.
+* Каждому подписчику достаются только новые значения его книг.  Значения
+  перезаписывают друг друга, поэтому медленный клиент получает последнее
+  число экземпляров, а очередь не растёт.
+
+Соединение — это асинхронный генератор и небольшой объект подписчика в
+цикле событий, без отдельного потока, поэтому поток нужно отдавать через
+ASGI.  Соединение живёт не дольше ``LIBRARY_EVENTS_MAX_AGE`` секунд,
+после чего браузер сам переподключается и получает свежий снимок; с
+``?timeout=0`` ответ содержит только снимок.
+
+Под WSGI Django дочитывает асинхронный ответ целиком, прежде чем
+отправить первый байт, и всё это время держит рабочий процесс.  Поэтому
+вне ASGI (:func:`streams_supported`) ответ всегда содержит только снимок,
+а страница книги не подписывается на поток.
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import threading
+import time
+import weakref
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.utils import timezone
+
+from .models import AvailabilityEvent, Book
+
+logger = logging.getLogger("library.events")
+
+# How long a browser waits before reconnecting, in milliseconds.
+RETRY_MS = 5000
+# A comment line this often keeps proxies from closing an idle stream.
+HEARTBEAT = 15.0
+MAX_BOOKS = 50
+# Events are kept this many seconds for the other processes to read.
+RETENTION = 600
+PRUNE_EVERY = 60.0
+
+_brokers = weakref.WeakKeyDictionary()  # event loop -> Broker
+_brokers_lock = threading.Lock()
+_prune_lock = threading.Lock()
+_pruned_at = None  # time.monotonic() of this process's last prune
+
+
+def poll_interval() -> float:
+    return getattr(settings, "LIBRARY_EVENTS_POLL_INTERVAL", 1.0)
+
+
+def max_age() -> float:
+    return getattr(settings, "LIBRARY_EVENTS_MAX_AGE", 300)
+
+
+def streams_supported(request) -> bool:
+    """Whether ``request`` is served by ASGI, which can hold a stream open."""
+    return isinstance(request, ASGIRequest)
+
+
+def publish(book_ids) -> None:
+    """
+    Record that the availability of ``book_ids`` changed.  Call it inside
+    the transaction that makes the change.
+    """
+    AvailabilityEvent.objects.bulk_create(
+        AvailabilityEvent(book_id=pk) for pk in book_ids
+    )
+    transaction.on_commit(wake_all)
+    if _prune_due():
+        transaction.on_commit(prune)
+
+
+def _prune_due() -> bool:
+    global _pruned_at
+    now = time.monotonic()
+    with _prune_lock:
+        if _pruned_at is not None and now - _pruned_at < PRUNE_EVERY:
+            return False
+        _pruned_at = now
+        return True
+
+
+def wake_all() -> None:
+    """Make every broker of this process read the new events now."""
+    with _brokers_lock:
+        found = list(_brokers.items())
+    for loop, hub in found:
+        try:
+            loop.call_soon_threadsafe(hub.wake)
+        except RuntimeError:
+            pass  # the loop is closed
+
+
+def latest_id() -> int:
+    return (
+        AvailabilityEvent.objects.order_by("-id").values_list("id", flat=True).first()
+        or 0
+    )
+
+
+def availability(book_ids) -> dict:
+    """``{book_id: available_copies}`` of the existing books in ``book_ids``."""
+    if not book_ids:
+        return {}
+    return dict(
+        Book.objects.filter(pk__in=book_ids).values_list("pk", "available_copies")
+    )
+
+
+def changes_since(last_id: int, book_ids):
+    """
+    The current availability of the books in ``book_ids`` that changed
+    after event ``last_id``, and the id of the newest event.
+    """
+    rows = list(
+        AvailabilityEvent.objects.filter(id__gt=last_id)
+        .order_by("id")
+        .values_list("id", "book_id")
+    )
+    if not rows:
+        return {}, last_id
+    changed = {book_id for _, book_id in rows if book_id in book_ids}
+    return availability(changed), rows[-1][0]
+
+
+def prune(now=None) -> int:
+    """Delete the events older than :data:`RETENTION` seconds."""
+    cutoff = (now or timezone.now()) - timedelta(seconds=RETENTION)
+    deleted, _ = AvailabilityEvent.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
+
+
+class Subscriber:
+    """One stream: its books and the latest values not yet sent."""
+
+    __slots__ = ("books", "pending", "ready")
+
+    def __init__(self, books):
+        self.books = frozenset(books)
+        self.pending = {}
+        self.ready = asyncio.Event()
+
+    def push(self, changes: dict) -> None:
+        for pk, copies in changes.items():
+            if pk in self.books:
+                self.pending[pk] = copies
+                self.ready.set()
+
+    def take(self) -> dict:
+        pending, self.pending = self.pending, {}
+        self.ready.clear()
+        return pending
+
+
+class Broker:
+    """Reads the new events for the subscribers of one event loop."""
+
+    def __init__(self):
+        self.subscribers = set()
+        self.last_id = 0
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    async def subscribe(self, books) -> Subscriber:
+        subscriber = Subscriber(books)
+        async with self._lock:
+            if self._task is None:
+                # Read before the caller's snapshot, so that no change
+                # made after the snapshot can be skipped.
+                self.last_id = await sync_to_async(latest_id)()
+                # A fresh context: the poller must not inherit the
+                # routing state or the timings of the first request.
+                self._task = asyncio.get_running_loop().create_task(
+                    self._run(), context=contextvars.Context()
+                )
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self.subscribers.discard(subscriber)
+        if not self.subscribers and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while self.subscribers:
+            try:
+                await asyncio.wait_for(self._wake.wait(), poll_interval())
+            except TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.poll()
+            except Exception:
+                logger.exception("Reading availability events failed")
+
+    async def poll(self) -> None:
+        books = set().union(*(subscriber.books for subscriber in self.subscribers))
+        changes, self.last_id = await sync_to_async(changes_since)(self.last_id, books)
+        for subscriber in list(self.subscribers):
+            subscriber.push(changes)
+
+
+def broker() -> Broker:
+    """The :class:`Broker` of the running event loop."""
+    loop = asyncio.get_running_loop()
+    with _brokers_lock:
+        hub = _brokers.get(loop)
+        if hub is None:
+            hub = _brokers[loop] = Broker()
+    return hub
+
+
+def _event(pk: int, copies: int) -> str:
+    data = json.dumps({"book": pk, "available_copies": copies})
+    return f"event: availability\ndata: {data}\n\n"
+
+
+async def stream(book_ids, lifetime: float):
+    """
+    The text of an event stream: the current availability of
+    ``book_ids``, then every change for ``lifetime`` seconds.
+    """
+    yield f"retry: {RETRY_MS}\n\n"
+    if lifetime <= 0:
+        for pk, copies in (await sync_to_async(availability)(book_ids)).items():
+            yield _event(pk, copies)
+        return
+    hub = broker()
+    subscriber = await hub.subscribe(book_ids)
+    try:
+        # The response is streamed after the middleware has returned, so
+        # these reads are routed to the primary like any outside a request.
+        for pk, copies in (await sync_to_async(availability)(book_ids)).items():
+            yield _event(pk, copies)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + lifetime
+        while (left := deadline - loop.time()) > 0:
+            try:
+                await asyncio.wait_for(subscriber.ready.wait(), min(HEARTBEAT, left))
+            except TimeoutError:
+                yield ": ping\n\n"
+                continue
+            for pk, copies in subscriber.take().items():
+                yield _event(pk, copies)
+    finally:
+        hub.unsubscribe(subscriber)
@@ -0,0 +1,192 @@
+"""
+Учёт доступных экземпляров книг.
+
+Все изменения ``Book.available_copies`` проходят через этот модуль.
+Вместо схемы «прочитать — изменить в Python — сохранить» используются
+условные атомарные ``UPDATE`` с ``F()``: экземпляр списывается только
+если ``available_copies > 0`` в момент записи, поэтому при
+одновременных запросах книга не может уйти в минус.  Запись о
+бронировании создаётся в той же транзакции, что и списание.
+
+В тех же транзакциях меняются счётчики ``BookStats`` (см.
+``library.stats``), так что покупки тоже проходят через этот модуль, и
+записываются события для потока наличия книг (``library.events``).
+
+Просроченные бронирования (дольше ``LIBRARY_RESERVATION_DAYS`` дней)
+закрывает :func:`expire_overdue` — пачками, каждая в своей короткой
+транзакции, с одним ``UPDATE`` на книгу для возврата экземпляров.
+"""
+
+import time
+from collections import Counter
+from functools import partial
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import caching, events, stats
+from .models import Book, Purchase, Reservation, reservation_days
+
+# Outcomes of reserve_copy().
+RESERVED = "reserved"
+OUT_OF_STOCK = "out_of_stock"
+ALREADY_RESERVED = "already_reserved"
+
+# Outcomes of purchase_copy().
+PURCHASED = "purchased"
+ALREADY_PURCHASED = "already_purchased"
+
+
+def _availability_changed(book_id: int) -> None:
+    """
+    ``update()`` does not send ``post_save``, so invalidate whatever shows
+    the number of copies once the transaction has committed, and tell the
+    availability streams (``library.events``).
+    """
+    events.publish([book_id])
+    transaction.on_commit(lambda: caching.bump_book_version(book_id))
+
+
+class _AlreadyReserved(Exception):
+    """Raised inside the transaction to roll back the copy we just took."""
+
+
+def reserve_copy(user, book: Book) -> str:
+    """
+    Take one copy of ``book`` for ``user`` and create the reservation.
+
+    Returns :data:`RESERVED` on success, :data:`OUT_OF_STOCK` if no copy
+    was left at the moment of the update and :data:`ALREADY_RESERVED` if
+    the user already holds an active reservation for this book.
+    """
+    try:
+        with transaction.atomic():
+            # The guarded UPDATE is the first statement so the transaction
+            # takes the write lock straight away instead of upgrading a
+            # read lock later.
+            taken = Book.objects.filter(
+                pk=book.pk, available_copies__gt=0
+            ).update(
+                available_copies=F("available_copies") - 1, updated_at=timezone.now()
+            )
+            if not taken:
+                return OUT_OF_STOCK
+            if Reservation.objects.filter(
+                user=user, book_id=book.pk, status="reserved"
+            ).exists():
+                raise _AlreadyReserved
+            Reservation.objects.create(user=user, book_id=book.pk)
+            stats.apply(book.pk, active_reservations=1, total_reservations=1)
+            _availability_changed(book.pk)
+    except (_AlreadyReserved, IntegrityError):
+        # IntegrityError: a concurrent request won the race for the
+        # one_active_reservation_per_book constraint.
+        return ALREADY_RESERVED
+    return RESERVED
+
+
+def release_copy(reservation: Reservation, status: str) -> bool:
+    """
+    Close an active reservation with ``status`` (``"returned"`` or
+    ``"cancelled"``) and put the copy back on the shelf.
+
+    Only the request that actually flips the row from ``"reserved"``
+    returns the copy, so double clicks cannot inflate the stock.  Returns
+    ``False`` if the reservation was already closed.
+    """
+    changes = {"status": status}
+    if status == "returned":
+        changes["return_date"] = timezone.now().date()
+    with transaction.atomic():
+        closed = Reservation.objects.filter(
+            pk=reservation.pk, status="reserved"
+        ).update(**changes)
+        if not closed:
+            return False
+        Book.objects.filter(pk=reservation.book_id).update(
+            available_copies=F("available_copies") + 1, updated_at=timezone.now()
+        )
+        stats.apply(reservation.book_id, active_reservations=-1)
+        _availability_changed(reservation.book_id)
+        user_id = reservation.user_id
+        transaction.on_commit(lambda: caching.bump_history_version(user_id))
+    for field, value in changes.items():
+        setattr(reservation, field, value)
+    return True
+
+
+def purchase_copy(user, book: Book) -> str:
+    """
+    Record that ``user`` bought ``book`` at its current price.  Returns
+    :data:`PURCHASED`, or :data:`ALREADY_PURCHASED` if the
+    one_purchase_per_book constraint says the user already owns it.
+    """
+    price = book.price or 0
+    try:
+        with transaction.atomic():
+            Purchase.objects.create(user=user, book=book, price=price)
+            stats.apply(book.pk, total_purchases=1, revenue=price)
+    except IntegrityError:
+        return ALREADY_PURCHASED
+    return PURCHASED
+
+
+def expire_overdue(now=None, batch_size: int = 200, pause: float = 0.0) -> int:
+    """
+    Close overdue reservations as ``"expired"`` and put their copies back.
+    Returns the number of reservations closed.
+
+    Each batch is one short transaction: a single ``UPDATE ... RETURNING``
+    flips up to ``batch_size`` rows that are still ``"reserved"``, then
+    every affected book gets one ``UPDATE`` adding all of its copies.  A
+    reservation closed meanwhile by :func:`release_copy` is no longer
+    ``"reserved"`` and is skipped, so no copy is returned twice.  The
+    write lock is released between batches; ``pause`` seconds between
+    them leave room for the request path on a busy database.
+    """
+    if reservation_days() is None:
+        return 0
+    total = 0
+    while True:
+        with transaction.atomic():
+            rows = _expire_batch(now, batch_size)
+            per_book = Counter(book_id for book_id, _ in rows)
+            for book_id, count in per_book.items():
+                Book.objects.filter(pk=book_id).update(
+                    available_copies=F("available_copies") + count,
+                    updated_at=timezone.now(),
+                )
+                stats.apply(book_id, active_reservations=-count)
+            if rows:
+                events.publish(per_book)
+                users = {user_id for _, user_id in rows}
+                transaction.on_commit(partial(_after_expiry, list(per_book), users))
+        total += len(rows)
+        if len(rows) < batch_size:
+            return total
+        if pause:
+            time.sleep(pause)
+
+
+def _expire_batch(now, batch_size):
+    """Flip one batch to ``"expired"``; returns ``[(book_id, user_id), ...]``."""
+    overdue = Reservation.objects.overdue(now).values("pk")[:batch_size]
+    select, params = overdue.query.sql_with_params()
+    table = connection.ops.quote_name(Reservation._meta.db_table)
+    # The status check is repeated in the outer statement so the row is
+    # re-checked at the moment it is written (matters on PostgreSQL).
+    sql = (
+        f"UPDATE {table} SET status = %s "
+        f"WHERE status = %s AND id IN ({select}) "
+        "RETURNING book_id, user_id"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, ["expired", "reserved", *params])
+        return cursor.fetchall()
+
+
+def _after_expiry(book_ids, user_ids):
+    caching.bump_book_versions(book_ids)
+    for user_id in user_ids:
+        caching.bump_history_version(user_id)
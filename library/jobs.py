@@ -0,0 +1,283 @@
+"""
+Очередь фоновых задач в таблице ``Job``.
+
+Задача — обычная функция, помеченная декоратором :func:`task`.  Ставится
+в очередь она вызовом ``func.enqueue(*args, **kwargs)``: это один
+``INSERT``, поэтому обработчик запроса сразу возвращает ответ, а письмо,
+уменьшенные копии обложки и т.п. делает команда ``runworker``.
+Аргументы должны сериализоваться в JSON, поэтому передаются ``id``, а
+не объекты моделей.
+
+Запись идёт в текущей транзакции: если она откатится, задачи тоже не
+будет, а обработчик не увидит задачу раньше, чем данные, которые ей
+нужны.
+
+Обработчик забирает задачи пачками одним атомарным
+``UPDATE ... RETURNING``, поэтому несколько обработчиков никогда не
+получат одну и ту же задачу.  Задачи выполняются в пуле потоков (или
+процессов — для работы, которая упирается в процессор), а результат
+записывается из основного потока: выполненные задачи удаляются одним
+``DELETE``, упавшие откладываются с экспоненциальной задержкой и после
+``max_attempts`` попыток получают статус ``failed``.  Задача, которую
+обработчик взял и не завершил за ``STALE_AFTER`` (например, процесс
+убили), снова становится доступна, так что задачи выполняются «хотя бы
+один раз» и должны переживать повторный запуск.  Если это была
+последняя попытка, задача получает статус ``failed``.
+"""
+
+import json
+import os
+import random
+import socket
+import threading
+import traceback
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import partial
+
+import django
+from django.db import close_old_connections, connection
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+# name -> function, filled by @task when library.tasks is imported.
+registry = {}
+
+DEFAULT_MAX_ATTEMPTS = 5
+# Retry delays: BACKOFF_BASE * 2**(attempt - 1) seconds with jitter,
+# at most BACKOFF_MAX.
+BACKOFF_BASE = 10
+BACKOFF_MAX = 3600
+# A running job not finished after this many seconds is handed out again.
+STALE_AFTER = 600
+STALE_ERROR = "The worker stopped before the last attempt finished."
+# Traceback text kept in Job.last_error.
+ERROR_PREVIEW = 4000
+
+ClaimedJob = namedtuple("ClaimedJob", "id name args kwargs attempts max_attempts")
+
+
+def task(func):
+    """Register ``func`` as a job and give it an ``enqueue`` method."""
+    name = f"{func.__module__}.{func.__qualname__}"
+    registry[name] = func
+    func.job_name = name
+    func.enqueue = partial(enqueue, name)
+    return func
+
+
+def enqueue(
+    name, *args, delay=0, max_attempts=DEFAULT_MAX_ATTEMPTS, **kwargs
+) -> Job:
+    """
+    Queue the job ``name`` with JSON-serialisable arguments.  It runs no
+    earlier than ``delay`` seconds from now.
+    """
+    if name not in registry:
+        raise ValueError(f"unknown job {name!r}")
+    return Job.objects.create(
+        name=name,
+        payload={"args": list(args), "kwargs": kwargs},
+        max_attempts=max_attempts,
+        run_after=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def backoff(attempts: int) -> float:
+    """Seconds to wait before retrying a job that failed ``attempts`` times."""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1))
+    # Jitter spreads out jobs that failed together (e.g. mail server down).
+    return random.uniform(delay / 2, delay)
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim(batch_size: int, worker: str = "") -> list:
+    """
+    Mark up to ``batch_size`` due jobs as running and return them as
+    :class:`ClaimedJob`.  The rows are picked and updated by a single
+    statement, so concurrent workers never get the same job.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=STALE_AFTER)
+    # An abandoned last attempt is not retried; it would stay running forever.
+    Job.objects.filter(
+        status=Job.RUNNING, claimed_at__lt=stale, attempts__gte=F("max_attempts")
+    ).update(
+        status=Job.FAILED,
+        last_error=STALE_ERROR,
+        claimed_by="",
+        claimed_at=None,
+    )
+    table = connection.ops.quote_name(Job._meta.db_table)
+    # Row locks that other workers skip instead of waiting on (PostgreSQL).
+    # SQLite has one writer at a time, so the UPDATE is serialised anyway.
+    skip_locked = (
+        " FOR UPDATE SKIP LOCKED"
+        if connection.features.has_select_for_update_skip_locked
+        else ""
+    )
+    adapt = connection.ops.adapt_datetimefield_value
+    sql = f"""
+        UPDATE {table}
+        SET status = %s, attempts = attempts + 1, claimed_by = %s, claimed_at = %s
+        WHERE id IN (
+            SELECT id FROM {table}
+            WHERE (status = %s AND run_after <= %s)
+               OR (status = %s AND claimed_at < %s AND attempts < max_attempts)
+            ORDER BY run_after, id
+            LIMIT %s{skip_locked}
+        )
+        RETURNING id, name, payload, attempts, max_attempts
+    """
+    params = [
+        Job.RUNNING,
+        worker[:100],
+        adapt(now),
+        Job.QUEUED,
+        adapt(now),
+        Job.RUNNING,
+        adapt(stale),
+        batch_size,
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    claimed = []
+    for pk, name, payload, attempts, max_attempts in rows:
+        # SQLite returns the JSON as text, PostgreSQL as a dict.
+        if isinstance(payload, str):
+            payload = json.loads(payload)
+        claimed.append(
+            ClaimedJob(
+                pk,
+                name,
+                payload.get("args", []),
+                payload.get("kwargs", {}),
+                attempts,
+                max_attempts,
+            )
+        )
+    # RETURNING gives no order guarantee; run the oldest first.
+    return sorted(claimed, key=lambda job: job.id)
+
+
+def execute(name, args, kwargs):
+    """
+    Run one job and return ``None`` on success or the traceback text.
+    Exceptions are turned into text here because they may not survive
+    the trip back from a worker process.
+    """
+    try:
+        registry[name](*args, **kwargs)
+    except Exception:
+        return traceback.format_exc()[-ERROR_PREVIEW:]
+    return None
+
+
+def _execute_in_pool(name, args, kwargs):
+    # Pool threads and processes hold their own connections; treat each
+    # job like a request so they are closed or recycled per CONN_MAX_AGE.
+    close_old_connections()
+    try:
+        return execute(name, args, kwargs)
+    finally:
+        close_old_connections()
+
+
+def finish(results) -> None:
+    """
+    Record the outcome of ``[(ClaimedJob, error_or_None), ...]``: delete
+    the jobs that succeeded and reschedule or fail the others.
+    """
+    done = [job.id for job, error in results if error is None]
+    if done:
+        Job.objects.filter(pk__in=done).delete()
+    now = timezone.now()
+    for job, error in results:
+        if error is None:
+            continue
+        if job.attempts >= job.max_attempts:
+            changes = {"status": Job.FAILED}
+        else:
+            changes = {
+                "status": Job.QUEUED,
+                "run_after": now + timedelta(seconds=backoff(job.attempts)),
+            }
+        Job.objects.filter(pk=job.id).update(
+            last_error=error, claimed_by="", claimed_at=None, **changes
+        )
+
+
+def run_pending(batch_size: int = 100) -> int:
+    """
+    Run every due job in the current thread and return how many ran.
+    Handy in tests and scripts; servers use :func:`work`.
+    """
+    count = 0
+    while True:
+        batch = claim(batch_size, worker_name())
+        if not batch:
+            return count
+        finish([(job, execute(job.name, job.args, job.kwargs)) for job in batch])
+        count += len(batch)
+
+
+def _make_pool(concurrency: int, processes: bool):
+    if processes:
+        # Imported here: the web processes that enqueue jobs never need it.
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        # "spawn" starts clean interpreters instead of forking one that
+        # holds open database connections and the cache.
+        return ProcessPoolExecutor(
+            concurrency,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=django.setup,
+        )
+    return ThreadPoolExecutor(concurrency, thread_name_prefix="library-job")
+
+
+def work(
+    batch_size: int = 4,
+    concurrency: int = 4,
+    processes: bool = False,
+    poll_interval: float = 1.0,
+    once: bool = False,
+    stop: threading.Event = None,
+    on_batch=None,
+) -> int:
+    """
+    Claim and run jobs until ``stop`` is set, or until the queue is empty
+    when ``once`` is true.  Returns the number of jobs run.
+    ``on_batch(results)`` is called after each batch.
+    """
+    stop = stop or threading.Event()
+    worker = worker_name()
+    count = 0
+    with _make_pool(concurrency, processes) as pool:
+        while not stop.is_set():
+            batch = claim(batch_size, worker)
+            if not batch:
+                if once:
+                    break
+                # Between polls the connection is not needed.
+                close_old_connections()
+                stop.wait(poll_interval)
+                continue
+            futures = [
+                pool.submit(_execute_in_pool, job.name, job.args, job.kwargs)
+                for job in batch
+            ]
+            results = [(job, future.result()) for job, future in zip(batch, futures)]
+            finish(results)
+            count += len(batch)
+            if on_batch is not None:
+                on_batch(results)
+    return count
@@ -0,0 +1,22 @@
+"""
+Обработчик логов для нескольких рабочих процессов.
+
+Все процессы сервера (``runprefork``, gunicorn) пишут в один файл.  Сами
+они файл не ротируют: ``RotatingFileHandler`` каждого процесса
+переименовывал бы файл независимо от остальных, и строки терялись бы
+или уходили в старый файл.  Ротацию делает внешний ``logrotate``, а
+:class:`WatchedFileHandler` замечает, что файл подменили, и открывает
+новый.  Каталог для файла создаётся при первой записи, а не при импорте
+настроек.
+"""
+
+import logging.handlers
+import os
+
+
+class WatchedFileHandler(logging.handlers.WatchedFileHandler):
+    """``WatchedFileHandler`` that creates the log directory when needed."""
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
@@ -0,0 +1,58 @@
+"""
+Команда, переносящая старые закрытые бронирования в архив по месяцам.
+
+Возвращённые, отменённые и просроченные бронирования старше
+``--older-than`` дней (по умолчанию ``LIBRARY_ARCHIVE_AFTER_DAYS``)
+переезжают в таблицы ``library_reservation_archive_ГГГГ_ММ`` пачками по
+``--batch-size`` строк, каждая — своей транзакцией (см.
+``library.archive``).  Прерванный запуск можно просто повторить.
+Команду можно запускать при работающем сайте, например раз в сутки из
+cron.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from library import archive
+
+
+class Command(BaseCommand):
+    help = "Move old closed reservations to the monthly archive tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than",
+            type=int,
+            default=None,
+            help="Age in days (default: LIBRARY_ARCHIVE_AFTER_DAYS)",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0.0,
+            help="Seconds to sleep between batches",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count the reservations to archive",
+        )
+
+    def handle(self, *args, **options):  # type: ignore[override]
+        days = options["older_than"]
+        if options["dry_run"]:
+            count = archive.candidates(days=days).count()
+            self.stdout.write(f"[dry-run] Бронирований для архива: {count}.")
+            return
+        started = time.perf_counter()
+        count = archive.archive_closed(
+            days=days, batch_size=options["batch_size"], pause=options["pause"]
+        )
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Перенесено в архив бронирований: {count} ({elapsed:.2f} с)."
+            )
+        )
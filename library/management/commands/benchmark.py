@@ -0,0 +1,211 @@
+"""
+Команда для нагрузочного замера всех страниц библиотеки.
+
+Замер идёт на отдельной временной базе (той же, что используют тесты)
+и в отдельном каталоге кэша, поэтому рабочие данные не затрагиваются.
+Примеры::
+
+    python manage.py benchmark --books 10000 --save-baseline bench.json
+    python manage.py benchmark --books 10000 --compare bench.json
+
+При сравнении команда завершается с ошибкой, если p95 какой-либо
+страницы вырос больше допуска, выросло число SQL-запросов или
+появились ошибки сервера.
+
+С ``--db-profile`` замер повторяется для каждого профиля SQLite из
+``SQLITE_PROFILES`` (каждый раз на новой базе), например::
+
+    python manage.py benchmark --only mixed --threads 8 \\
+        --db-profile development production
+
+С ``--server wsgi asgi`` те же страницы замеряются и через ASGI: вместо
+потоков — столько же одновременных задач в одном цикле событий.
+
+С ``--replicas 0 1 2`` замер повторяется с разным числом реплик для
+чтения (копий базы, которые фоновый поток обновляет раз в
+``--replica-interval`` секунд) и добавляется строка ``replica_reads``:
+тяжёлые чтения из ``--threads`` потоков, пока ещё один поток переписывает
+каталог на основной базе.  Например::
+
+    python manage.py benchmark --only mixed home book_detail --threads 8 \\
+        --replicas 0 1 2 4
+"""
+
+import json
+import random
+import tempfile
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from library import benchmark
+
+SCALE_OPTIONS = ("books", "users", "reservations", "purchases", "requests", "threads")
+PROFILE_KEYS = ("CONN_MAX_AGE", "CONN_HEALTH_CHECKS", "OPTIONS")
+
+
+class Command(BaseCommand):
+    help = "Seed a throwaway database and benchmark every library route"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--books", type=int, default=2000)
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--reservations", type=int, default=5000)
+        parser.add_argument("--purchases", type=int, default=1000)
+        parser.add_argument(
+            "--requests", type=int, default=200, help="Requests per route"
+        )
+        parser.add_argument("--threads", type=int, default=4)
+        parser.add_argument(
+            "--write-share",
+            type=float,
+            default=0.2,
+            help="Share of reservations in the mixed scenario",
+        )
+        parser.add_argument(
+            "--only", nargs="*", help="Benchmark only these route names"
+        )
+        parser.add_argument(
+            "--db-profile",
+            nargs="+",
+            choices=sorted(settings.SQLITE_PROFILES),
+            help="Repeat the run with each of these SQLite profiles",
+        )
+        parser.add_argument(
+            "--server",
+            nargs="+",
+            choices=["wsgi", "asgi"],
+            default=["wsgi"],
+            help="Drive the WSGI handler from threads or the ASGI one from tasks",
+        )
+        parser.add_argument(
+            "--replicas",
+            nargs="+",
+            type=int,
+            default=[0],
+            help="Repeat the run with this many read replicas",
+        )
+        parser.add_argument(
+            "--replica-interval",
+            type=float,
+            default=1.0,
+            help="Seconds between replica refreshes",
+        )
+        parser.add_argument(
+            "--read-seconds",
+            type=float,
+            default=3.0,
+            help="Length of the replica_reads run that --replicas adds",
+        )
+        parser.add_argument("--save-baseline", metavar="PATH")
+        parser.add_argument("--compare", metavar="PATH")
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.25,
+            help="Allowed relative p95 growth when comparing (0.25 = 25%%)",
+        )
+
+    def handle(self, *args, **options):  # type: ignore[override]
+        baseline = None
+        if options["compare"]:
+            with open(options["compare"], encoding="utf-8") as f:
+                baseline = json.load(f)
+
+        results = {}
+        for profile in options["db_profile"] or [None]:
+            for server in options["server"]:
+                for count in options["replicas"]:
+                    replicas = f"replicas={count}" if count else None
+                    tags = ",".join(
+                        t for t in (profile, server, replicas) if t and t != "wsgi"
+                    )
+                    rows = self._run(profile, server, count, options)
+                    for name, row in rows.items():
+                        results[f"{name}[{tags}]" if tags else name] = row
+
+        self.stdout.write(
+            f"{'страница':<32}{'p50':>9}{'p95':>9}{'p99':>9}"
+            f"{'SQL':>6}{'rps':>9}{'5xx':>6}"
+        )
+        for name, row in results.items():
+            self.stdout.write(
+                f"{name:<32}{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}"
+                f"{row['p99_ms']:>9.2f}{row['queries']:>6}{row['rps']:>9.1f}"
+                f"{row['errors']:>6}"
+            )
+
+        report = {
+            "scale": {key: options[key] for key in SCALE_OPTIONS},
+            "routes": results,
+        }
+        if options["save_baseline"]:
+            with open(options["save_baseline"], "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(
+                self.style.SUCCESS(f"Эталон сохранён в {options['save_baseline']}")
+            )
+        if baseline is not None:
+            problems = benchmark.compare(
+                baseline["routes"], results, options["tolerance"]
+            )
+            if problems:
+                raise CommandError("Регрессии:\n  " + "\n  ".join(problems))
+            self.stdout.write(self.style.SUCCESS("Регрессий нет."))
+
+    def _run(self, profile, server, replicas, options):
+        """Seed a fresh test database and measure it with ``profile``."""
+        # Every thread's connection is built from this very dict.
+        db_settings = connection.settings_dict
+        saved = {key: db_settings[key] for key in PROFILE_KEYS}
+        if profile:
+            connection.close()
+            db_settings.update(
+                {"CONN_MAX_AGE": 0, "CONN_HEALTH_CHECKS": False, "OPTIONS": {}},
+                **settings.SQLITE_PROFILES[profile],
+            )
+            self.stdout.write(f"Профиль базы: {profile}")
+
+        with tempfile.TemporaryDirectory(prefix="library-bench-cache-") as cache_dir:
+            caches = {
+                alias: {**config, "LOCATION": f"{cache_dir}/{alias}"}
+                for alias, config in settings.CACHES.items()
+            }
+            old_name = connection.creation.create_test_db(
+                verbosity=0, autoclobber=True, serialize=False
+            )
+            try:
+                with override_settings(CACHES=caches), ExitStack() as stack:
+                    self.stdout.write("Заполняем базу...")
+                    benchmark.seed(
+                        books=options["books"],
+                        users=options["users"],
+                        reservations=options["reservations"],
+                        purchases=options["purchases"],
+                        rng=random.Random(0),
+                    )
+                    if replicas:
+                        self.stdout.write(f"Реплик для чтения: {replicas}")
+                        stack.enter_context(
+                            benchmark.replica_copies(
+                                replicas, cache_dir, options["replica_interval"]
+                            )
+                        )
+                    results = benchmark.run(
+                        requests=options["requests"],
+                        threads=options["threads"],
+                        names=options["only"],
+                        write_share=options["write_share"],
+                        server=server,
+                    )
+                    if options["replicas"] != [0]:
+                        results["replica_reads"] = benchmark.read_throughput(
+                            options["threads"], options["read_seconds"]
+                        )
+                    return results
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                db_settings.update(saved)
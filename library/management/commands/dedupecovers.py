@@ -0,0 +1,111 @@
+"""
+Команда для объединения одинаковых файлов обложек.
+
+Проходит по каталогу ``book_covers``, считает SHA-256 каждого файла и
+для каждой группы одинаковых файлов оставляет одну копию под именем
+из хэша (как её назвало бы ``ContentAddressedStorage``).  Книги,
+ссылавшиеся на дубликаты, переводятся на эту копию одним ``UPDATE`` на
+группу, а лишние файлы и их уменьшенные копии удаляются.  Пустые файлы
+считаются испорченными: ссылки на них очищаются.
+"""
+
+import os
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from library import caching, thumbnails
+from library.models import Book
+from library.storage import CHUNK_SIZE, content_name, file_digest
+
+COVERS_DIR = "book_covers"
+
+
+def _read_chunks(path):
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            yield chunk
+
+
+class Command(BaseCommand):
+    help = "Merge byte-identical cover files and repoint Book.cover_image"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report what would be merged",
+        )
+
+    def handle(self, *args, **options):  # type: ignore[override]
+        storage = Book._meta.get_field("cover_image").storage
+        dry_run = options["dry_run"]
+        folder = storage.path(COVERS_DIR)
+        if not os.path.isdir(folder):
+            self.stdout.write("Каталога с обложками нет.")
+            return
+
+        groups = defaultdict(list)
+        empty = []
+        for entry in sorted(os.scandir(folder), key=lambda e: e.name):
+            if not entry.is_file():
+                continue
+            name = f"{COVERS_DIR}/{entry.name}"
+            if entry.stat().st_size == 0:
+                empty.append(name)
+            else:
+                digest = file_digest(_read_chunks(entry.path))
+                groups[digest].append((name, entry.stat().st_size))
+
+        freed = merged = 0
+        for digest, files in groups.items():
+            names = [name for name, _ in files]
+            target = content_name(names[0], digest)
+            if names == [target]:
+                continue
+            merged += 1
+            # All files in a group have the same size; one copy stays.
+            freed += sum(size for _, size in files) - files[0][1]
+            self.stdout.write(f"{target} ← {', '.join(n for n in names if n != target)}")
+            if dry_run:
+                continue
+            if not storage.exists(target):
+                os.replace(storage.path(names[0]), storage.path(target))
+            self._repoint(names, target)
+            for name in names:
+                if name != target:
+                    self._remove(storage, name)
+            thumbnails.generate_derivatives(target)
+
+        for name in empty:
+            self.stdout.write(self.style.WARNING(f"Пустой файл: {name}"))
+            if not dry_run:
+                self._repoint([name], "")
+                self._remove(storage, name)
+
+        prefix = "[dry-run] " if dry_run else ""
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{prefix}Объединено групп: {merged}, пустых файлов: {len(empty)}, "
+                f"освобождено {freed / 1024:.0f} КБ."
+            )
+        )
+
+    def _repoint(self, names, target):
+        books = Book.objects.filter(cover_image__in=names)
+        with transaction.atomic():
+            pks = list(books.values_list("pk", flat=True))
+            # update() skips auto_now; the page stamps (ETag,
+            # Last-Modified) are built from updated_at.
+            books.update(cover_image=target, updated_at=timezone.now())
+        caching.bump_book_versions(pks)
+
+    def _remove(self, storage, name):
+        """Delete a cover file together with its generated thumbnails."""
+        if storage.exists(name):
+            storage.delete(name)
+        for variants in thumbnails.derivatives(name, storage).values():
+            for _, variant in variants:
+                storage.delete(variant)
@@ -0,0 +1,58 @@
+"""
+Команда, закрывающая просроченные бронирования.
+
+Бронирование, которое держат дольше ``LIBRARY_RESERVATION_DAYS`` дней,
+получает статус «Просрочено», а экземпляр возвращается в
+``available_copies``.  Работа идёт пачками по ``--batch-size`` строк,
+каждая в своей короткой транзакции, поэтому команду можно запускать
+при работающем сайте (например, раз в час из cron) и одновременно с
+другими её копиями.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from library import inventory
+from library.models import Reservation, reservation_days
+
+
+class Command(BaseCommand):
+    help = "Expire overdue reservations and return their copies"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=200)
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0.0,
+            help="Seconds to sleep between batches",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count the overdue reservations",
+        )
+
+    def handle(self, *args, **options):  # type: ignore[override]
+        days = reservation_days()
+        if days is None:
+            self.stdout.write(
+                "Срок бронирования не ограничен (LIBRARY_RESERVATION_DAYS)."
+            )
+            return
+        if options["dry_run"]:
+            count = Reservation.objects.overdue().count()
+            self.stdout.write(f"[dry-run] Просроченных бронирований: {count}.")
+            return
+        started = time.perf_counter()
+        count = inventory.expire_overdue(
+            batch_size=options["batch_size"], pause=options["pause"]
+        )
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Закрыто просроченных бронирований: {count} "
+                f"(срок {days} дн., {elapsed:.2f} с)."
+            )
+        )
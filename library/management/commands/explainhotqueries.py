@@ -0,0 +1,49 @@
+"""
+Команда, которая показывает планы выполнения «горячих» запросов.
+
+Для каждого запроса печатается ``EXPLAIN QUERY PLAN`` и среднее время
+выполнения на текущей базе.  Если какой-то запрос читает таблицу целиком
+или сортирует результат без индекса, команда завершается с ошибкой —
+её удобно запускать после изменения моделей или миграций.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from library.queryplans import hot_queries, plan_lines, plan_problems, time_query
+
+
+class Command(BaseCommand):
+    help = "Show EXPLAIN QUERY PLAN for hot queries and fail on table scans"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, default=1, help="User id to use")
+        parser.add_argument("--book", type=int, default=1, help="Book id to use")
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=50,
+            help="How many times to run each query for timing (0 to skip)",
+        )
+
+    def handle(self, *args, **options):  # type: ignore[override]
+        if connection.vendor != "sqlite":
+            raise CommandError("EXPLAIN QUERY PLAN разбирается только для SQLite.")
+        failed = []
+        for name, queryset in hot_queries(options["user"], options["book"]):
+            lines = plan_lines(queryset)
+            problems = plan_problems(queryset, lines)
+            timing = ""
+            if options["repeat"]:
+                timing = f" ({time_query(queryset, options['repeat']):.3f} мс)"
+            style = self.style.ERROR if problems else self.style.SUCCESS
+            self.stdout.write(style(f"{name}{timing}"))
+            for line in lines:
+                self.stdout.write(f"    {line}")
+            if problems:
+                failed.append(name)
+        if failed:
+            raise CommandError(
+                "Запросы без индекса: " + ", ".join(failed)
+            )
+        self.stdout.write(self.style.SUCCESS("Все горячие запросы идут по индексам."))
@@ -0,0 +1,233 @@
+"""
+Команда для массового импорта книг из CSV или JSONL.
+
+Файл читается построчно, целиком в память он не загружается.  Названия
+уже существующих книг загружаются один раз в словарь, поэтому проверка
+дубликатов не делает запросов на каждую строку.  Новые книги пишутся
+через ``bulk_create``, а с ``--update`` существующие обновляются через
+``bulk_update`` — пачками по ``--batch-size`` строк, каждая пачка в
+своей транзакции.
+
+После каждой пачки номер обработанной строки сохраняется в файл
+``<файл>.checkpoint``.  Если импорт прервался, повторный запуск с теми же
+аргументами продолжит с места остановки.
+
+Поля: ``title``, ``author``, ``description``, ``available_copies``,
+``is_vip``, ``price``.  Обязательны только ``title`` и ``author``.
+``available_copies`` задаёт запас только новой книги: у существующей
+это текущий остаток, который меняют бронирования, и ``--update`` его не
+трогает.
+"""
+
+import csv
+import json
+import os
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from library import caching, search
+from library.models import Book
+
+# available_copies is left out: on the site it is the live stock that
+# reservations change (library.inventory), not a catalog attribute.
+UPDATE_FIELDS = [
+    "author",
+    "description",
+    "is_vip",
+    "price",
+    # bulk_update() does not apply auto_now; _flush() sets it.
+    "updated_at",
+]
+TRUE_VALUES = {"1", "true", "yes", "y", "да"}
+
+
+def _read_rows(path: str, fmt: str):
+    """
+    Yield the rows of a CSV or JSONL file, one line at a time: dicts for
+    CSV, undecoded lines for JSONL (see :func:`_to_book`).
+    """
+    with open(path, encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield line
+
+
+def _to_book(row) -> Book:
+    if isinstance(row, str):
+        # Decoded here so that a broken line is one bad row, not the end
+        # of the import.
+        row = json.loads(row)
+    title = (row.get("title") or "").strip()
+    author = (row.get("author") or "").strip()
+    if not title or not author:
+        raise ValueError("title and author are required")
+    price = row.get("price")
+    try:
+        price = Decimal(str(price)) if price not in (None, "") else None
+    except InvalidOperation:
+        raise ValueError(f"bad price {price!r}")
+    copies = row.get("available_copies")
+    copies = int(copies) if copies not in (None, "") else 1
+    if copies < 0:
+        raise ValueError(f"negative available_copies {copies}")
+    is_vip = row.get("is_vip")
+    if not isinstance(is_vip, bool):
+        is_vip = str(is_vip or "").strip().lower() in TRUE_VALUES
+    return Book(
+        title=title,
+        author=author,
+        description=row.get("description") or "",
+        available_copies=copies,
+        is_vip=is_vip,
+        price=price,
+    )
+
+
+class Command(BaseCommand):
+    help = "Import books from a CSV or JSONL file in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV or JSONL file to import")
+        parser.add_argument(
+            "--format",
+            choices=["csv", "jsonl"],
+            help="File format (by default guessed from the extension)",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--update",
+            action="store_true",
+            help="Update books whose title already exists instead of skipping them",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore an existing checkpoint and start from the first row",
+        )
+
+    def handle(self, *args, **options):  # type: ignore[override]
+        path = options["path"]
+        if not os.path.exists(path):
+            raise CommandError(f"Файл {path} не найден.")
+        fmt = options["format"]
+        if fmt is None:
+            fmt = "jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv"
+        batch_size = options["batch_size"]
+        self.checkpoint_path = path + ".checkpoint"
+        start_row = 0 if options["restart"] else self._load_checkpoint()
+        if start_row:
+            self.stdout.write(f"Продолжаем со строки {start_row + 1}.")
+
+        # title -> pk of every book already in the catalog, loaded once.
+        self.existing = dict(Book.objects.values_list("title", "pk").iterator())
+        self.update = options["update"]
+        self.counts = {"created": 0, "updated": 0, "skipped": 0, "errors": 0}
+
+        started = time.perf_counter()
+        batch = []
+        row_number = 0
+        for row_number, row in enumerate(_read_rows(path, fmt), start=1):
+            if row_number <= start_row:
+                continue
+            try:
+                batch.append((row_number, _to_book(row)))
+            except (ValueError, TypeError, AttributeError) as exc:
+                self.counts["errors"] += 1
+                self.stderr.write(f"Строка {row_number}: {exc}")
+            if len(batch) >= batch_size:
+                self._flush(batch, row_number, started, start_row)
+                batch = []
+        self._flush(batch, row_number, started, start_row)
+
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Импорт завершён: создано {created}, обновлено {updated}, "
+                "пропущено {skipped}, ошибок {errors}.".format(**self.counts)
+            )
+        )
+
+    def _flush(self, batch, row_number, started, start_row):
+        """Write one batch in a transaction, then record the checkpoint."""
+        new, changed = [], []
+        now = timezone.now()
+        for number, book in batch:
+            pk = self.existing.get(book.title)
+            if pk is None:
+                new.append((number, book))
+                self.existing[book.title] = 0  # dedupe within the file too
+            elif self.update and pk:
+                book.pk = pk
+                book.updated_at = now
+                changed.append((number, book))
+            else:
+                self.counts["skipped"] += 1
+        created = updated = []
+        if new or changed:
+            try:
+                created, updated = self._write(new, changed)
+            except IntegrityError:
+                # A row the checks in _to_book() let through; write the
+                # batch row by row so that it costs only itself.
+                created, updated = self._write_each(new, changed)
+        for book in created:
+            self.existing[book.title] = book.pk
+        caching.bump_book_versions(book.pk for book in updated)
+        if created:
+            # New books have no cached copies, but the catalog has changed.
+            caching.bump_catalog_generation()
+        self.counts["created"] += len(created)
+        self.counts["updated"] += len(updated)
+        self._save_checkpoint(row_number)
+
+        elapsed = time.perf_counter() - started
+        rate = (row_number - start_row) / elapsed if elapsed else 0
+        self.stdout.write(f"Строк обработано: {row_number} ({rate:,.0f} строк/с)")
+
+    def _write(self, new, changed):
+        """Write ``[(row number, book), ...]`` in one transaction."""
+        new = [book for _, book in new]
+        changed = [book for _, book in changed]
+        with transaction.atomic():
+            created = Book.objects.bulk_create(new)
+            if changed:
+                Book.objects.bulk_update(changed, UPDATE_FIELDS)
+            # bulk_* skip the model signals; keep the search index in step.
+            search.index_books(created + changed)
+        return created, changed
+
+    def _write_each(self, new, changed):
+        """Like :meth:`_write`, one row per transaction; bad rows are reported."""
+        created, updated = [], []
+        for number, book in new + changed:
+            row = [(number, book)]
+            try:
+                if book.pk is None:
+                    created += self._write(row, [])[0]
+                else:
+                    updated += self._write([], row)[1]
+            except IntegrityError as exc:
+                self.counts["errors"] += 1
+                self.stderr.write(f"Строка {number}: {exc}")
+        return created, updated
+
+    def _load_checkpoint(self) -> int:
+        try:
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                return int(json.load(f)["rows"])
+        except (FileNotFoundError, ValueError, KeyError):
+            return 0
+
+    def _save_checkpoint(self, rows: int) -> None:
+        tmp = self.checkpoint_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"rows": rows}, f)
+        os.replace(tmp, self.checkpoint_path)
@@ -5,14 +5,18 @@
 Она проверяет, есть ли книга с таким названием, и не создаёт
 дубликаты.  Обложки берутся из каталога ``media/book_covers``.  Часть
 книг помечена как VIP (их можно только купить).
+
+Книги создаются сразу, а обложки (запись файла и уменьшенные копии)
+добавляются фоновыми задачами: их выполнит ``python manage.py
+runworker`` (или ``runworker --once``).
 """
 
 import os
 
-from django.core.files import File
 from django.core.management.base import BaseCommand
 from django.conf import settings
 
+from library import tasks
 from library.models import Book
 
 
@@ -153,6 +157,7 @@ class Command(BaseCommand):
         ]
 
         created_count = 0
+        covers_queued = 0
         for data in books:
             if Book.objects.filter(title=data["title"]).exists():
                 self.stdout.write(
@@ -169,17 +174,21 @@ class Command(BaseCommand):
                 is_vip=data["is_vip"],
                 price=data.get("price"),
             )
-            # Attach cover image if available
-            cover_filename = data["cover"]
-            media_path = os.path.join(settings.MEDIA_ROOT, "book_covers", cover_filename)
-            if os.path.exists(media_path):
-                with open(media_path, "rb") as f:
-                    book.cover_image.save(cover_filename, File(f), save=False)
             book.save()
+            # Attach the cover image, if available, in the background
+            cover_path = os.path.join("book_covers", data["cover"])
+            if os.path.exists(os.path.join(settings.MEDIA_ROOT, cover_path)):
+                tasks.attach_cover.enqueue(book.pk, cover_path)
+                covers_queued += 1
             created_count += 1
             self.stdout.write(
                 self.style.SUCCESS(f"Добавлена книга: {book.title}")
             )
         self.stdout.write(
             self.style.SUCCESS(f"Завершено. Добавлено {created_count} книг.")
-        )
\ No newline at end of file
+        )
+        if covers_queued:
+            self.stdout.write(
+                f"Обложек в очереди: {covers_queued}. Они появятся после "
+                "запуска python manage.py runworker --once."
+            )
\ No newline at end of file
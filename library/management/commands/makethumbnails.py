@@ -0,0 +1,75 @@
+"""
+Команда для создания уменьшенных копий уже загруженных обложек.
+
+Новые обложки обрабатываются фоновой задачей после сохранения книги, а эта
+команда нужна, чтобы один раз пройтись по старым.  Изображения
+обрабатываются параллельно в пуле процессов; обложки с актуальными
+копиями пропускаются, поэтому команду можно запускать повторно.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from library import caching, thumbnails
+from library.models import Book
+
+
+def _process(args):
+    name, force = args
+    return name, thumbnails.generate_derivatives(name, force=force)
+
+
+class Command(BaseCommand):
+    help = "Generate WebP/JPEG cover thumbnails for existing books"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Number of worker processes",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Regenerate thumbnails even if they are up to date",
+        )
+
+    def handle(self, *args, **options):  # type: ignore[override]
+        covers = {}
+        for pk, name in Book.objects.exclude(cover_image="").exclude(
+            cover_image__isnull=True
+        ).values_list("pk", "cover_image"):
+            covers.setdefault(name, []).append(pk)
+        if not covers:
+            self.stdout.write("Обложек нет.")
+            return
+
+        # Workers only touch files, never the database; do not let them
+        # inherit open connections from the parent.
+        connections.close_all()
+        started = time.perf_counter()
+        written = updated = 0
+        jobs = [(name, options["force"]) for name in covers]
+        with ProcessPoolExecutor(
+            max_workers=options["workers"], initializer=django.setup
+        ) as pool:
+            for name, count in pool.map(_process, jobs):
+                if count:
+                    written += count
+                    updated += 1
+                    # Cached cards of these books must pick up the srcset.
+                    for pk in covers[name]:
+                        caching.bump_book_version(pk)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Обработано обложек: {len(covers)}, обновлено: {updated}, "
+                f"файлов записано: {written} за {elapsed:.2f} с."
+            )
+        )
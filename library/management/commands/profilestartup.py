@@ -0,0 +1,84 @@
+"""
+Команда, которая показывает, на что уходит холодный старт процесса.
+
+Проект загружается в новом интерпретаторе (см. ``library.startup``), и
+команда печатает время этапов (``django.setup()``, импорт WSGI-приложения,
+первый и второй запрос), время каждого приложения (импорт, ``models``,
+``ready()``), шаги прогрева и самые дорогие модули по ``-X importtime``.
+Пример::
+
+    python manage.py profilestartup --top 15
+"""
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library import startup
+
+
+class Command(BaseCommand):
+    help = "Profile a cold start: per-app ready time and per-module import time"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--top", type=int, default=20, help="How many modules to list"
+        )
+        parser.add_argument(
+            "--json", action="store_true", help="Print the raw timings as JSON"
+        )
+
+    def handle(self, *args, **options):  # type: ignore[override]
+        try:
+            result = startup.profile()
+        except RuntimeError as exc:
+            raise CommandError(f"Процесс не запустился: {exc}")
+        imports = result.pop("imports")
+        top = options["top"]
+        by_self = sorted(imports, key=lambda row: -row.self_us)[:top]
+        by_cumulative = sorted(imports, key=lambda row: -row.cumulative_us)[:top]
+        if options["json"]:
+            result["imports"] = {
+                "modules": len(imports),
+                "self": [row._asdict() for row in by_self],
+                "cumulative": [row._asdict() for row in by_cumulative],
+                "packages": startup.package_totals(imports),
+            }
+            self.stdout.write(json.dumps(result, ensure_ascii=False, indent=2))
+            return
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Этапы, мс"))
+        for step, ms in result["steps"].items():
+            self.stdout.write(f"  {step:<20} {ms:>9.2f}")
+        self.stdout.write(f"  {'всего':<20} {result['total']:>9.2f}")
+
+        self.stdout.write(
+            self.style.MIGRATE_HEADING("Приложения, мс (импорт / models / ready)")
+        )
+        for label, app in result["apps"].items():
+            self.stdout.write(
+                f"  {label:<20} {app['import']:>9.2f} "
+                f"{app['models']:>9.2f} {app['ready']:>9.2f}"
+            )
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Прогрев, мс"))
+        for step, ms in result["warm_up"].items():
+            self.stdout.write(f"  {step:<20} {ms:>9.2f}")
+
+        self.stdout.write(
+            self.style.MIGRATE_HEADING(
+                f"Модули по собственному времени импорта, мс (из {len(imports)})"
+            )
+        )
+        for row in by_self:
+            self.stdout.write(f"  {row.self_us / 1000:>9.2f}  {row.module}")
+
+        self.stdout.write(
+            self.style.MIGRATE_HEADING("Модули вместе с зависимостями, мс")
+        )
+        for row in by_cumulative:
+            self.stdout.write(f"  {row.cumulative_us / 1000:>9.2f}  {row.module}")
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Пакеты, мс"))
+        for package, us in list(startup.package_totals(imports).items())[:top]:
+            self.stdout.write(f"  {us / 1000:>9.2f}  {package}")
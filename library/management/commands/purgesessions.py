@@ -0,0 +1,60 @@
+"""
+Команда, удаляющая истёкшие сессии из базы.
+
+В отличие от ``clearsessions``, который удаляет всё одним запросом и
+надолго берёт блокировку записи, удаление идёт пачками по
+``--batch-size`` строк (по индексу на ``expire_date``), каждая — своим
+коротким ``DELETE``.  Записи в кэше сессий истекают сами, в тот же срок.
+Команду можно запускать при работающем сайте, например раз в сутки из
+cron.
+"""
+
+import time
+
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+def purge_expired(now=None, batch_size: int = 1000, pause: float = 0.0) -> int:
+    """Delete expired sessions in batches; returns how many were deleted."""
+    now = now or timezone.now()
+    total = 0
+    while True:
+        batch = Session.objects.filter(expire_date__lt=now).values("pk")[:batch_size]
+        deleted, _ = Session.objects.filter(pk__in=batch).delete()
+        total += deleted
+        if deleted < batch_size:
+            return total
+        if pause:
+            time.sleep(pause)
+
+
+class Command(BaseCommand):
+    help = "Delete expired sessions in small batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0.0,
+            help="Seconds to sleep between batches",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count the expired sessions",
+        )
+
+    def handle(self, *args, **options):  # type: ignore[override]
+        if options["dry_run"]:
+            count = Session.objects.filter(expire_date__lt=timezone.now()).count()
+            self.stdout.write(f"[dry-run] Истёкших сессий: {count}.")
+            return
+        started = time.perf_counter()
+        count = purge_expired(batch_size=options["batch_size"], pause=options["pause"])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(f"Удалено истёкших сессий: {count} ({elapsed:.2f} с).")
+        )
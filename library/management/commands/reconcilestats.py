@@ -0,0 +1,62 @@
+"""
+Команда для сверки счётчиков ``BookStats`` с таблицами бронирований и
+покупок.
+
+Счётчики пересчитываются двумя запросами с ``GROUP BY``, расхождения
+печатаются и (если не указан ``--dry-run``) исправляются пачками через
+``bulk_update`` и ``bulk_create``.  Запускать стоит после правок
+бронирований в админке или массовой загрузки данных в обход
+``library.inventory``.  С ``--defer`` сверка ставится в очередь
+фоновых задач и выполнится в ``runworker``.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from library import stats, tasks
+
+# Mismatches printed one by one; the rest are only counted.
+SHOW_MISMATCHES = 20
+
+
+class Command(BaseCommand):
+    help = "Verify and repair the denormalised BookStats counters"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report the differences",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--defer",
+            action="store_true",
+            help="Queue the repair as a background job instead of running it",
+        )
+
+    def handle(self, *args, **options):  # type: ignore[override]
+        if options["defer"]:
+            job = tasks.reconcile_stats.enqueue()
+            self.stdout.write(
+                self.style.SUCCESS(f"Сверка поставлена в очередь: {job}.")
+            )
+            return
+        started = time.perf_counter()
+        mismatches = stats.reconcile(
+            repair=not options["dry_run"], batch_size=options["batch_size"]
+        )
+        elapsed = time.perf_counter() - started
+        for book_id, counter, stored, expected in mismatches[:SHOW_MISMATCHES]:
+            self.stdout.write(f"Книга {book_id}: {counter} {stored} → {expected}")
+        if len(mismatches) > SHOW_MISMATCHES:
+            self.stdout.write(f"... и ещё {len(mismatches) - SHOW_MISMATCHES}")
+        books = len({book_id for book_id, *_ in mismatches})
+        prefix = "[dry-run] " if options["dry_run"] else ""
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{prefix}Расхождений: {len(mismatches)} у {books} книг "
+                f"({elapsed:.2f} с)."
+            )
+        )
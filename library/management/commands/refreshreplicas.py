@@ -0,0 +1,62 @@
+"""
+Команда, обновляющая локальные реплики базы.
+
+Каждые ``--interval`` секунд основная база копируется во все реплики из
+``LIBRARY_READ_REPLICAS`` через online backup API SQLite (см.
+``library.replicas``).  С ``--once`` реплики обновляются один раз —
+например, чтобы создать их перед запуском сайта.  Интервал должен быть
+меньше ``LIBRARY_REPLICA_PIN_SECONDS``.  SIGTERM и Ctrl+C завершают
+команду после текущего копирования.
+"""
+
+import signal
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library import replicas
+
+
+class Command(BaseCommand):
+    help = "Copy the primary SQLite database to its read replicas"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=2.0,
+            help="Seconds between refreshes",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Refresh once and exit"
+        )
+
+    def handle(self, *args, **options):  # type: ignore[override]
+        if not replicas.replica_aliases():
+            raise CommandError(
+                "Реплики не настроены: задайте LIBRARY_DB_REPLICAS."
+            )
+        self.verbosity = options["verbosity"]
+        self._report(replicas.refresh())
+        if options["once"]:
+            return
+        stop = threading.Event()
+        previous = {
+            signum: signal.signal(signum, lambda *_: stop.set())
+            for signum in (signal.SIGINT, signal.SIGTERM)
+        }
+        try:
+            replicas.refresh_periodically(
+                options["interval"], stop, on_refresh=self._report
+            )
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+
+    def _report(self, timings):
+        if self.verbosity < 1:
+            return
+        self.stdout.write(
+            "Реплики обновлены: "
+            + ", ".join(f"{alias} {ms:.1f} мс" for alias, ms in timings.items())
+        )
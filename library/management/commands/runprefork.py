@@ -0,0 +1,115 @@
+"""
+Простой WSGI-сервер с предварительным форком.
+
+Родительский процесс открывает сокет, загружает ``WSGI_APPLICATION``
+(``library_site.wsgi``: приложение, middleware и прогрев из
+``library.warmup``), замораживает кучу (``gc.freeze()``, чтобы сборщик
+мусора в детях не трогал унаследованные страницы памяти) и запускает
+``--workers`` дочерних процессов.  Они принимают соединения с общего
+сокета и получают уже загруженные модули, URL и скомпилированные
+шаблоны, так что первый запрос к новому процессу не медленнее
+остальных.  Упавший или отработавший ``--max-requests`` ребёнок
+заменяется новым форком — тоже прогретым.
+
+Каждый ребёнок обслуживает один запрос за раз (``wsgiref``); для
+продакшена подойдёт и ``gunicorn --preload library_site.wsgi``.
+"""
+
+import gc
+import os
+import signal
+import time
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import get_internal_wsgi_application
+
+
+class QuietHandler(WSGIRequestHandler):
+    """Requests are logged by RequestTimingMiddleware, not to stderr."""
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _child(server, max_requests):
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if max_requests:
+        for _ in range(max_requests):
+            server.handle_request()
+    else:
+        server.serve_forever()
+
+
+class Command(BaseCommand):
+    help = "Serve the site with warmed-up, pre-forked WSGI worker processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--bind", default="127.0.0.1:8000", help="host:port")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument(
+            "--max-requests",
+            type=int,
+            default=0,
+            help="Replace a worker after this many requests (0: never)",
+        )
+
+    def handle(self, *args, **options):  # type: ignore[override]
+        host, _, port = options["bind"].rpartition(":")
+        if not port.isdigit() or options["workers"] < 1:
+            raise CommandError(
+                "Укажите --bind host:port и --workers больше нуля."
+            )
+
+        started = time.perf_counter()
+        # Makes WSGI_APPLICATION (library_site.wsgi) run warm_up() too.
+        os.environ["LIBRARY_WARM_UP"] = "1"
+        server = make_server(
+            host or "127.0.0.1",
+            int(port),
+            get_internal_wsgi_application(),
+            server_class=WSGIServer,
+            handler_class=QuietHandler,
+        )
+        gc.collect()
+        gc.freeze()
+        self.stdout.write(
+            f"Приложение загружено за {time.perf_counter() - started:.2f} с, "
+            f"слушаем http://{options['bind']}/ ({options['workers']} процессов)."
+        )
+
+        children = set()
+        stopping = False
+
+        def spawn():
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    _child(server, options["max_requests"])
+                finally:
+                    os._exit(0)
+            children.add(pid)
+
+        def stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+            for pid in children:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+        for _ in range(options["workers"]):
+            spawn()
+        while children:
+            try:
+                pid, _ = os.wait()
+            except ChildProcessError:
+                break
+            children.discard(pid)
+            if not stopping:
+                spawn()
+        server.server_close()
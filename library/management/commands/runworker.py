@@ -0,0 +1,90 @@
+"""
+Команда, выполняющая фоновые задачи из таблицы ``Job``.
+
+Обработчик забирает готовые задачи пачками по ``--batch-size`` и
+выполняет их в пуле из ``--concurrency`` потоков (с ``--processes`` —
+процессов, для задач, нагружающих процессор).  Когда задач нет, очередь
+опрашивается раз в ``--poll-interval`` секунд.  С ``--once`` команда
+выполняет всё, что готово, и завершается — удобно для cron и разработки.
+
+Можно запустить несколько обработчиков одновременно: задача достаётся
+только одному из них.  SIGTERM и Ctrl+C дают закончить текущую пачку.
+"""
+
+import signal
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library import jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=4)
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=4,
+            help="Number of threads (or processes) running jobs",
+        )
+        parser.add_argument(
+            "--processes",
+            action="store_true",
+            help="Run jobs in worker processes instead of threads",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="Seconds between polls of an empty queue",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once no job is due",
+        )
+
+    def handle(self, *args, **options):  # type: ignore[override]
+        if options["batch_size"] < 1 or options["concurrency"] < 1:
+            raise CommandError(
+                "--batch-size и --concurrency должны быть больше нуля."
+            )
+        stop = threading.Event()
+        previous = {
+            signum: signal.signal(signum, lambda *_: stop.set())
+            for signum in (signal.SIGINT, signal.SIGTERM)
+        }
+
+        self.verbosity = options["verbosity"]
+        started = time.perf_counter()
+        try:
+            count = jobs.work(
+                batch_size=options["batch_size"],
+                concurrency=options["concurrency"],
+                processes=options["processes"],
+                poll_interval=options["poll_interval"],
+                once=options["once"],
+                stop=stop,
+                on_batch=self._report,
+            )
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(f"Выполнено задач: {count} за {elapsed:.2f} с.")
+        )
+
+    def _report(self, results):
+        for job, error in results:
+            if error is None:
+                if self.verbosity > 1:
+                    self.stdout.write(f"{job.name} #{job.id}: готово")
+                continue
+            outcome = "отказ" if job.attempts >= job.max_attempts else "повтор позже"
+            last_line = error.strip().splitlines()[-1]
+            self.stderr.write(f"{job.name} #{job.id}: {last_line} ({outcome})")
@@ -0,0 +1,40 @@
+from django.db import migrations
+
+FTS_TABLE = "library_book_fts"
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        "title, author, description, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    # Fill the index from books that already exist; «ё» is folded into «е»
+    # the same way library.search.normalize() does it.
+    columns = ", ".join(
+        f"replace(replace({name}, 'ё', 'е'), 'Ё', 'Е')"
+        for name in ("title", "author", "description")
+    )
+    schema_editor.execute(
+        f"INSERT INTO {FTS_TABLE} (rowid, title, author, description) "
+        f"SELECT id, {columns} FROM library_book"
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0003_book_title_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
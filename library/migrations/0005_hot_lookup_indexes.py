@@ -0,0 +1,82 @@
+# Generated by Django 5.2.4 on 2026-10-18 20:29
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Min
+
+
+def check_duplicate_purchases(apps, schema_editor):
+    """
+    Refuse to add the unique constraint while a user has bought the same
+    book twice.  These are payment records, so an operator resolves them
+    (a refund, a merge) rather than this migration deleting any.
+    """
+    Purchase = apps.get_model('library', 'Purchase')
+    duplicates = list(
+        Purchase.objects.values_list('user_id', 'book_id')
+        .annotate(n=Count('id'))
+        .filter(n__gt=1)
+        .order_by('user_id', 'book_id')
+    )
+    if duplicates:
+        pairs = ', '.join(
+            f'user={user_id} book={book_id} ({n})' for user_id, book_id, n in duplicates
+        )
+        raise RuntimeError(
+            'Повторные покупки одной книги мешают добавить ограничение '
+            f'one_purchase_per_book: {pairs}.  Разберите их вручную и '
+            'повторите migrate.'
+        )
+
+
+def close_duplicate_reservations(apps, schema_editor):
+    """
+    Before the unique constraint can be added, cancel every active
+    reservation of a book except the earliest one per user and put those
+    copies back on the shelf.
+    """
+    Reservation = apps.get_model('library', 'Reservation')
+    Book = apps.get_model('library', 'Book')
+    duplicates = (
+        Reservation.objects.filter(status='reserved')
+        .values('user_id', 'book_id')
+        .annotate(n=Count('id'), keep=Min('id'))
+        .filter(n__gt=1)
+    )
+    for row in duplicates:
+        extra = Reservation.objects.filter(
+            status='reserved', user_id=row['user_id'], book_id=row['book_id']
+        ).exclude(pk=row['keep'])
+        closed = extra.update(status='cancelled')
+        Book.objects.filter(pk=row['book_id']).update(
+            available_copies=F('available_copies') + closed
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0004_book_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['user', 'purchased_at'], name='purchase_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['user', 'reserved_at'], name='reservation_user_date_idx'),
+        ),
+        migrations.RunPython(check_duplicate_purchases, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='purchase',
+            constraint=models.UniqueConstraint(fields=('user', 'book'), name='one_purchase_per_book'),
+        ),
+        migrations.RunPython(close_duplicate_reservations, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='reservation',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'reserved')), fields=('user', 'book'), name='one_active_reservation_per_book'),
+        ),
+    ]
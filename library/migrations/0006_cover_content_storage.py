@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-18 20:35
+
+import library.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0005_hot_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='book',
+            name='cover_image',
+            field=models.ImageField(blank=True, help_text='Обложка книги', null=True, storage=library.storage.cover_storage, upload_to='book_covers/'),
+        ),
+    ]
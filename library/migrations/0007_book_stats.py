@@ -0,0 +1,60 @@
+# Generated by Django 5.2.4 on 2026-10-18 20:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def fill_book_stats(apps, schema_editor):
+    """Count the existing reservations and purchases once."""
+    Reservation = apps.get_model('library', 'Reservation')
+    Purchase = apps.get_model('library', 'Purchase')
+    BookStats = apps.get_model('library', 'BookStats')
+    stats = {}
+    reservations = (
+        Reservation.objects.order_by()
+        .values('book_id')
+        .annotate(total=Count('id'), active=Count('id', filter=Q(status='reserved')))
+    )
+    for row in reservations:
+        stats[row['book_id']] = BookStats(
+            book_id=row['book_id'],
+            active_reservations=row['active'],
+            total_reservations=row['total'],
+        )
+    purchases = (
+        Purchase.objects.order_by()
+        .values('book_id')
+        .annotate(total=Count('id'), revenue=Sum('price'))
+    )
+    for row in purchases:
+        entry = stats.setdefault(row['book_id'], BookStats(book_id=row['book_id']))
+        entry.total_purchases = row['total']
+        entry.revenue = row['revenue'] or 0
+    BookStats.objects.bulk_create(stats.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0006_cover_content_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookStats',
+            fields=[
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='library.book', verbose_name='Книга')),
+                ('active_reservations', models.IntegerField(default=0, verbose_name='Активные бронирования')),
+                ('total_reservations', models.IntegerField(default=0, verbose_name='Всего бронирований')),
+                ('total_purchases', models.IntegerField(default=0, verbose_name='Всего покупок')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Выручка')),
+            ],
+            options={
+                'verbose_name': 'Статистика книги',
+                'verbose_name_plural': 'Статистика книг',
+                'indexes': [models.Index(fields=['total_reservations', 'book'], name='stats_reservations_idx'), models.Index(fields=['total_purchases', 'book'], name='stats_purchases_idx')],
+            },
+        ),
+        migrations.RunPython(fill_book_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-18 20:58
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0008_job'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='reservation',
+            name='status',
+            field=models.CharField(choices=[('reserved', 'Зарезервировано'), ('returned', 'Возвращено'), ('cancelled', 'Отменено'), ('expired', 'Просрочено')], default='reserved', max_length=10, verbose_name='Статус'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['status', 'reserved_at'], name='reservation_status_date_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-18 21:20
+
+from django.db import migrations, models
+
+
+def drop_partition_tables(apps, schema_editor):
+    # The month tables are created by library.archive, not by migrations.
+    ArchivePartition = apps.get_model('library', 'ArchivePartition')
+    for table in ArchivePartition.objects.values_list('table', flat=True):
+        schema_editor.execute(
+            f'DROP TABLE IF EXISTS {schema_editor.quote_name(table)}'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0009_reservation_expiry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivePartition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(unique=True, verbose_name='Месяц')),
+                ('table', models.CharField(max_length=100, unique=True, verbose_name='Таблица')),
+                ('rows', models.PositiveIntegerField(default=0, verbose_name='Строк')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создана')),
+            ],
+            options={
+                'verbose_name': 'Раздел архива бронирований',
+                'verbose_name_plural': 'Разделы архива бронирований',
+                'ordering': ['-month'],
+            },
+        ),
+        migrations.RunPython(migrations.RunPython.noop, drop_partition_tables),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.4 on 2026-10-18 22:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0010_archive_partition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, help_text='Когда книга изменилась'),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-18 21:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0011_book_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AvailabilityEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Время')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='library.book', verbose_name='Книга')),
+            ],
+            options={
+                'verbose_name': 'Изменение наличия',
+                'verbose_name_plural': 'Изменения наличия',
+            },
+        ),
+    ]
@@ -6,8 +6,14 @@
 просто, чтобы было понятно начинающему разработчику.
 """
 
+from datetime import timedelta
+
 from django.conf import settings
+from django.core.paginator import Paginator
 from django.db import models
+from django.utils import timezone
+
+from .storage import cover_storage
 
 
 class Book(models.Model):
@@ -18,6 +24,7 @@ class Book(models.Model):
     description = models.TextField(blank=True, help_text="Описание")
     cover_image = models.ImageField(
         upload_to="book_covers/",
+        storage=cover_storage,
         blank=True,
         null=True,
         help_text="Обложка книги",
@@ -39,20 +46,109 @@ class Book(models.Model):
         blank=True,
         help_text="Цена книги (если книга VIP)",
     )
+    # Время последнего изменения для заголовка Last-Modified.  Обновления
+    # через ``update()``/``bulk_update()`` (library.inventory, importbooks)
+    # ставят его сами: auto_now срабатывает только в save().
+    updated_at = models.DateTimeField(auto_now=True, help_text="Когда книга изменилась")
 
     class Meta:
         ordering = ["title"]
+        # Индекс для постраничного вывода каталога по курсору (title, id).
+        indexes = [
+            models.Index(fields=["title", "id"], name="book_title_id_idx"),
+        ]
         verbose_name = "Книга"
         verbose_name_plural = "Книги"
 
     def __str__(self) -> str:
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        book = super().from_db(db, field_names, values)
+        # The stored cover, so that saving can tell a replaced one
+        # (library.signals.make_cover_thumbnails).
+        if "cover_image" in field_names:
+            book._saved_cover = values[field_names.index("cover_image")]
+        return book
+
     def is_available(self) -> bool:
         """Return True if at least one copy is available."""
         return self.available_copies > 0
 
 
+class HistoryQuerySet(models.QuerySet):
+    """
+    Общие методы для истории пользователя (бронирования и покупки).
+
+    Строки истории выбираются вместе с книгой одним JOIN-запросом и
+    только с теми полями, которые нужны шаблонам, чтобы страница не
+    делала отдельный запрос к книге на каждую строку.
+    """
+
+    history_fields: tuple = ()
+    history_ordering: tuple = ()
+
+    def history_for(self, user):
+        """Rows of ``user``'s history with their book, newest first."""
+        return (
+            self.filter(user=user)
+            .select_related("book")
+            .only(*self.history_fields)
+            .order_by(*self.history_ordering)
+        )
+
+    def history_page(self, user, number=None, per_page=None):
+        """Return one :class:`~django.core.paginator.Page` of history."""
+        per_page = per_page or getattr(settings, "LIBRARY_HISTORY_PAGE_SIZE", 50)
+        return Paginator(self.history_for(user), per_page).get_page(number)
+
+    async def ahistory_page(self, user, number=None, per_page=None):
+        """Async :meth:`history_page`; the page rows are already fetched."""
+        per_page = per_page or getattr(settings, "LIBRARY_HISTORY_PAGE_SIZE", 50)
+        queryset = self.history_for(user)
+        paginator = Paginator(queryset, per_page)
+        # Fill the cached count so the paginator never counts synchronously.
+        paginator.count = await queryset.acount()
+        page = paginator.get_page(number)
+        page.object_list = [row async for row in page.object_list]
+        return page
+
+
+class ReservationQuerySet(HistoryQuerySet):
+    history_fields = (
+        "reserved_at",
+        "return_date",
+        "status",
+        "book_id",
+        "book__title",
+    )
+    history_ordering = ("-reserved_at", "-id")
+
+    def overdue(self, now=None):
+        """
+        Active reservations past their due date, oldest first.  Served by
+        the (status, reserved_at) index.
+        """
+        days = reservation_days()
+        if days is None:
+            return self.none()
+        cutoff = (now or timezone.now()) - timedelta(days=days)
+        return self.filter(status="reserved", reserved_at__lt=cutoff).order_by(
+            "reserved_at", "id"
+        )
+
+
+def reservation_days():
+    """How long a book may be kept (``LIBRARY_RESERVATION_DAYS``)."""
+    return getattr(settings, "LIBRARY_RESERVATION_DAYS", 14)
+
+
+class PurchaseQuerySet(HistoryQuerySet):
+    history_fields = ("purchased_at", "price", "book_id", "book__title")
+    history_ordering = ("-purchased_at", "-id")
+
+
 class Reservation(models.Model):
     """Represents a reservation of a book by a user."""
 
@@ -60,6 +156,7 @@ class Reservation(models.Model):
         ("reserved", "Зарезервировано"),
         ("returned", "Возвращено"),
         ("cancelled", "Отменено"),
+        ("expired", "Просрочено"),
     ]
 
     user = models.ForeignKey(
@@ -87,14 +184,44 @@ class Reservation(models.Model):
         verbose_name="Статус",
     )
 
+    objects = ReservationQuerySet.as_manager()
+
     class Meta:
         ordering = ["-reserved_at"]
+        indexes = [
+            # История пользователя.  Индекс по возрастанию: SQLite читает его
+            # с конца и получает порядок (-reserved_at, -id) без сортировки.
+            models.Index(
+                fields=["user", "reserved_at"], name="reservation_user_date_idx"
+            ),
+            # Поиск просроченных бронирований (команда expirereservations).
+            models.Index(
+                fields=["status", "reserved_at"], name="reservation_status_date_idx"
+            ),
+        ]
+        constraints = [
+            # Не больше одного активного бронирования книги на пользователя.
+            # Этот же частичный индекс обслуживает проверку в reserve_book.
+            models.UniqueConstraint(
+                fields=["user", "book"],
+                condition=models.Q(status="reserved"),
+                name="one_active_reservation_per_book",
+            ),
+        ]
         verbose_name = "Бронирование"
         verbose_name_plural = "Бронирования"
 
     def __str__(self) -> str:
         return f"{self.book.title} – {self.user.username}"
 
+    @property
+    def due_date(self):
+        """Date by which an active reservation must be returned."""
+        days = reservation_days()
+        if self.status != "reserved" or days is None:
+            return None
+        return timezone.localdate(self.reserved_at + timedelta(days=days))
+
 
 class Purchase(models.Model):
     """Represents the purchase of a VIP book by a user."""
@@ -120,10 +247,182 @@ class Purchase(models.Model):
         verbose_name="Цена",
     )
 
+    objects = PurchaseQuerySet.as_manager()
+
     class Meta:
         ordering = ["-purchased_at"]
+        indexes = [
+            models.Index(
+                fields=["user", "purchased_at"], name="purchase_user_date_idx"
+            ),
+        ]
+        constraints = [
+            # Книгу можно купить только один раз; индекс обслуживает
+            # проверки в purchase_book и book_detail.
+            models.UniqueConstraint(
+                fields=["user", "book"], name="one_purchase_per_book"
+            ),
+        ]
         verbose_name = "Покупка"
         verbose_name_plural = "Покупки"
 
     def __str__(self) -> str:
         return f"{self.book.title} – {self.user.username} (покупка)"
+
+
+class BookStatsQuerySet(models.QuerySet):
+    # Orderings that have an index and are therefore cheap to list.
+    popular_orderings = ("total_reservations", "total_purchases")
+
+    def popular(self, limit: int = 10, by: str = "total_reservations"):
+        """
+        The ``limit`` books with the highest ``by`` counter.  Reads
+        ``limit`` entries from the end of the counter's index plus one
+        primary-key lookup per book.
+        """
+        if by not in self.popular_orderings:
+            raise ValueError(f"cannot list popular books by {by!r}")
+        return (
+            self.filter(**{f"{by}__gt": 0})
+            .select_related("book")
+            .order_by(f"-{by}", "-book_id")[:limit]
+        )
+
+
+class BookStats(models.Model):
+    """
+    Счётчики книги, которые иначе пришлось бы считать по всей таблице
+    бронирований и покупок.  Обновляются в тех же транзакциях, что и
+    сами бронирования и покупки (см. ``library.inventory``); сверяет и
+    чинит их команда ``reconcilestats``.  Нет строки — все счётчики нули.
+    """
+
+    book = models.OneToOneField(
+        Book,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="stats",
+        verbose_name="Книга",
+    )
+    active_reservations = models.IntegerField(
+        default=0, verbose_name="Активные бронирования"
+    )
+    total_reservations = models.IntegerField(
+        default=0, verbose_name="Всего бронирований"
+    )
+    total_purchases = models.IntegerField(default=0, verbose_name="Всего покупок")
+    revenue = models.DecimalField(
+        max_digits=12, decimal_places=2, default=0, verbose_name="Выручка"
+    )
+
+    objects = BookStatsQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Списки популярных книг: SQLite читает эти индексы с конца.
+            models.Index(
+                fields=["total_reservations", "book"], name="stats_reservations_idx"
+            ),
+            models.Index(
+                fields=["total_purchases", "book"], name="stats_purchases_idx"
+            ),
+        ]
+        verbose_name = "Статистика книги"
+        verbose_name_plural = "Статистика книг"
+
+    def __str__(self) -> str:
+        return f"Статистика: {self.book_id}"
+
+
+class Job(models.Model):
+    """
+    Отложенная задача для фонового обработчика (см. ``library.jobs`` и
+    команду ``runworker``).  Выполненные задачи удаляются, в таблице
+    остаются только ожидающие, выполняемые и окончательно упавшие.
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "В очереди"),
+        (RUNNING, "Выполняется"),
+        (FAILED, "Ошибка"),
+    ]
+
+    name = models.CharField(max_length=200, verbose_name="Задача")
+    payload = models.JSONField(default=dict, verbose_name="Аргументы")
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default=QUEUED,
+        verbose_name="Статус",
+    )
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Попыток")
+    max_attempts = models.PositiveIntegerField(
+        default=5, verbose_name="Максимум попыток"
+    )
+    run_after = models.DateTimeField(verbose_name="Не раньше")
+    claimed_by = models.CharField(
+        max_length=100, blank=True, verbose_name="Обработчик"
+    )
+    claimed_at = models.DateTimeField(
+        null=True, blank=True, verbose_name="Взята в работу"
+    )
+    last_error = models.TextField(blank=True, verbose_name="Последняя ошибка")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создана")
+
+    class Meta:
+        indexes = [
+            # Выборка готовых к запуску задач в порядке run_after.
+            models.Index(
+                fields=["status", "run_after"], name="job_status_run_after_idx"
+            ),
+        ]
+        verbose_name = "Фоновая задача"
+        verbose_name_plural = "Фоновые задачи"
+
+    def __str__(self) -> str:
+        return f"{self.name} #{self.pk}"
+
+
+class ArchivePartition(models.Model):
+    """
+    Месячная таблица архива закрытых бронирований (см.
+    ``library.archive``).  Сами строки лежат в таблице ``table``, которая
+    создаётся при первом переносе строк за этот месяц; здесь — её список.
+    """
+
+    month = models.DateField(unique=True, verbose_name="Месяц")
+    table = models.CharField(max_length=100, unique=True, verbose_name="Таблица")
+    rows = models.PositiveIntegerField(default=0, verbose_name="Строк")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создана")
+
+    class Meta:
+        ordering = ["-month"]
+        verbose_name = "Раздел архива бронирований"
+        verbose_name_plural = "Разделы архива бронирований"
+
+    def __str__(self) -> str:
+        return self.month.strftime("%Y-%m")
+
+
+class AvailabilityEvent(models.Model):
+    """
+    Изменение числа доступных экземпляров книги.  По этим строкам
+    процессы сайта узнают об изменениях, сделанных в других процессах,
+    и рассылают их подписчикам потока (см. ``library.events``).  Старые
+    строки удаляются при записи новых.
+    """
+
+    book = models.ForeignKey(
+        Book, on_delete=models.CASCADE, related_name="+", verbose_name="Книга"
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Время")
+
+    class Meta:
+        verbose_name = "Изменение наличия"
+        verbose_name_plural = "Изменения наличия"
+
+    def __str__(self) -> str:
+        return f"{self.book_id} #{self.pk}"
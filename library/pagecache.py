@@ -0,0 +1,109 @@
+"""
+Кэш целых страниц для анонимных посетителей.
+
+Большая часть трафика — анонимный просмотр каталога и карточек книг,
+которые для всех анонимов одинаковы.  Декоратор :func:`anonymous_page`
+кладёт готовый HTML такой страницы в кэш под ключом (адрес, метка
+версии) и отдаёт его, не трогая ни ORM, ни шаблоны.  Метки версий ведёт
+``library.caching``: у каталога это «поколение», которое меняется при
+изменении любой книги, у карточки — версия книги.  Бронирование, отмена
+и возврат меняют версию только своей книги (``library.inventory``),
+поэтому сбрасываются ровно её страница и каталог.
+
+Метка же служит ``ETag``, а время изменения — ``Last-Modified``; на
+условный запрос с неизменившейся меткой ответ — ``304 Not Modified``.
+
+Вошедшие пользователи видят свою страницу (покупки, кнопки брони), а
+ожидающее сообщение (``django.contrib.messages``) показывается один
+раз — такие запросы идут мимо кэша, как и раньше.  Страница для кэша
+рисуется по основной базе: отстающая реплика не должна попасть в кэш
+под новой меткой.
+"""
+
+import hashlib
+from functools import wraps
+
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.http import http_date, quote_etag
+
+from .replicas import use_primary
+
+PAGE_KEY = "library:page:{}"
+
+# Stale pages are never asked for again; the timeout only frees space
+# (and bounds how long a page outlives a deploy).
+PAGE_TIMEOUT = 600
+
+
+async def is_cacheable(request) -> bool:
+    """An anonymous GET or HEAD with no message waiting to be shown."""
+    if request.method not in ("GET", "HEAD"):
+        return False
+    user = await request.auser()
+    return not user.is_authenticated and not len(get_messages(request))
+
+
+def anonymous_page(stamp):
+    """
+    Cache the anonymous responses of an async view.  ``stamp`` is an
+    async ``(request, *args, **kwargs) -> (version, modified)`` where
+    ``modified`` is a Unix timestamp; the page is cached under the
+    version and the full URL.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if not await is_cacheable(request):
+                return await view(request, *args, **kwargs)
+            version, modified = await stamp(request, *args, **kwargs)
+            # The request class too: book pages only subscribe to the
+            # availability stream under ASGI (library.events).
+            digest = hashlib.sha1(
+                f"{view.__name__}:{type(request).__name__}:{version}:"
+                f"{request.get_full_path()}".encode()
+            ).hexdigest()
+            etag = quote_etag(digest)
+            modified = int(modified)
+            response = get_conditional_response(
+                request, etag=etag, last_modified=modified
+            )
+            if response is None:
+                response = await _page(request, view, digest, args, kwargs)
+            response.headers["ETag"] = etag
+            response.headers["Last-Modified"] = http_date(modified)
+            patch_cache_control(response, no_cache=True)
+            # A logged-in user must never be given the anonymous copy.
+            patch_vary_headers(response, ("Cookie",))
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+async def _page(request, view, digest, args, kwargs):
+    key = PAGE_KEY.format(digest)
+    entry = await cache.aget(key)
+    if entry is not None:
+        content, content_type = entry
+        return HttpResponse(content, content_type=content_type)
+    with use_primary():
+        response = await view(request, *args, **kwargs)
+    if (
+        request.method == "GET"
+        and response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+    ):
+        await cache.aset(
+            key, (response.content, response["Content-Type"]), PAGE_TIMEOUT
+        )
+    return response
@@ -0,0 +1,154 @@
+"""
+Постраничный вывод каталога по курсору (keyset pagination).
+
+Вместо ``OFFSET`` мы запоминаем ключ последней показанной книги —
+пару ``(title, id)`` — и запрашиваем следующую страницу условием
+«строго после этого ключа».  Такой запрос идёт по индексу
+``(title, id)`` и стоит одинаково и для первой, и для тысячной
+страницы.  Курсор передаётся в адресной строке в виде короткой
+base64-строки.
+"""
+
+import base64
+import json
+
+from django.db.models import Q
+
+
+def encode_cursor(title: str, pk: int) -> str:
+    """Pack a ``(title, id)`` key into an opaque URL-safe cursor."""
+    raw = json.dumps([title, pk], ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """
+    Unpack a cursor produced by :func:`encode_cursor`.  Returns ``None``
+    for anything malformed so that a tampered URL simply shows the first
+    page instead of raising an error.
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        title, pk = json.loads(base64.urlsafe_b64decode(padded).decode("utf-8"))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(title, str) or not isinstance(pk, int):
+        return None
+    return title, pk
+
+
+# ``title >= x`` on its own gives the database a range to seek to in the
+# ``(title, id)`` index; the OR only filters rows with the same title.
+def after_q(title: str, pk: int) -> Q:
+    return Q(title__gte=title) & (Q(title__gt=title) | Q(pk__gt=pk))
+
+
+def before_q(title: str, pk: int) -> Q:
+    return Q(title__lte=title) & (Q(title__lt=title) | Q(pk__lt=pk))
+
+
+class KeysetPage:
+    """
+    One page of books.  Iterating over the page yields the books, so
+    templates that loop over ``books`` keep working unchanged.
+    """
+
+    def __init__(self, object_list, next_cursor=None, prev_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self) -> int:
+        return len(self.object_list)
+
+    def __bool__(self) -> bool:
+        return bool(self.object_list)
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self) -> bool:
+        return self.prev_cursor is not None
+
+
+def _page_query(queryset, per_page, after_key, before_key):
+    """The ``LIMIT`` query for one page plus one row to detect more."""
+    if before_key is not None:
+        return queryset.filter(before_q(*before_key)).order_by("-title", "-pk")[
+            : per_page + 1
+        ]
+    qs = queryset.order_by("title", "pk")
+    if after_key is not None:
+        qs = qs.filter(after_q(*after_key))
+    return qs[: per_page + 1]
+
+
+def _trim(rows, per_page, after_key, before_key):
+    """Cut the extra row and return ``(rows, more_ahead, more_behind)``."""
+    if before_key is not None:
+        more_behind = len(rows) > per_page
+        rows = rows[:per_page]
+        rows.reverse()
+        return rows, True, more_behind
+    return rows[:per_page], len(rows) > per_page, after_key is not None
+
+
+def _make_page(rows, more_ahead, more_behind):
+    next_cursor = prev_cursor = None
+    if rows and more_ahead:
+        next_cursor = encode_cursor(rows[-1].title, rows[-1].pk)
+    if rows and more_behind:
+        prev_cursor = encode_cursor(rows[0].title, rows[0].pk)
+    return KeysetPage(rows, next_cursor=next_cursor, prev_cursor=prev_cursor)
+
+
+def _decode(after, before):
+    after_key = decode_cursor(after)
+    before_key = decode_cursor(before) if after_key is None else None
+    return after_key, before_key
+
+
+def keyset_page(queryset, per_page: int, after: str = "", before: str = ""):
+    """
+    Return a :class:`KeysetPage` of ``queryset`` ordered by ``(title, id)``.
+
+    ``after`` continues forward from a ``next_cursor``; ``before`` walks
+    back from a ``prev_cursor``.  Each call issues one ``LIMIT`` query in
+    the requested direction plus, when a cursor is given, a cheap
+    ``EXISTS`` probe for the opposite direction.
+    """
+    after_key, before_key = _decode(after, before)
+    rows = list(_page_query(queryset, per_page, after_key, before_key))
+    rows, more_ahead, more_behind = _trim(rows, per_page, after_key, before_key)
+
+    if rows and after_key is not None:
+        # The cursor may point at a book that has since been deleted, so
+        # confirm that something really lies before the first row.
+        first = rows[0]
+        more_behind = queryset.filter(before_q(first.title, first.pk)).exists()
+    if rows and before_key is not None:
+        last = rows[-1]
+        more_ahead = queryset.filter(after_q(last.title, last.pk)).exists()
+    return _make_page(rows, more_ahead, more_behind)
+
+
+async def akeyset_page(queryset, per_page: int, after: str = "", before: str = ""):
+    """Async :func:`keyset_page` for async views; same queries."""
+    after_key, before_key = _decode(after, before)
+    rows = [row async for row in _page_query(queryset, per_page, after_key, before_key)]
+    rows, more_ahead, more_behind = _trim(rows, per_page, after_key, before_key)
+
+    if rows and after_key is not None:
+        first = rows[0]
+        more_behind = await queryset.filter(before_q(first.title, first.pk)).aexists()
+    if rows and before_key is not None:
+        last = rows[-1]
+        more_ahead = await queryset.filter(after_q(last.title, last.pk)).aexists()
+    return _make_page(rows, more_ahead, more_behind)
@@ -0,0 +1,92 @@
+"""
+Проверка планов «горячих» запросов.
+
+Здесь собраны запросы, которые выполняются почти на каждой странице:
+каталог, карточка книги, проверки в ``reserve_book`` и
+``purchase_book``, история пользователя, списки популярных книг.  Для каждого мы берём
+``EXPLAIN QUERY PLAN`` и ищем полный просмотр таблицы или сортировку во
+временном B-дереве — оба признака означают, что нужного индекса нет.
+Используется командой ``python manage.py explainhotqueries`` и тестами.
+"""
+
+import re
+import time
+
+from django.contrib.auth import get_user_model
+
+from .models import Book, BookStats, Purchase, Reservation
+from .pagination import after_q, before_q
+
+_SCAN_RE = re.compile(r"^SCAN \w+")
+_INDEX_SCAN_RE = re.compile(r"^SCAN \w+ USING (COVERING )?INDEX ")
+
+
+def hot_queries(user_id: int = 1, book_id: int = 1, title: str = "М"):
+    """Return ``(name, queryset)`` pairs for the hot access paths."""
+    user = get_user_model()(pk=user_id)
+    return [
+        ("catalog: first page", Book.objects.order_by("title", "pk")[:25]),
+        (
+            "catalog: next page",
+            Book.objects.filter(after_q(title, book_id)).order_by("title", "pk")[:25],
+        ),
+        (
+            "catalog: previous page",
+            Book.objects.filter(before_q(title, book_id)).order_by("-title", "-pk")[:25],
+        ),
+        ("book_detail: book", Book.objects.filter(pk=book_id)),
+        (
+            "book_detail / purchase_book: purchased?",
+            Purchase.objects.filter(user=user, book_id=book_id).order_by()[:1],
+        ),
+        (
+            "reserve_book: active reservation?",
+            Reservation.objects.filter(
+                user=user, book_id=book_id, status="reserved"
+            ).order_by()[:1],
+        ),
+        ("user_reservations", Reservation.objects.history_for(user)[:50]),
+        (
+            "expirereservations: overdue batch",
+            Reservation.objects.overdue().values("pk")[:200],
+        ),
+        ("user_purchases", Purchase.objects.history_for(user)[:50]),
+        ("popular: most reserved", BookStats.objects.popular(12, "total_reservations")),
+        ("popular: best sellers", BookStats.objects.popular(12, "total_purchases")),
+    ]
+
+
+def plan_lines(queryset):
+    """Return the ``EXPLAIN QUERY PLAN`` detail lines for ``queryset``."""
+    # SQLite rows look like "<id> <parent> <notused> <detail>".
+    return [line.split(" ", 3)[-1] for line in queryset.explain().splitlines()]
+
+
+def plan_problems(queryset, lines=None):
+    """
+    Return the plan lines of ``queryset`` that indicate a missing index.
+
+    Any ``SCAN`` reads the table from the start.  The only scan we accept
+    is an index scan for an unfiltered query with a ``LIMIT``: it walks
+    the index in order and stops after one page.
+    """
+    if lines is None:
+        lines = plan_lines(queryset)
+    query = queryset.query
+    paged_listing = query.high_mark is not None and not query.where
+    problems = []
+    for line in lines:
+        if line.startswith("USE TEMP B-TREE"):
+            problems.append(line)
+        elif _SCAN_RE.match(line):
+            if not (paged_listing and _INDEX_SCAN_RE.match(line)):
+                problems.append(line)
+    return problems
+
+
+def time_query(queryset, repeat: int = 50) -> float:
+    """Average wall time of evaluating ``queryset`` in milliseconds."""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        list(queryset.all())
+    return (time.perf_counter() - started) * 1000 / repeat
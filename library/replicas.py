@@ -0,0 +1,231 @@
+"""
+Чтение с реплик базы, запись — в основную.
+
+Реплики — это псевдонимы из ``LIBRARY_READ_REPLICAS`` (в настройках их
+добавляет переменная окружения ``LIBRARY_DB_REPLICAS``).  Локально реплика
+— копия ``db.sqlite3``, которую ``python manage.py refreshreplicas``
+периодически обновляет через online backup API SQLite (:func:`refresh`).
+Копия пишется на месте, поэтому открытые соединения реплики видят новые
+данные со следующего запроса.
+
+``ReplicaRouter`` отправляет на реплику только чтения внутри HTTP-запроса
+и только если
+
+* в этом запросе ещё ничего не записано;
+* нет открытой транзакции на основной базе;
+* у браузера нет метки ``PIN_COOKIE``.  Её ставит
+  ``PrimaryPinMiddleware`` после любого запроса, который что-то записал
+  (бронирование, вход, ...), на ``LIBRARY_REPLICA_PIN_SECONDS`` секунд —
+  дольше интервала обновления реплик.  Так страница, на которую
+  ``reserve_book`` перенаправляет пользователя, уже видит его бронь.
+
+Всё, что выполняется вне запросов (команды, обработчик задач), читает
+основную базу.  Значения, которые кладутся в общий кэш, тоже вычисляются
+по основной базе (:func:`use_primary` в ``library.caching``): иначе
+устаревшая копия могла бы попасть в кэш под уже новой версией книги.
+Карточки каталога рисуются из книг, уже прочитанных с реплики, поэтому
+``library.cards`` сверяет версию книги со временем копии реплики
+(:func:`snapshot_times`).
+"""
+
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_COOKIE = "library_primary"
+# time_ns() at which the current copy of a replica was started.
+SNAPSHOT_KEY = "library:replica-snapshot:{}"
+# Changes are stamped (book versions, ...) just before their transaction
+# commits; a copy must start at least this much later to be sure to hold
+# the change.
+COMMIT_MARGIN_NS = 1_000_000_000
+# How often a missing replica file is looked for again, in seconds.
+RECHECK_AFTER = 1.0
+
+
+class RoutingState:
+    """Per-request routing flags, shared by every thread the request uses."""
+
+    __slots__ = ("pinned", "wrote")
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+_state = ContextVar("library_routing_state", default=None)
+_seen = {}  # alias -> (exists, checked_at)
+
+
+def replica_aliases() -> list:
+    return list(getattr(settings, "LIBRARY_READ_REPLICAS", ()))
+
+
+def pin_seconds() -> int:
+    return getattr(settings, "LIBRARY_REPLICA_PIN_SECONDS", 10)
+
+
+def available_replicas() -> list:
+    """Replica aliases whose database file has been created."""
+    now = time.monotonic()
+    found = []
+    for alias in replica_aliases():
+        exists, checked_at = _seen.get(alias, (False, 0.0))
+        if not exists and now - checked_at >= RECHECK_AFTER:
+            exists = os.path.exists(connections[alias].settings_dict["NAME"])
+            _seen[alias] = (exists, now)
+        if exists:
+            found.append(alias)
+    return found
+
+
+@contextmanager
+def routing(pinned=False):
+    """
+    Route reads made inside the block like those of a request; yields
+    the :class:`RoutingState`, which records whether anything was written.
+    """
+    state = RoutingState(pinned=pinned)
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+
+
+@contextmanager
+def use_primary():
+    """Send the reads made inside the block to the primary database."""
+    state = _state.get()
+    if state is None or state.pinned:
+        yield
+        return
+    state.pinned = True
+    try:
+        yield
+    finally:
+        state.pinned = False
+
+
+class ReplicaRouter:
+    """Reads of a request go to a random replica, everything else to ``default``."""
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state.pinned or state.wrote:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        replicas = available_replicas()
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Every alias holds the same rows.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema with the data from refresh().
+        return db == DEFAULT_DB_ALIAS
+
+
+class PrimaryPinMiddleware:
+    """
+    Route the reads of a request (see :class:`ReplicaRouter`) and pin a
+    client that has just written to the primary for a few seconds.
+    Place it before the session middleware so that session writes count.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with routing(pinned=PIN_COOKIE in request.COOKIES) as state:
+            response = self.get_response(request)
+        return self._pin(response, state)
+
+    async def __acall__(self, request):
+        with routing(pinned=PIN_COOKIE in request.COOKIES) as state:
+            response = await self.get_response(request)
+        return self._pin(response, state)
+
+    def _pin(self, response, state):
+        if state.wrote and replica_aliases():
+            response.set_cookie(
+                PIN_COOKIE, "1", max_age=pin_seconds(), httponly=True, samesite="Lax"
+            )
+        return response
+
+
+def copy_database(source, target) -> None:
+    """
+    Copy the SQLite database ``source`` over ``target`` with the online
+    backup API: a consistent snapshot even while ``source`` is written.
+    Readers of ``target`` wait for the copy (up to the busy timeout).
+    """
+    src = sqlite3.connect(source)
+    try:
+        dst = sqlite3.connect(target, timeout=20)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+    finally:
+        src.close()
+
+
+def refresh(aliases=None) -> dict:
+    """Copy ``default`` to every replica; returns ``{alias: ms}``."""
+    source = connections[DEFAULT_DB_ALIAS].settings_dict["NAME"]
+    timings = {}
+    for alias in replica_aliases() if aliases is None else aliases:
+        snapshot = time.time_ns()
+        started = time.perf_counter()
+        copy_database(source, connections[alias].settings_dict["NAME"])
+        timings[alias] = round((time.perf_counter() - started) * 1000, 2)
+        cache.set(SNAPSHOT_KEY.format(alias), snapshot, None)
+    return timings
+
+
+def snapshot_times(aliases) -> dict:
+    """
+    ``{alias: time_ns}`` of the start of each replica's current copy:
+    everything committed before that moment is on the replica.
+    """
+    aliases = list(aliases)
+    found = cache.get_many([SNAPSHOT_KEY.format(alias) for alias in aliases])
+    return {
+        alias: found[SNAPSHOT_KEY.format(alias)]
+        for alias in aliases
+        if SNAPSHOT_KEY.format(alias) in found
+    }
+
+
+def refresh_periodically(interval: float, stop: threading.Event, on_refresh=None):
+    """Call :func:`refresh` every ``interval`` seconds until ``stop`` is set."""
+    while not stop.wait(interval):
+        timings = refresh()
+        if on_refresh is not None:
+            on_refresh(timings)
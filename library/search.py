@@ -0,0 +1,166 @@
+"""
+Полнотекстовый поиск по каталогу.
+
+Индекс хранится в виртуальной таблице SQLite FTS5
+``library_book_fts``, где ``rowid`` совпадает с ``Book.id``.  Токенизатор
+``unicode61`` приводит к нижнему регистру и кириллицу, а букву «ё» мы
+сами заменяем на «е» и при индексации, и в запросе, чтобы «Фёдор» и
+«Федор» находили одно и то же.  Каждое слово запроса ищется по
+префиксу, результаты сортируются по ``bm25``.
+
+Индекс поддерживается сигналами из ``signals.py``; полностью
+пересобрать его можно командой ``python manage.py rebuildsearchindex``.
+На других СУБД поиск откатывается к обычному ``icontains``.
+"""
+
+import re
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import Book
+
+FTS_TABLE = "library_book_fts"
+
+# Weights for bm25(): a hit in the title matters more than in the author,
+# which in turn matters more than a hit in the description.
+RANK_WEIGHTS = (10.0, 5.0, 1.0)
+
+CREATE_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "title, author, description, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+)
+DROP_SQL = f"DROP TABLE IF EXISTS {FTS_TABLE}"
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def is_supported() -> bool:
+    """FTS5 is only available on the SQLite backend."""
+    return connection.vendor == "sqlite"
+
+
+def normalize(text: str) -> str:
+    """Fold «ё» into «е»; case folding is left to the FTS tokenizer."""
+    return (text or "").replace("ё", "е").replace("Ё", "Е")
+
+
+def build_match_query(query: str) -> str:
+    """
+    Turn free user input into an FTS5 expression where every word must
+    match as a prefix, e.g. ``толст война`` → ``"толст"* "война"*``.
+    Quoting each word keeps FTS operators typed by users harmless.
+    """
+    words = _WORD_RE.findall(normalize(query))
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def _row(book):
+    return (
+        book.pk,
+        normalize(book.title),
+        normalize(book.author),
+        normalize(book.description),
+    )
+
+
+def index_book(book) -> None:
+    """Insert or refresh a single book in the index."""
+    if not is_supported():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [book.pk])
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, title, author, description) "
+            "VALUES (%s, %s, %s, %s)",
+            _row(book),
+        )
+
+
+def index_books(books) -> None:
+    """Insert or refresh many books at once, e.g. after ``bulk_create``."""
+    if not is_supported():
+        return
+    rows = [_row(book) for book in books]
+    if not rows:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(row[0],) for row in rows]
+        )
+        _insert_batch(cursor, rows)
+
+
+def remove_book(pk: int) -> None:
+    """Drop a book from the index."""
+    if not is_supported():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [pk])
+
+
+def rebuild_index(batch_size: int = 2000) -> int:
+    """
+    Recreate the whole index from the ``Book`` table.  Rows are streamed
+    with ``iterator()`` and written with ``executemany`` in batches, then
+    the FTS b-trees are merged with ``optimize``.  Returns the number of
+    indexed books.
+    """
+    if not is_supported():
+        return 0
+    books = Book.objects.only("title", "author", "description").iterator(
+        chunk_size=batch_size
+    )
+    total = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(DROP_SQL)
+        cursor.execute(CREATE_SQL)
+        batch = []
+        for book in books:
+            batch.append(_row(book))
+            if len(batch) >= batch_size:
+                total += _insert_batch(cursor, batch)
+                batch = []
+        if batch:
+            total += _insert_batch(cursor, batch)
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+    return total
+
+
+def _insert_batch(cursor, batch) -> int:
+    cursor.executemany(
+        f"INSERT INTO {FTS_TABLE} (rowid, title, author, description) "
+        "VALUES (%s, %s, %s, %s)",
+        batch,
+    )
+    return len(batch)
+
+
+def search_books(query: str, limit: int = 50):
+    """
+    Return up to ``limit`` books matching ``query``, best matches first.
+    The ranked ids come from one FTS query; the books themselves are then
+    fetched with a single ``in_bulk`` lookup.
+    """
+    match = build_match_query(query)
+    if not match:
+        return []
+    if not is_supported():
+        condition = Q()
+        for word in _WORD_RE.findall(query):
+            condition &= (
+                Q(title__icontains=word)
+                | Q(author__icontains=word)
+                | Q(description__icontains=word)
+            )
+        return list(Book.objects.filter(condition)[:limit])
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+            f"ORDER BY bm25({FTS_TABLE}, %s, %s, %s) LIMIT %s",
+            [match, *RANK_WEIGHTS, limit],
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+    books = Book.objects.in_bulk(ids)
+    return [books[pk] for pk in ids if pk in books]
@@ -0,0 +1,99 @@
+"""
+Обработчики сигналов приложения библиотеки.
+
+Подключаются в ``LibraryConfig.ready()``.
+"""
+
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_out
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import archive, caching, search, tasks
+from .auth_backends import forget_user
+from .models import Book, Purchase, Reservation
+
+
+@receiver(post_save, sender=Book, dispatch_uid="library_book_search_index")
+def update_search_index(sender, instance, raw=False, **kwargs):
+    """Keep the full-text index in sync with saved books."""
+    if raw:
+        return
+    search.index_book(instance)
+
+
+@receiver(post_delete, sender=Book, dispatch_uid="library_book_search_remove")
+def remove_from_search_index(sender, instance, **kwargs):
+    """Remove deleted books from the full-text index."""
+    search.remove_book(instance.pk)
+
+
+@receiver(post_save, sender=Book, dispatch_uid="library_book_version_save")
+@receiver(post_delete, sender=Book, dispatch_uid="library_book_version_delete")
+def bump_book_version(sender, instance, **kwargs):
+    """
+    Make cached cards, pages and lookups of a changed book stale once the
+    change is committed; a bump before the commit would let a request
+    cache the old row under the new version.
+    """
+    transaction.on_commit(partial(caching.bump_book_version, instance.pk))
+
+
+@receiver(post_delete, sender=Book, dispatch_uid="library_book_archive_delete")
+def delete_archived_book_rows(sender, instance, **kwargs):
+    """Archive tables have no foreign keys; cascade to them by hand."""
+    archive.delete_archived("book_id", instance.pk)
+
+
+@receiver(post_save, sender=Book, dispatch_uid="library_book_thumbnails")
+def make_cover_thumbnails(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Queue the resized copies of a new or replaced cover."""
+    if raw or not instance.cover_image:
+        return
+    if update_fields is not None and "cover_image" not in update_fields:
+        return
+    name = instance.cover_image.name
+    if name == getattr(instance, "_saved_cover", None):
+        return
+    instance._saved_cover = name
+    tasks.make_thumbnails.enqueue(name)
+
+
+@receiver(post_save, sender=Reservation, dispatch_uid="library_reservation_history_save")
+@receiver(post_delete, sender=Reservation, dispatch_uid="library_reservation_history_delete")
+@receiver(post_save, sender=Purchase, dispatch_uid="library_purchase_history_save")
+@receiver(post_delete, sender=Purchase, dispatch_uid="library_purchase_history_delete")
+def bump_history_version(sender, instance, **kwargs):
+    """
+    Change the user's history stamp once the row is committed, so a poll
+    can never pair the new stamp with the old rows.
+    """
+    user_id = instance.user_id
+    transaction.on_commit(lambda: caching.bump_history_version(user_id))
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL, dispatch_uid="library_user_cache_save")
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL, dispatch_uid="library_user_cache_delete")
+def forget_cached_user(sender, instance, **kwargs):
+    """
+    Change the user's cache stamp after a change (password, last_login,
+    is_active, ...) is committed.  A request that read the old row caches
+    it under the old stamp, where nobody looks for it.
+    """
+    transaction.on_commit(partial(forget_user, instance.pk))
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL, dispatch_uid="library_user_archive_delete")
+def delete_archived_user_rows(sender, instance, **kwargs):
+    """Archive tables have no foreign keys; cascade to them by hand."""
+    archive.delete_archived("user_id", instance.pk)
+
+
+@receiver(user_logged_out, dispatch_uid="library_user_cache_logout")
+def forget_user_on_logout(sender, request, user, **kwargs):
+    """The session itself is flushed by logout(); drop the user too."""
+    if user is not None:
+        forget_user(user.pk)
@@ -0,0 +1,151 @@
+"""
+Профилирование холодного старта процесса Django.
+
+:func:`profile` запускает отдельный интерпретатор с ``-X importtime`` и
+повторяет то, что делает новый WSGI-процесс: ``django.setup()``, импорт
+``WSGI_APPLICATION`` (вместе с прогревом из ``library.warmup``) и два
+запроса к главной странице.  Внутри дочернего процесса замеряется время
+каждого приложения из ``INSTALLED_APPS`` — импорт модуля приложения,
+``models`` и ``ready()``, а вывод ``-X importtime`` разбирается в
+родителе: он показывает, какие модули дороже всего импортировать.
+
+Используется командой ``python manage.py profilestartup``.
+"""
+
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+from typing import NamedTuple
+
+# Runs in the child interpreter; prints one JSON object to stdout.
+PROBE = r"""
+import json
+import time
+
+timings = {"apps": {}, "steps": {}}
+started = time.perf_counter()
+
+
+def ms(since):
+    return round((time.perf_counter() - since) * 1000, 2)
+
+
+def app_timings(label):
+    return timings["apps"].setdefault(
+        label, {"import": 0.0, "models": 0.0, "ready": 0.0}
+    )
+
+
+from functools import partial
+
+from django.apps import config as app_config
+
+create = app_config.AppConfig.create.__func__
+
+
+def timed(method, label, key, *args, **kwargs):
+    since = time.perf_counter()
+    try:
+        return method(*args, **kwargs)
+    finally:
+        app_timings(label)[key] += ms(since)
+
+
+def timed_create(cls, entry):
+    since = time.perf_counter()
+    app = create(cls, entry)
+    app_timings(app.label)["import"] = ms(since)
+    # Per instance: app configs override ready() in their own classes.
+    app.import_models = partial(timed, app.import_models, app.label, "models")
+    app.ready = partial(timed, app.ready, app.label, "ready")
+    return app
+
+
+app_config.AppConfig.create = classmethod(timed_create)
+
+import django
+
+since = time.perf_counter()
+django.setup()
+timings["steps"]["django.setup"] = ms(since)
+
+import sys
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+since = time.perf_counter()
+application = import_string(settings.WSGI_APPLICATION)
+timings["steps"]["wsgi application"] = ms(since)
+# library_site/wsgi.py keeps what its warm_up() call measured.
+wsgi_module = sys.modules[settings.WSGI_APPLICATION.rpartition(".")[0]]
+timings["warm_up"] = getattr(wsgi_module, "warm_up_timings", {})
+
+from library.benchmark import _environ
+
+for step in ("first request", "second request"):
+    since = time.perf_counter()
+    status = []
+    b"".join(application(_environ("/", ""), lambda s, h: status.append(s)))
+    timings["steps"][step] = ms(since)
+    timings["status"] = status[0]
+
+timings["total"] = ms(started)
+print(json.dumps(timings))
+"""
+
+
+class ImportTime(NamedTuple):
+    module: str
+    self_us: int
+    cumulative_us: int
+
+
+def parse_importtime(text: str) -> list:
+    """Parse ``-X importtime`` output into :class:`ImportTime` rows."""
+    rows = []
+    for line in text.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # the header line
+        rows.append(
+            ImportTime(parts[2].strip(), int(parts[0]), int(parts[1]))
+        )
+    return rows
+
+
+def package_totals(rows) -> dict:
+    """``{top-level package: self µs}``, most expensive first."""
+    totals = defaultdict(int)
+    for row in rows:
+        totals[row.module.split(".")[0]] += row.self_us
+    return dict(sorted(totals.items(), key=lambda item: -item[1]))
+
+
+def profile(settings_module=None) -> dict:
+    """
+    Start a fresh interpreter, load the project in it and return its
+    timings plus the parsed import times under ``"imports"``.
+    """
+    env = dict(os.environ)
+    env["DJANGO_SETTINGS_MODULE"] = settings_module or os.environ.get(
+        "DJANGO_SETTINGS_MODULE", "library_site.settings"
+    )
+    # Profile the start of a prefork worker, warm-up included.
+    env.setdefault("LIBRARY_WARM_UP", "1")
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE],
+        capture_output=True,
+        text=True,
+        env=env,
+        cwd=os.getcwd(),
+    )
+    if completed.returncode:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result["imports"] = parse_importtime(completed.stderr)
+    return result
@@ -0,0 +1,174 @@
+"""
+Раздача собранных статических файлов прямо из WSGI-приложения.
+
+``StaticFilesMiddleware`` оборачивает приложение Django (см.
+``library_site/wsgi.py``) и отвечает на запросы к ``STATIC_URL`` сам, не
+доходя до Django.  Файлы из ``STATIC_ROOT`` перечисляются один раз при
+запуске, поэтому обработка запроса — это поиск в словаре без обращений
+к диску, кроме чтения самого файла.
+
+* Если клиент принимает ``br`` или ``gzip`` и у файла есть сжатая
+  копия (их пишет ``collectstatic``, см. ``library.staticfiles``),
+  отдаётся она с ``Content-Encoding`` и ``Vary: Accept-Encoding``.
+* Файлы с хэшем в имени (из манифеста) отдаются с
+  ``Cache-Control: immutable`` на год, остальные — на ``SHORT_MAX_AGE``.
+* ``ETag`` и ``Last-Modified`` позволяют отвечать ``304``.
+
+После ``collectstatic`` сервер нужно перезапустить.
+"""
+
+import json
+import mimetypes
+import os
+from wsgiref.util import FileWrapper
+
+from django.conf import settings
+from django.utils.http import http_date, parse_http_date_safe
+
+# Preferred encodings, best first, and the suffix of their files.
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+FOREVER = "public, max-age=31536000, immutable"
+SHORT_MAX_AGE = 60
+BLOCK_SIZE = 64 * 1024
+
+
+class StaticFile:
+    """One collected file and its precompressed copies."""
+
+    def __init__(self, path, content_type, immutable):
+        self.content_type = content_type
+        self.cache_control = (
+            FOREVER if immutable else f"public, max-age={SHORT_MAX_AGE}"
+        )
+        # encoding ("" for identity) -> (path, size, etag, mtime)
+        self.variants = {}
+        for encoding, suffix in (("", ""), *ENCODINGS):
+            try:
+                stat = os.stat(path + suffix)
+            except FileNotFoundError:
+                continue
+            etag = f'"{stat.st_size:x}-{int(stat.st_mtime):x}{suffix}"'
+            self.variants[encoding] = (
+                path + suffix,
+                stat.st_size,
+                etag,
+                stat.st_mtime,
+            )
+
+    @property
+    def compressed(self) -> bool:
+        return len(self.variants) > 1
+
+    def pick(self, accept_encoding: str):
+        """The best ``(encoding, variant)`` the client accepts."""
+        accepted = _accepted_encodings(accept_encoding)
+        for encoding, _ in ENCODINGS:
+            if encoding in accepted and encoding in self.variants:
+                return encoding, self.variants[encoding]
+        return "", self.variants[""]
+
+
+def _accepted_encodings(header: str) -> set:
+    """Codings listed in ``Accept-Encoding`` without ``q=0``."""
+    accepted = set()
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        if coding:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def _content_type(name: str) -> str:
+    content_type, _ = mimetypes.guess_type(name)
+    content_type = content_type or "application/octet-stream"
+    if content_type.startswith("text/") or content_type in (
+        "application/javascript",
+        "application/json",
+        "image/svg+xml",
+    ):
+        content_type += "; charset=utf-8"
+    return content_type
+
+
+def scan(root, manifest_name="staticfiles.json") -> dict:
+    """Map the name of each file below ``root`` to a :class:`StaticFile`."""
+    immutable = set()
+    try:
+        with open(os.path.join(root, manifest_name), encoding="utf-8") as f:
+            immutable = set(json.load(f).get("paths", {}).values())
+    except (FileNotFoundError, ValueError):
+        pass
+    files = {}
+    for folder, _, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.endswith(tuple(suffix for _, suffix in ENCODINGS)):
+                continue
+            path = os.path.join(folder, filename)
+            name = os.path.relpath(path, root).replace(os.sep, "/")
+            files[name] = StaticFile(path, _content_type(name), name in immutable)
+    return files
+
+
+class StaticFilesMiddleware:
+    """WSGI middleware serving ``STATIC_ROOT`` under ``STATIC_URL``."""
+
+    def __init__(self, application, root=None, prefix=None):
+        self.application = application
+        root = root or settings.STATIC_ROOT
+        self.prefix = prefix or settings.STATIC_URL
+        self.files = scan(root) if root and os.path.isdir(root) else {}
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        if not path.startswith(self.prefix):
+            return self.application(environ, start_response)
+        static_file = self.files.get(path[len(self.prefix):])
+        if static_file is None:
+            return self.application(environ, start_response)
+        if environ["REQUEST_METHOD"] not in ("GET", "HEAD"):
+            start_response("405 Method Not Allowed", [("Allow", "GET, HEAD")])
+            return [b""]
+        return self.serve(static_file, environ, start_response)
+
+    def serve(self, static_file, environ, start_response):
+        encoding, (path, size, etag, mtime) = static_file.pick(
+            environ.get("HTTP_ACCEPT_ENCODING", "")
+        )
+        headers = [
+            ("Cache-Control", static_file.cache_control),
+            ("ETag", etag),
+            ("Last-Modified", http_date(mtime)),
+        ]
+        if static_file.compressed:
+            headers.append(("Vary", "Accept-Encoding"))
+        if _not_modified(environ, etag, mtime):
+            start_response("304 Not Modified", headers)
+            return [b""]
+        headers += [
+            ("Content-Type", static_file.content_type),
+            ("Content-Length", str(size)),
+        ]
+        if encoding:
+            headers.append(("Content-Encoding", encoding))
+        start_response("200 OK", headers)
+        if environ["REQUEST_METHOD"] == "HEAD":
+            return [b""]
+        wrapper = environ.get("wsgi.file_wrapper", FileWrapper)
+        return wrapper(open(path, "rb"), BLOCK_SIZE)
+
+
+def _not_modified(environ, etag, mtime) -> bool:
+    if_none_match = environ.get("HTTP_IF_NONE_MATCH")
+    if if_none_match is not None:
+        return etag in (tag.strip() for tag in if_none_match.split(",")) or (
+            if_none_match.strip() == "*"
+        )
+    since = parse_http_date_safe(environ.get("HTTP_IF_MODIFIED_SINCE", ""))
+    return since is not None and int(mtime) <= since
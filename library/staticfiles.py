@@ -0,0 +1,153 @@
+"""
+Сборка статических файлов для продакшена.
+
+``CompressedManifestStaticFilesStorage`` подключается в ``STORAGES`` и
+работает при ``python manage.py collectstatic``:
+
+1. как и ``ManifestStaticFilesStorage``, копирует файлы с хэшем
+   содержимого в имени (``styles.3f2a1b.css``) и пишет манифест, поэтому
+   файлы можно кэшировать в браузере «навсегда» — новая версия получит
+   новое имя;
+2. для изображений из ``LIBRARY_STATIC_IMAGES`` создаёт уменьшенные
+   копии в AVIF (если Pillow его поддерживает), WebP и JPEG — тем же
+   кодом, что и копии обложек (``library.thumbnails``);
+3. сжимает текстовые файлы в ``.gz`` и, если установлен пакет
+   ``Brotli``, в ``.br``.  Копия сохраняется, только если она заметно
+   меньше оригинала.
+
+Пока ``collectstatic`` не запускался (разработка, тесты), манифеста нет,
+и ``{% static %}`` отдаёт обычные имена файлов.
+
+Отдаёт собранные файлы ``library.static_wsgi.StaticFilesMiddleware``.
+"""
+
+import gzip
+from functools import cache
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import (
+    ManifestStaticFilesStorage,
+    staticfiles_storage,
+)
+from django.core.files.base import ContentFile
+
+from . import thumbnails
+
+try:
+    import brotli
+except ImportError:  # optional: only .gz copies are written
+    brotli = None
+
+# Extensions worth compressing; images and fonts are compressed already.
+COMPRESSIBLE = (".css", ".js", ".mjs", ".json", ".map", ".svg", ".txt", ".xml")
+# Keep a compressed copy only if it saves at least this share of the size.
+MIN_SAVING = 0.05
+
+
+@cache
+def image_formats():
+    """Formats of the static image variants, best first."""
+    # {% static %} imports this module on every web worker; Pillow is
+    # only needed by collectstatic.
+    from PIL import features
+
+    avif = (("AVIF", "avif", {"quality": 55}),) if features.check("avif") else ()
+    return avif + (
+        ("WEBP", "webp", {"quality": 78, "method": 6}),
+        ("JPEG", "jpg", {"quality": 80, "optimize": True, "progressive": True}),
+    )
+
+
+def static_images() -> dict:
+    """``{name: widths}`` of the images that get variants."""
+    return getattr(settings, "LIBRARY_STATIC_IMAGES", {})
+
+
+def image_variants(name: str, storage=None) -> dict:
+    """
+    ``{ext: [(width, name), ...]}`` for the collected variants of the
+    static image ``name``, narrowest first.  Looks only at the manifest,
+    so it costs no file system access; without a manifest it is empty.
+    """
+    storage = storage if storage is not None else staticfiles_storage
+    manifest = getattr(storage, "hashed_files", None)
+    if not manifest:
+        return {}
+    found = {}
+    for _, ext, _ in image_formats():
+        found[ext] = [
+            (width, thumbnails.derivative_name(name, width, ext))
+            for width in static_images().get(name, ())
+            if thumbnails.derivative_name(name, width, ext) in manifest
+        ]
+    return found
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Manifest storage that also writes image variants and gzip/brotli copies."""
+
+    def stored_name(self, name):
+        # Nothing collected yet: fall back to the plain name, like DEBUG.
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        variants = list(self._make_image_variants(paths))
+        if variants:
+            self.save_manifest()
+        yield from variants
+        yield from self._compress()
+
+    def _make_image_variants(self, paths):
+        for name, widths in static_images().items():
+            if name not in paths:
+                continue
+            thumbnails.generate_derivatives(
+                name, storage=self, widths=widths, formats=image_formats()
+            )
+            for width in widths:
+                for _, ext, _ in image_formats():
+                    variant = thumbnails.derivative_name(name, width, ext)
+                    if not self.exists(variant):
+                        continue  # wider than the source
+                    with self.open(variant) as f:
+                        content = ContentFile(f.read())
+                    hashed = self.hashed_name(variant, content)
+                    if not self.exists(hashed):
+                        self._save(hashed, content)
+                    self.hashed_files[self.hash_key(variant)] = hashed
+                    yield variant, hashed, True
+
+    def _compress(self):
+        names = set(self.hashed_files) | set(self.hashed_files.values())
+        for name in sorted(names):
+            if not name.endswith(COMPRESSIBLE) or not self.exists(name):
+                continue
+            data = None
+            for suffix, compress in self._compressors():
+                target = name + suffix
+                if self.exists(target) and (
+                    self.get_modified_time(target) >= self.get_modified_time(name)
+                ):
+                    continue
+                if data is None:
+                    with self.open(name) as f:
+                        data = f.read()
+                packed = compress(data)
+                if self.exists(target):
+                    self.delete(target)
+                if len(packed) > len(data) * (1 - MIN_SAVING):
+                    continue
+                self._save(target, ContentFile(packed))
+                yield name, target, True
+
+    @staticmethod
+    def _compressors():
+        # mtime=0 keeps the .gz bytes identical between runs.
+        yield ".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0)
+        if brotli is not None:
+            yield ".br", lambda data: brotli.compress(data, quality=11)
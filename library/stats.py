@@ -0,0 +1,126 @@
+"""
+Счётчики популярности и выручки книг (модель ``BookStats``).
+
+Счётчики меняются атомарными ``UPDATE ... SET x = x + 1`` внутри тех же
+транзакций, что создают и закрывают бронирования и покупки, поэтому
+они не расходятся с данными при параллельных запросах.  Изменения в
+обход ``library.inventory`` (например, правка бронирования в админке)
+счётчики не трогают: их находит и исправляет :func:`reconcile`
+(команда ``python manage.py reconcilestats``).
+"""
+
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+
+from . import archive
+from .models import BookStats, Purchase, Reservation
+
+COUNTERS = ("active_reservations", "total_reservations", "total_purchases", "revenue")
+
+
+def apply(book_id: int, **deltas) -> None:
+    """
+    Add ``deltas`` to the counters of ``book_id``.  Call it inside the
+    transaction that makes the change being counted.
+    """
+    changes = {field: F(field) + delta for field, delta in deltas.items()}
+    if BookStats.objects.filter(book_id=book_id).update(**changes):
+        return
+    # No row yet: books are created without one.
+    try:
+        with transaction.atomic():
+            BookStats.objects.create(
+                book_id=book_id,
+                **{field: max(delta, 0) for field, delta in deltas.items()},
+            )
+    except IntegrityError:
+        # A concurrent transaction created the row first.
+        BookStats.objects.filter(book_id=book_id).update(**changes)
+
+
+def expected() -> dict:
+    """
+    Recount every counter from the reservation and purchase tables with
+    two ``GROUP BY`` queries, plus one per archive table (archived
+    reservations are all closed).  Returns ``{book_id: {counter: value}}``
+    for books that have any activity.
+    """
+    counts = {}
+    zero = dict.fromkeys(COUNTERS, 0)
+    zero["revenue"] = Decimal("0.00")
+    reservations = (
+        Reservation.objects.order_by()
+        .values("book_id")
+        .annotate(
+            total=Count("id"),
+            active=Count("id", filter=Q(status="reserved")),
+        )
+    )
+    for row in reservations.iterator():
+        counts[row["book_id"]] = {
+            **zero,
+            "active_reservations": row["active"],
+            "total_reservations": row["total"],
+        }
+    for book_id, total in archive.book_totals().items():
+        entry = counts.setdefault(book_id, dict(zero))
+        entry["total_reservations"] += total
+    purchases = (
+        Purchase.objects.order_by()
+        .values("book_id")
+        .annotate(total=Count("id"), revenue=Sum("price"))
+    )
+    for row in purchases.iterator():
+        entry = counts.setdefault(row["book_id"], dict(zero))
+        entry["total_purchases"] = row["total"]
+        entry["revenue"] = row["revenue"] or Decimal("0.00")
+    return counts
+
+
+def reconcile(repair: bool = True, batch_size: int = 1000) -> list:
+    """
+    Compare the stored counters with a fresh recount and, when ``repair``
+    is set, fix the differences with ``bulk_update``/``bulk_create``.
+    Returns ``[(book_id, counter, stored, expected), ...]``.
+
+    Everything runs in one transaction, so the recount and the stored
+    values come from the same snapshot and no increment made meanwhile
+    is overwritten.
+    """
+    with transaction.atomic():
+        return _reconcile(repair, batch_size)
+
+
+def _reconcile(repair, batch_size):
+    wanted = expected()
+    mismatches = []
+    changed, seen = [], set()
+    stored = BookStats.objects.values_list("book_id", *COUNTERS)
+    for book_id, *values in stored.iterator(chunk_size=batch_size):
+        seen.add(book_id)
+        should = wanted.get(book_id)
+        row = BookStats(book_id=book_id, **dict(zip(COUNTERS, values)))
+        differs = False
+        for counter, value in zip(COUNTERS, values):
+            target = should[counter] if should else 0
+            if value != target:
+                mismatches.append((book_id, counter, value, target))
+                setattr(row, counter, target)
+                differs = True
+        if differs:
+            changed.append(row)
+    missing = [
+        BookStats(book_id=book_id, **counters)
+        for book_id, counters in wanted.items()
+        if book_id not in seen
+    ]
+    for row in missing:
+        for counter in COUNTERS:
+            if getattr(row, counter):
+                mismatches.append((row.book_id, counter, 0, getattr(row, counter)))
+    if repair:
+        BookStats.objects.bulk_update(changed, COUNTERS, batch_size=batch_size)
+        BookStats.objects.bulk_create(missing, batch_size=batch_size)
+    return mismatches
@@ -0,0 +1,58 @@
+"""
+Хранилище файлов с адресацией по содержимому.
+
+Имя файла — это SHA-256 его содержимого, поэтому одинаковые обложки
+хранятся на диске один раз: повторная загрузка того же изображения
+просто возвращает имя уже сохранённого файла.  Хэш считается по кускам,
+без чтения всего файла в память.
+
+Используется для ``Book.cover_image``.  Уже накопившиеся дубликаты
+объединяет команда ``python manage.py dedupecovers``.
+"""
+
+import hashlib
+import posixpath
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+CHUNK_SIZE = 64 * 1024
+
+
+def file_digest(chunks) -> str:
+    """SHA-256 hex digest of an iterable of byte chunks."""
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_name(name: str, digest: str) -> str:
+    """``book_covers/cover1.PNG`` + digest → ``book_covers/<digest>.png``."""
+    folder, filename = posixpath.split(name)
+    ext = posixpath.splitext(filename)[1].lower()
+    return posixpath.join(folder, digest + ext)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """``FileSystemStorage`` that names files by the hash of their bytes."""
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+        digest = file_digest(content.chunks(CHUNK_SIZE))
+        name = content_name(self.generate_filename(name), digest)
+        if self.exists(name):
+            # Same bytes are already stored: nothing to write.
+            return name
+        content.seek(0)
+        # Should another process write the same file first, _save() falls
+        # back to a suffixed name; dedupecovers merges such leftovers.
+        return self._save(name, content)
+
+
+def cover_storage():
+    """Storage for ``Book.cover_image``; a callable keeps migrations stable."""
+    return ContentAddressedStorage()
@@ -0,0 +1,80 @@
+"""
+Фоновые задачи приложения библиотеки (см. ``library.jobs``).
+
+Каждая задача может выполниться повторно, поэтому все они безопасны
+для повторного запуска: копии обложек не пересоздаются, если уже есть,
+пересчёт статистики просто сверяет счётчики ещё раз.  Письма при
+повторе могут уйти дважды — это меньшее зло, чем не отправить их.
+"""
+
+import os
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files import File
+
+from . import caching, stats, thumbnails
+from .jobs import task
+from .models import Book
+
+
+@task
+def make_thumbnails(name: str) -> None:
+    """Create the resized copies of the cover stored as ``name``."""
+    if thumbnails.generate_derivatives(name):
+        # Cards cached before the copies existed have no srcset.
+        caching.bump_book_versions(
+            Book.objects.filter(cover_image=name).values_list("pk", flat=True)
+        )
+
+
+@task
+def attach_cover(book_id: int, path: str) -> None:
+    """Copy the image at ``path`` (relative to MEDIA_ROOT) to the book's cover."""
+    book = Book.objects.filter(pk=book_id).first()
+    if book is None or book.cover_image:
+        return
+    with open(os.path.join(settings.MEDIA_ROOT, path), "rb") as f:
+        # save() stores the file and the book; post_save queues the thumbnails.
+        book.cover_image.save(os.path.basename(path), File(f))
+
+
+@task
+def send_reservation_email(user_id: int, book_id: int) -> None:
+    """Confirm a reservation to the user by email."""
+    user = get_user_model().objects.filter(pk=user_id).first()
+    book = Book.objects.filter(pk=book_id).first()
+    if user is None or book is None or not user.email:
+        return
+    from django.core.mail import send_mail
+
+    send_mail(
+        "Бронирование книги",
+        f"Здравствуйте, {user.username}!\n\n"
+        f"Книга «{book.title}» ({book.author}) забронирована на ваше имя.",
+        None,
+        [user.email],
+    )
+
+
+@task
+def send_welcome_email(user_id: int) -> None:
+    """Greet a newly registered user."""
+    user = get_user_model().objects.filter(pk=user_id).first()
+    if user is None or not user.email:
+        return
+    from django.core.mail import send_mail
+
+    send_mail(
+        "Добро пожаловать в библиотеку",
+        f"Здравствуйте, {user.username}!\n\n"
+        "Спасибо за регистрацию. Теперь вы можете бронировать и покупать книги.",
+        None,
+        [user.email],
+    )
+
+
+@task
+def reconcile_stats() -> None:
+    """Repair the BookStats counters (see ``reconcilestats``)."""
+    stats.reconcile()
@@ -0,0 +1,13 @@
+"""Шаблонные теги для каталога книг."""
+
+from django import template
+
+from library.cards import render_cards
+
+register = template.Library()
+
+
+@register.simple_tag
+def book_cards(books):
+    """Render the catalog grid from cached per-book card fragments."""
+    return render_cards(books)
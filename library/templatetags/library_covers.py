@@ -0,0 +1,46 @@
+"""Шаблонный тег для вывода обложек с адаптивными размерами."""
+
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from library.thumbnails import derivatives
+
+register = template.Library()
+
+DEFAULT_SIZES = "(min-width: 992px) 25vw, (min-width: 576px) 50vw, 100vw"
+
+
+def _srcset(storage, variants):
+    return ", ".join(f"{storage.url(name)} {width}w" for width, name in variants)
+
+
+@register.simple_tag
+def cover_image(field, alt="", css_class="", style="", sizes=DEFAULT_SIZES):
+    """
+    Render ``<picture>`` for a cover ``ImageField`` with WebP and JPEG
+    ``srcset`` built from the generated derivatives.  The original file
+    stays the ``src`` fallback, so covers without derivatives still show.
+    """
+    variants = derivatives(field.name, field.storage)
+    img_attrs = [
+        ("src", field.url),
+        ("alt", alt),
+        ("class", css_class),
+        ("style", style),
+        ("loading", "lazy"),
+        ("decoding", "async"),
+    ]
+    if variants["jpg"]:
+        img_attrs += [("srcset", _srcset(field.storage, variants["jpg"])), ("sizes", sizes)]
+    img = format_html(
+        "<img {} />",
+        format_html_join(" ", '{}="{}"', ((k, v) for k, v in img_attrs if v)),
+    )
+    if not variants["webp"]:
+        return img
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}" />{}</picture>',
+        _srcset(field.storage, variants["webp"]),
+        sizes,
+        img,
+    )
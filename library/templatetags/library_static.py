@@ -0,0 +1,55 @@
+"""Шаблонный тег для статических изображений с уменьшенными копиями."""
+
+from django import template
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+
+from library.staticfiles import image_variants
+
+register = template.Library()
+
+MIME_TYPES = {"avif": "image/avif", "webp": "image/webp"}
+
+
+def _srcset(variants):
+    return ", ".join(
+        f"{staticfiles_storage.url(name)} {width}w" for width, name in variants
+    )
+
+
+@register.simple_tag
+def static_picture(name, alt="", css_class="", sizes="100vw", priority=False):
+    """
+    Render ``<picture>`` for the static image ``name`` with AVIF, WebP and
+    JPEG ``srcset`` from the variants made by ``collectstatic``.  Before
+    the files are collected only the original is used.  ``priority``
+    marks an above-the-fold image: loaded eagerly and fetched first.
+    """
+    variants = image_variants(name)
+    img_attrs = [
+        ("src", static(name)),
+        ("alt", alt),
+        ("class", css_class),
+        ("decoding", "async"),
+        ("fetchpriority", "high" if priority else ""),
+        ("loading", "" if priority else "lazy"),
+    ]
+    if variants.get("jpg"):
+        img_attrs += [("srcset", _srcset(variants["jpg"])), ("sizes", sizes)]
+    img = format_html(
+        "<img {} />",
+        format_html_join(" ", '{}="{}"', ((k, v) for k, v in img_attrs if v)),
+    )
+    sources = format_html_join(
+        "",
+        '<source type="{}" srcset="{}" sizes="{}" />',
+        (
+            (mime, _srcset(variants[ext]), sizes)
+            for ext, mime in MIME_TYPES.items()
+            if variants.get(ext)
+        ),
+    )
+    if not sources:
+        return img
+    return format_html("<picture>{}{}</picture>", sources, img)
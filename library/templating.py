@@ -0,0 +1,92 @@
+"""
+Шаблонный бэкенд Django с ленивой загрузкой библиотек тегов.
+
+Обычный ``DjangoTemplates`` при создании импортирует модули
+``templatetags`` всех установленных приложений: crispy-forms, админки и
+т.д. — даже если шаблоны процесса их не используют.  Здесь модули только
+перечисляются, а импортируются при первом ``{% load %}``, поэтому,
+например, crispy-forms загружается только при первой отрисовке формы
+входа или регистрации.
+"""
+
+from importlib import import_module
+from pkgutil import walk_packages
+
+from django.apps import apps
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates
+from django.template.engine import Engine
+from django.template.library import import_library
+
+
+class LazyLibraries(dict):
+    """``{name: Library}`` that imports each library on first access."""
+
+    def __init__(self, paths):
+        super().__init__()
+        self.paths = dict(paths)
+
+    def __missing__(self, name):
+        library = import_library(self.paths[name])
+        self[name] = library
+        return library
+
+    def __contains__(self, name):
+        return name in self.paths
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def keys(self):
+        return self.paths.keys()
+
+    def items(self):
+        return [(name, self[name]) for name in self.paths]
+
+    def values(self):
+        return [self[name] for name in self.paths]
+
+
+class LazyEngine(Engine):
+    def get_template_libraries(self, libraries):
+        return LazyLibraries(libraries)
+
+
+def template_tag_modules():
+    """
+    Yield ``(name, module path)`` for the tag libraries of Django and the
+    installed apps, like Django's ``get_template_tag_modules()`` but
+    without importing the library modules themselves.
+    """
+    candidates = ["django.templatetags"]
+    candidates += [f"{config.name}.templatetags" for config in apps.get_app_configs()]
+    for candidate in candidates:
+        try:
+            package = import_module(candidate)
+        except ImportError:
+            continue
+        if not hasattr(package, "__path__"):
+            continue
+        for module in walk_packages(package.__path__, candidate + "."):
+            if not module.ispkg:
+                yield module.name.removeprefix(candidate + "."), module.name
+
+
+class LazyDjangoTemplates(DjangoTemplates):
+    """``DjangoTemplates`` whose engine imports tag libraries on demand."""
+
+    def __init__(self, params):
+        params = params.copy()
+        options = params.pop("OPTIONS").copy()
+        options.setdefault("autoescape", True)
+        options.setdefault("debug", settings.DEBUG)
+        options.setdefault("file_charset", "utf-8")
+        libraries = dict(template_tag_modules())
+        libraries.update(options.get("libraries", {}))
+        options["libraries"] = libraries
+        # Skip DjangoTemplates.__init__, which builds an eager Engine.
+        super(DjangoTemplates, self).__init__(params)
+        self.engine = LazyEngine(self.dirs, self.app_dirs, **options)
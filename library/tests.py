@@ -1,3 +1,1626 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core import mail
+from django.contrib.sessions.models import Session
+from django.core.cache import cache, caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.utils import ConnectionHandler
+from django.http import Http404
+from django.template import Context, Template, engines
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db.models import Count
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import (
+    archive,
+    benchmark,
+    events,
+    pagecache,
+    caching,
+    cards,
+    inventory,
+    jobs,
+    logfiles,
+    replicas,
+    startup,
+    stats,
+    thumbnails,
+    timing,
+    urls,
+    warmup,
+)
+from .auth_backends import CachedModelBackend, user_key
+from .cache_backends import TieredCache
+from .management.commands import importbooks
+from .models import ArchivePartition, AvailabilityEvent, Book, BookStats, Job, Purchase, Reservation
+from .pagination import decode_cursor, encode_cursor, keyset_page
+from .queryplans import hot_queries, plan_problems
+from .search import rebuild_index, search_books
+from .management.commands.purgesessions import purge_expired
+from .static_wsgi import StaticFilesMiddleware
+
+# Keep test entries out of the development cache directory.
+TEST_CACHES = {
+    "default": {
+        **settings.CACHES["default"],
+        "LOCATION": tempfile.mkdtemp(prefix="library-test-cache-"),
+    },
+    # Test rollbacks reuse user ids without any signal; only
+    # SessionCacheTests caches users (see SESSION_TEST_CACHES).
+    "sessions": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+}
+SESSION_TEST_CACHES = {
+    **TEST_CACHES,
+    "sessions": {
+        **settings.CACHES["sessions"],
+        "LOCATION": tempfile.mkdtemp(prefix="library-test-sessions-"),
+    },
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Duplicate titles make sure the ``id`` tiebreak is respected.
+        for i in range(7):
+            Book.objects.create(title=f"Книга {i // 2}", author="Автор")
+
+    def walk_forward(self, per_page):
+        seen, after = [], ""
+        while True:
+            page = keyset_page(Book.objects.all(), per_page, after=after)
+            seen.extend(b.pk for b in page)
+            if not page.has_next:
+                return seen
+            after = page.next_cursor
+
+    def test_forward_walk_matches_model_ordering(self):
+        expected = list(Book.objects.order_by("title", "pk").values_list("pk", flat=True))
+        self.assertEqual(self.walk_forward(3), expected)
+
+    def test_prev_cursor_returns_previous_page(self):
+        first = keyset_page(Book.objects.all(), 3)
+        self.assertFalse(first.has_previous)
+        second = keyset_page(Book.objects.all(), 3, after=first.next_cursor)
+        back = keyset_page(Book.objects.all(), 3, before=second.prev_cursor)
+        self.assertEqual([b.pk for b in back], [b.pk for b in first])
+        self.assertFalse(back.has_previous)
+        self.assertTrue(back.has_next)
+
+    def test_cursor_roundtrip_and_garbage(self):
+        self.assertEqual(decode_cursor(encode_cursor("Война и мир", 5)), ("Война и мир", 5))
+        self.assertIsNone(decode_cursor("not-a-cursor!"))
+
+    @override_settings(LIBRARY_CATALOG_PAGE_SIZE=4)
+    def test_home_renders_one_page_with_link_to_next(self):
+        response = self.client.get(reverse("home"))
+        self.assertEqual(len(response.context["books"]), 4)
+        self.assertContains(response, "?after=")
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.war = Book.objects.create(
+            title="Война и мир",
+            author="Лев Толстой",
+            description="Эпический роман о войне 1812 года.",
+        )
+        cls.crime = Book.objects.create(
+            title="Преступление и наказание",
+            author="Фёдор Достоевский",
+            description="История о бедном студенте.",
+        )
+
+    def test_prefix_and_case_insensitive_cyrillic(self):
+        self.assertEqual(search_books("ТОЛСТ"), [self.war])
+        self.assertEqual(search_books("преступ наказ"), [self.crime])
+
+    def test_yo_is_folded(self):
+        self.assertEqual(search_books("Федор"), [self.crime])
+        self.assertEqual(search_books("Фёдор"), [self.crime])
+
+    def test_title_hits_rank_above_description_hits(self):
+        other = Book.objects.create(
+            title="Рассказы", author="Автор", description="Сборник о войне."
+        )
+        self.assertEqual(search_books("войн"), [self.war, other])
+
+    def test_signals_keep_index_in_sync(self):
+        self.war.title = "Анна Каренина"
+        self.war.save()
+        self.assertEqual(search_books("каренин"), [self.war])
+        self.assertEqual(search_books("война"), [])
+        self.war.delete()
+        self.assertEqual(search_books("каренин"), [])
+
+    def test_rebuild_index(self):
+        Book.objects.bulk_create([Book(title="Обломов", author="Гончаров")])
+        self.assertEqual(search_books("обломов"), [])
+        self.assertEqual(rebuild_index(), 3)
+        self.assertEqual(len(search_books("обломов")), 1)
+
+    def test_search_view_ignores_fts_syntax(self):
+        response = self.client.get(reverse("search"), {"q": 'толстой" *('})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context["books"]), [self.war])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class InventoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("reader", password="pass")
+        cls.book = Book.objects.create(title="Обломов", author="Гончаров", available_copies=1)
+
+    def test_reserve_until_out_of_stock(self):
+        other = User.objects.create_user("other", password="pass")
+        self.assertEqual(inventory.reserve_copy(self.user, self.book), inventory.RESERVED)
+        self.assertEqual(inventory.reserve_copy(other, self.book), inventory.OUT_OF_STOCK)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 0)
+
+    def test_second_reservation_rolls_back_taken_copy(self):
+        Book.objects.filter(pk=self.book.pk).update(available_copies=2)
+        inventory.reserve_copy(self.user, self.book)
+        self.assertEqual(
+            inventory.reserve_copy(self.user, self.book), inventory.ALREADY_RESERVED
+        )
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 1)
+
+    def test_release_returns_copy_only_once(self):
+        inventory.reserve_copy(self.user, self.book)
+        reservation = Reservation.objects.get()
+        self.assertTrue(inventory.release_copy(reservation, "returned"))
+        self.assertFalse(inventory.release_copy(reservation, "cancelled"))
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 1)
+        self.assertEqual(Reservation.objects.get().status, "returned")
+
+
+@override_settings(CACHES=TEST_CACHES)
+class InventoryStressTests(TransactionTestCase):
+    """Hammer one book from many threads and check nothing is oversold."""
+
+    THREADS = 8
+    ATTEMPTS_PER_THREAD = 25
+    COPIES = 50
+
+    def test_concurrent_reservations_never_oversell(self):
+        book = Book.objects.create(
+            title="Тихий Дон", author="Шолохов", available_copies=self.COPIES
+        )
+        users = User.objects.bulk_create(
+            User(username=f"reader{i}")
+            for i in range(self.THREADS * self.ATTEMPTS_PER_THREAD)
+        )
+        outcomes = []
+        lock = threading.Lock()
+        start = threading.Barrier(self.THREADS)
+
+        def worker(chunk):
+            start.wait()
+            try:
+                for user in chunk:
+                    outcome = inventory.reserve_copy(user, book)
+                    with lock:
+                        outcomes.append(outcome)
+            finally:
+                connection.close()
+
+        step = self.ATTEMPTS_PER_THREAD
+        threads = [
+            threading.Thread(target=worker, args=(users[i * step:(i + 1) * step],))
+            for i in range(self.THREADS)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        book.refresh_from_db()
+        reserved = outcomes.count(inventory.RESERVED)
+        self.assertEqual(len(outcomes), len(users))
+        self.assertEqual(reserved, self.COPIES)
+        self.assertEqual(Reservation.objects.filter(book=book).count(), self.COPIES)
+        self.assertEqual(book.available_copies, 0)
+        self.assertEqual(book.stats.total_reservations, self.COPIES)
+        self.assertEqual(stats.reconcile(repair=False), [])
+        logging.getLogger(__name__).info(
+            "inventory stress: %d attempts, %.0f reservation attempts/s",
+            len(outcomes),
+            len(outcomes) / elapsed,
+        )
+
+
+@override_settings(CACHES=TEST_CACHES)
+class HistoryQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("reader", password="pass")
+
+    def add_history(self, count):
+        books = Book.objects.bulk_create(
+            Book(title=f"Книга {i}", author="Автор", is_vip=True, price=5)
+            for i in range(count)
+        )
+        Reservation.objects.bulk_create(Reservation(user=self.user, book=b) for b in books)
+        Purchase.objects.bulk_create(
+            Purchase(user=self.user, book=b, price=5) for b in books
+        )
+
+    def count_queries(self, url_name):
+        self.client.force_login(self.user)
+        # The archive table list is read once per cache lifetime.
+        archive.partitions()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx)
+
+    def test_query_count_does_not_grow_with_history(self):
+        for url_name in ("user_reservations", "user_purchases"):
+            with self.subTest(url_name=url_name):
+                Reservation.objects.all().delete()
+                Purchase.objects.all().delete()
+                self.add_history(2)
+                short = self.count_queries(url_name)
+                self.add_history(40)
+                self.assertEqual(self.count_queries(url_name), short)
+
+    @override_settings(LIBRARY_HISTORY_PAGE_SIZE=5)
+    def test_history_is_paginated(self):
+        self.add_history(12)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("user_reservations"), {"page": 3})
+        self.assertEqual(len(response.context["reservations"]), 2)
+        self.assertContains(response, "3 из 3")
+
+
+@override_settings(CACHES=TEST_CACHES)
+class HotQueryPlanTests(TestCase):
+    def test_hot_queries_use_indexes(self):
+        for name, queryset in hot_queries():
+            with self.subTest(name):
+                self.assertEqual(plan_problems(queryset), [])
+
+    def test_full_scan_is_reported(self):
+        self.assertTrue(plan_problems(Book.objects.filter(author="Толстой")[:25]))
+        # status leads an index now; return_date is not indexed.
+        self.assertTrue(
+            plan_problems(Reservation.objects.filter(return_date__isnull=False))
+        )
+
+    def test_one_active_reservation_per_user_and_book(self):
+        user = User.objects.create_user("reader", password="pass")
+        book = Book.objects.create(title="Обломов", author="Гончаров")
+        Reservation.objects.create(user=user, book=book, status="returned")
+        Reservation.objects.create(user=user, book=book)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Reservation.objects.create(user=user, book=book)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CardCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = [
+            Book.objects.create(title=f"Книга {i}", author="Автор", available_copies=2)
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        cards.reset_stats()
+
+    def test_warm_render_is_all_hits(self):
+        cold = cards.render_cards(self.books)
+        self.assertEqual(cards.stats(), {"hits": 0, "misses": 3})
+        self.assertEqual(cards.render_cards(self.books), cold)
+        self.assertEqual(cards.stats(), {"hits": 3, "misses": 3})
+
+    def test_saving_a_book_rerenders_only_its_card(self):
+        cards.render_cards(self.books)
+        version = caching.book_version(self.books[1].pk)
+        self.books[1].title = "Новое название"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.books[1].save()
+            # Not before the commit, or the old row could be cached anew.
+            self.assertEqual(caching.book_version(self.books[1].pk), version)
+        html = cards.render_cards(self.books)
+        self.assertIn("Новое название", html)
+        self.assertEqual(cards.stats()["misses"], 4)
+
+    def test_reservation_invalidates_card_after_commit(self):
+        user = User.objects.create_user("reader", password="pass")
+        cards.render_cards(Book.objects.filter(pk=self.books[0].pk))
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.reserve_copy(user, self.books[0])
+        html = cards.render_cards(Book.objects.filter(pk=self.books[0].pk))
+        self.assertIn("Доступно: 1", html)
+
+    def test_book_changed_while_rendering_is_not_cached(self):
+        book = self.books[0]
+        real_versions = cards.book_versions
+
+        def versions_after_an_edit(book_ids):
+            Book.objects.filter(pk=book.pk).update(title="Новое название")
+            caching.bump_book_version(book.pk)
+            return real_versions(book_ids)
+
+        with mock.patch.object(cards, "book_versions", versions_after_an_edit):
+            self.assertNotIn("Новое название", cards.render_cards([book]))
+        html = cards.render_cards(Book.objects.filter(pk=book.pk))
+        self.assertIn("Новое название", html)
+
+    def test_cards_from_a_lagging_replica_are_not_cached(self):
+        books = list(Book.objects.all())
+        for book in books:
+            book._state.db = "replica1"
+        cards.render_cards(books)
+        cards.render_cards(books)
+        self.assertEqual(cards.stats(), {"hits": 0, "misses": 6})
+        # A copy taken after the versions were stamped holds these rows.
+        cache.set(replicas.SNAPSHOT_KEY.format("replica1"), time.time_ns() + 10**10)
+        cards.render_cards(books)
+        cards.render_cards(books)
+        self.assertEqual(cards.stats(), {"hits": 3, "misses": 9})
+
+
+class TieredCacheTests(TestCase):
+    def make_cache(self, **options):
+        location = tempfile.mkdtemp(prefix="library-tiered-")
+        params = {"OPTIONS": {"LOCAL_TIMEOUT": 60, **options}}
+        return TieredCache(location, params), TieredCache(location, params)
+
+    def test_workers_share_the_file_tier(self):
+        worker_a, worker_b = self.make_cache()
+        worker_a.set("book", {"title": "Обломов"})
+        self.assertEqual(worker_b.get("book"), {"title": "Обломов"})
+        self.assertTrue(worker_b.local.get(worker_b.make_key("book"))[0])
+
+    def test_local_tier_is_bounded(self):
+        worker, _ = self.make_cache(LOCAL_MAX_ENTRIES=2)
+        for key in ("a", "b", "c"):
+            worker.set(key, key)
+        self.assertFalse(worker.local.get(worker.make_key("a"))[0])
+        self.assertEqual(worker.get("a"), "a")  # still on disk
+
+    def test_one_worker_replaces_an_expired_entry(self):
+        location = tempfile.mkdtemp(prefix="library-tiered-")
+        workers = [TieredCache(location, {}) for _ in range(16)]
+        for _ in range(100):
+            workers[0].set("lock", 0, 0.001)
+            time.sleep(0.002)
+            barrier = threading.Barrier(len(workers))
+            won = []
+
+            def contend(worker):
+                barrier.wait()
+                won.append(worker.add("lock", 1, 30))
+
+            threads = [
+                threading.Thread(target=contend, args=(worker,)) for worker in workers
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(won.count(True), 1)
+            workers[0].delete("lock")
+
+    def test_shared_only_keys_are_seen_at_once(self):
+        worker_a, worker_b = self.make_cache(SHARED_ONLY_PREFIXES=("stamp:",))
+        worker_a.set("stamp:book", 1)
+        self.assertEqual(worker_b.get("stamp:book"), 1)
+        worker_a.set("stamp:book", 2)
+        self.assertEqual(worker_b.get("stamp:book"), 2)
+        self.assertEqual(async_to_sync(worker_b.aget)("stamp:book"), 2)
+        self.assertFalse(worker_b.local.get(worker_b.make_key("stamp:book"))[0])
+
+    def test_add_is_exclusive_across_workers(self):
+        worker_a, worker_b = self.make_cache()
+        self.assertTrue(worker_a.add("lock", 1, 30))
+        self.assertFalse(worker_b.add("lock", 1, 30))
+        worker_a.delete("lock")
+        self.assertTrue(worker_b.add("lock", 1, 30))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CachedLookupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_get_or_compute_runs_once_while_fresh(self):
+        calls = []
+        compute = lambda: calls.append(1) or len(calls)  # noqa: E731
+        self.assertEqual(caching.get_or_compute("k", compute, 60), 1)
+        self.assertEqual(caching.get_or_compute("k", compute, 60), 1)
+        self.assertEqual(len(calls), 1)
+        self.assertIsNone(cache.get("k:lock"))
+
+    def test_slow_recompute_keeps_the_next_workers_lock(self):
+        def compute():
+            # This worker's lock expires and another worker takes it.
+            cache.delete("k:lock")
+            cache.add("k:lock", "theirs", caching.LOCK_TIMEOUT)
+            return 1
+
+        self.assertEqual(caching.get_or_compute("k", compute, 60), 1)
+        self.assertEqual(cache.get("k:lock"), "theirs")
+
+    def test_get_book_sees_changes_through_version(self):
+        book = Book.objects.create(title="Обломов", author="Гончаров", available_copies=2)
+        self.assertEqual(caching.get_book(book.pk).available_copies, 2)
+        with self.assertNumQueries(0):
+            caching.get_book(book.pk)
+        user = User.objects.create_user("reader", password="pass")
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.reserve_copy(user, book)
+        self.assertEqual(caching.get_book(book.pk).available_copies, 1)
+
+    def test_missing_book_is_404(self):
+        with self.assertRaises(Http404):
+            caching.get_book(999)
+
+
+@override_settings(CACHES=TEST_CACHES, LIBRARY_COVER_WIDTHS=(20, 40, 400))
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp(prefix="library-media-")
+        override = override_settings(MEDIA_ROOT=media)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def make_png(self, size=(80, 120)):
+        buffer = io.BytesIO()
+        Image.new("RGBA", size, (200, 30, 30, 128)).save(buffer, "PNG")
+        return ContentFile(buffer.getvalue(), name="cover.png")
+
+    def test_saving_a_book_generates_variants_once(self):
+        book = Book(title="Обломов", author="Гончаров")
+        book.cover_image.save("cover.png", self.make_png())
+        # Saving only queues the work.
+        name = book.cover_image.name
+        self.assertEqual(thumbnails.derivatives(name), {"webp": [], "jpg": []})
+        self.assertEqual(jobs.run_pending(), 1)
+        variants = thumbnails.derivatives(name)
+        self.assertEqual([w for w, _ in variants["webp"]], [20, 40])
+        self.assertEqual([w for w, _ in variants["jpg"]], [20, 40])
+        self.assertEqual(thumbnails.generate_derivatives(name), 0)
+        self.assertEqual(thumbnails.generate_derivatives(name, force=True), 4)
+
+    def test_only_a_new_cover_is_queued(self):
+        book = Book(title="Обломов", author="Гончаров")
+        book.cover_image.save("cover.png", self.make_png())
+        book.title = "Обрыв"
+        book.save()
+        Book.objects.get(pk=book.pk).save()
+        book.save(update_fields=["title"])
+        self.assertEqual(Job.objects.count(), 1)
+        book.cover_image.save("other.png", self.make_png((60, 90)))
+        self.assertEqual(Job.objects.count(), 2)
+
+    def test_template_tag_emits_srcset(self):
+        book = Book(title="Обломов", author="Гончаров")
+        book.cover_image.save("cover.png", self.make_png())
+        jobs.run_pending()
+        html = Template(
+            "{% load library_covers %}{% cover_image book.cover_image alt=book.title %}"
+        ).render(Context({"book": book}))
+        self.assertIn('type="image/webp"', html)
+        self.assertIn("-40.jpg 40w", html)
+        self.assertIn('alt="Обломов"', html)
+
+    def test_empty_file_is_skipped(self):
+        default_storage.save("book_covers/empty.png", ContentFile(b""))
+        self.assertEqual(thumbnails.generate_derivatives("book_covers/empty.png"), 0)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp(prefix="library-media-")
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.storage = Book._meta.get_field("cover_image").storage
+
+    def test_identical_uploads_are_stored_once(self):
+        first = self.storage.save("book_covers/a.PNG", ContentFile(b"same bytes"))
+        second = self.storage.save("book_covers/b.png", ContentFile(b"same bytes"))
+        self.assertEqual(first, second)
+        self.assertTrue(first.endswith(".png"))
+        self.assertEqual(len(os.listdir(os.path.join(self.media, "book_covers"))), 1)
+
+    def test_dedupecovers_merges_files_and_repoints_books(self):
+        folder = os.path.join(self.media, "book_covers")
+        os.makedirs(folder)
+        for name, data in [("c1.png", b"x" * 10), ("c1_dup.png", b"x" * 10), ("broken.png", b"")]:
+            with open(os.path.join(folder, name), "wb") as f:
+                f.write(data)
+        a = Book.objects.create(title="А", author="А", cover_image="book_covers/c1.png")
+        b = Book.objects.create(title="Б", author="Б", cover_image="book_covers/c1_dup.png")
+        c = Book.objects.create(title="В", author="В", cover_image="book_covers/broken.png")
+        saved_at = b.updated_at
+        version = caching.book_version(b.pk)
+        call_command("dedupecovers", stdout=io.StringIO())
+        a.refresh_from_db()
+        b.refresh_from_db()
+        c.refresh_from_db()
+        self.assertEqual(a.cover_image.name, b.cover_image.name)
+        self.assertGreater(b.updated_at, saved_at)
+        self.assertNotEqual(caching.book_version(b.pk), version)
+        self.assertEqual(c.cover_image.name, "")
+        self.assertEqual(os.listdir(folder), [os.path.basename(a.cover_image.name)])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ImportBooksTests(TestCase):
+    def write(self, name, text):
+        path = os.path.join(tempfile.mkdtemp(prefix="library-import-"), name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+    def test_csv_import_dedupes_and_indexes(self):
+        Book.objects.create(title="Обломов", author="Гончаров")
+        path = self.write(
+            "feed.csv",
+            "title,author,available_copies,is_vip,price\n"
+            "Обломов,Гончаров,5,,\n"
+            "Тихий Дон,Шолохов,4,,\n"
+            "Хоббит,Толкин,1,да,8.49\n"
+            "Хоббит,Толкин,1,да,8.49\n"
+            ",без названия,1,,\n",
+        )
+        out = io.StringIO()
+        call_command("importbooks", path, batch_size=2, stdout=out, stderr=io.StringIO())
+        self.assertIn("создано 2, обновлено 0, пропущено 2, ошибок 1", out.getvalue())
+        hobbit = Book.objects.get(title="Хоббит")
+        self.assertTrue(hobbit.is_vip)
+        self.assertEqual(search_books("шолох")[0].title, "Тихий Дон")
+        self.assertFalse(os.path.exists(path + ".checkpoint"))
+
+    def test_jsonl_update_and_resume_from_checkpoint(self):
+        Book.objects.create(title="Обломов", author="Гончаров", available_copies=1)
+        path = self.write(
+            "feed.jsonl",
+            '{"title": "Обломов", "author": "Гончаров", "description": "Роман",'
+            ' "available_copies": 7}\n'
+            '{"title": "Тихий Дон", "author": "Шолохов"}\n',
+        )
+        with open(path + ".checkpoint", "w") as f:
+            f.write('{"rows": 1}')
+        call_command("importbooks", path, update=True, stdout=io.StringIO())
+        self.assertEqual(Book.objects.get(title="Обломов").description, "")
+        self.assertTrue(Book.objects.filter(title="Тихий Дон").exists())
+
+        call_command("importbooks", path, update=True, restart=True, stdout=io.StringIO())
+        oblomov = Book.objects.get(title="Обломов")
+        self.assertEqual(oblomov.description, "Роман")
+        # The stock is changed by reservations only.
+        self.assertEqual(oblomov.available_copies, 1)
+
+    def test_bad_rows_are_reported_and_skipped(self):
+        path = self.write(
+            "feed.jsonl",
+            '{"title": "Обломов", "author": "Гончаров"}\n'
+            '{"title": "Нос", "author": \n'
+            '{"title": "Бесы", "author": "Достоевский", "available_copies": -3}\n'
+            '{"title": "Тихий Дон", "author": "Шолохов"}\n',
+        )
+        out, err = io.StringIO(), io.StringIO()
+        call_command("importbooks", path, stdout=out, stderr=err)
+        self.assertIn("создано 2, обновлено 0, пропущено 0, ошибок 2", out.getvalue())
+        self.assertIn("Строка 2:", err.getvalue())
+        self.assertIn("Строка 3: negative available_copies", err.getvalue())
+
+    def test_rejected_row_costs_only_itself(self):
+        checked = importbooks._to_book
+
+        def to_book(row):
+            book = checked(row)
+            if book.title == "Бесы":
+                book.available_copies = -1  # slips past the checks
+            return book
+
+        path = self.write(
+            "feed.csv",
+            "title,author\nОбломов,Гончаров\nБесы,Достоевский\nНос,Гоголь\n",
+        )
+        out, err = io.StringIO(), io.StringIO()
+        with mock.patch.object(importbooks, "_to_book", to_book):
+            call_command("importbooks", path, stdout=out, stderr=err)
+        self.assertIn("создано 2, обновлено 0, пропущено 0, ошибок 1", out.getvalue())
+        self.assertIn("Строка 2:", err.getvalue())
+        self.assertEqual(
+            sorted(Book.objects.values_list("title", flat=True)), ["Нос", "Обломов"]
+        )
+
+
+@override_settings(CACHES=TEST_CACHES)
+class BenchmarkTests(TestCase):
+    def test_seed_covers_every_route(self):
+        benchmark.seed(books=50, users=5, reservations=40, purchases=10)
+        self.assertEqual(Book.objects.count(), 50)
+        self.assertFalse(
+            Reservation.objects.filter(status="reserved")
+            .values("user", "book")
+            .annotate(n=Count("id"))
+            .filter(n__gt=1)
+            .exists()
+        )
+        names = {s.name for s in benchmark.scenarios(random.Random(0))}
+        self.assertEqual(names, {p.name for p in urls.urlpatterns})
+
+    def test_compare_flags_regressions(self):
+        base = {"home": {"p95_ms": 10.0, "queries": 1, "errors": 0}}
+        self.assertEqual(
+            benchmark.compare(base, {"home": {"p95_ms": 12.0, "queries": 1, "errors": 0}}),
+            [],
+        )
+        problems = benchmark.compare(
+            base, {"home": {"p95_ms": 20.0, "queries": 3, "errors": 1}}
+        )
+        self.assertEqual(len(problems), 3)
+        self.assertEqual(benchmark.percentile([5, 1, 4, 2, 3], 50), 3)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RequestTimingTests(TestCase):
+    def test_server_timing_header_and_log_line(self):
+        Book.objects.create(title="Обломов", author="Гончаров")
+        with self.assertLogs("library.timing", "INFO") as logs:
+            response = self.client.get(reverse("home"))
+        header = response["Server-Timing"]
+        self.assertIn("app;dur=", header)
+        self.assertIn("db;dur=", header)
+        self.assertIn("tpl;dur=", header)
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line["view"], "home")
+        self.assertEqual(line["status"], 200)
+        self.assertGreaterEqual(line["queries"], 1)
+        self.assertGreater(line["template_ms"], 0)
+
+    async def test_async_views_count_their_queries(self):
+        await Book.objects.acreate(title="Обломов", author="Гончаров")
+        with self.assertLogs("library.timing", "INFO") as logs:
+            await self.async_client.get(reverse("home"))
+        line = json.loads(logs.records[0].getMessage())
+        self.assertGreaterEqual(line["queries"], 1)
+
+    @override_settings(LIBRARY_TIMING_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_untouched(self):
+        response = self.client.get(reverse("home"))
+        self.assertNotIn("Server-Timing", response)
+
+    def test_repeated_statements_are_counted(self):
+        book = Book.objects.create(title="Обломов", author="Гончаров")
+        timings = timing.RequestTimings()
+        with connection.execute_wrapper(timings.execute_wrapper):
+            for _ in range(3):
+                Book.objects.filter(pk=book.pk).first()
+            Book.objects.count()
+        self.assertEqual(timings.queries, 4)
+        self.assertEqual(timings.duplicate_queries, 2)
+        self.assertEqual(timings.repeated()[0][1], 3)
+
+
+class LogFileTests(TestCase):
+    def test_directory_is_created_on_first_write(self):
+        path = os.path.join(tempfile.mkdtemp(prefix="library-logs-"), "new", "t.log")
+        handler = logfiles.WatchedFileHandler(path, delay=True)
+        self.addCleanup(handler.close)
+        self.assertFalse(os.path.exists(os.path.dirname(path)))
+        handler.emit(logging.makeLogRecord({"msg": "line"}))
+        with open(path, encoding="utf-8") as f:
+            self.assertEqual(f.read(), "line\n")
+
+
+class SQLiteProfileTests(TestCase):
+    def test_production_profile_applies_pragmas(self):
+        path = os.path.join(tempfile.mkdtemp(prefix="library-db-"), "profile.sqlite3")
+        handler = ConnectionHandler(
+            {
+                "default": {
+                    "ENGINE": "django.db.backends.sqlite3",
+                    "NAME": path,
+                    **settings.SQLITE_PROFILES["production"],
+                }
+            }
+        )
+        conn = handler["default"]
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("PRAGMA journal_mode")
+                self.assertEqual(cursor.fetchone()[0], "wal")
+                cursor.execute("PRAGMA synchronous")
+                self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+                cursor.execute("PRAGMA busy_timeout")
+                self.assertEqual(cursor.fetchone()[0], 20000)
+            self.assertEqual(conn.transaction_mode, "IMMEDIATE")
+        finally:
+            conn.close()
+
+
+@override_settings(CACHES=TEST_CACHES)
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("reader", password="x")
+        cls.vip = Book.objects.create(
+            title="Хоббит", author="Толкин", is_vip=True, price=Decimal("8.49")
+        )
+        cls.book = Book.objects.create(title="Обломов", author="Гончаров")
+        Purchase.objects.create(user=cls.user, book=cls.vip, price=cls.vip.price)
+        Reservation.objects.create(user=cls.user, book=cls.book)
+
+    async def test_read_views_under_async_client(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse("home"))
+        self.assertContains(response, "Обломов")
+        response = await self.async_client.get(reverse("book_detail", args=[self.vip.pk]))
+        self.assertTrue(response.context["user_has_purchased"])
+        response = await self.async_client.get(reverse("book_detail", args=[self.book.pk]))
+        self.assertFalse(response.context["user_has_purchased"])
+        response = await self.async_client.get(reverse("user_reservations"))
+        self.assertContains(response, "Обломов")
+        response = await self.async_client.get(reverse("user_purchases"))
+        self.assertContains(response, "Хоббит")
+
+    def test_regular_book_page_skips_the_purchase_check(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("book_detail", args=[self.book.pk]))
+        self.assertFalse(response.context["user_has_purchased"])
+        self.assertFalse(any("library_purchase" in q["sql"] for q in queries))
+
+    async def test_missing_book_and_anonymous_history(self):
+        response = await self.async_client.get(reverse("book_detail", args=[10**6]))
+        self.assertEqual(response.status_code, 404)
+        response = await self.async_client.get(reverse("user_purchases"))
+        self.assertEqual(response.status_code, 302)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CatalogApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("reader", password="x")
+        cls.books = [
+            Book.objects.create(title=title, author="Автор", available_copies=2)
+            for title in ["Анна Каренина", "Бесы", "Война и мир", "Идиот", "Обломов"]
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_fields_and_cursor_pagination(self):
+        url = reverse("api_books")
+        response = self.client.get(url, {"fields": "title", "limit": 2})
+        data = response.json()
+        self.assertEqual(data["results"], [{"title": "Анна Каренина"}, {"title": "Бесы"}])
+        titles = []
+        next_url = f"{url}?fields=title&limit=2"
+        while next_url:
+            data = self.client.get(next_url).json()
+            titles += [row["title"] for row in data["results"]]
+            next_url = data["next"]
+        self.assertEqual(titles, [b.title for b in self.books])
+
+    def test_bad_parameters(self):
+        url = reverse("api_books")
+        self.assertEqual(self.client.get(url, {"fields": "title,secret"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"limit": 0}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"cursor": "!!"}).status_code, 400)
+        self.assertEqual(
+            self.client.get(reverse("api_book", args=[10**6])).status_code, 404
+        )
+
+    def test_unchanged_poll_gets_304_without_queries(self):
+        url = reverse("api_books")
+        etag = self.client.get(url)["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        book = self.books[0]
+        book.available_copies = 5
+        with self.captureOnCommitCallbacks(execute=True):
+            book.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_errors_carry_no_etag(self):
+        url = reverse("api_books")
+        response = self.client.get(url, {"fields": "nope"})
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn("ETag", response)
+        response = self.client.get(url, {"cursor": "garbage"})
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn("ETag", response)
+
+    def test_history_needs_login_and_tracks_changes(self):
+        url = reverse("api_reservations")
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertEqual(response.json()["results"], [])
+        etag = response["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.reserve_copy(self.user, self.books[1])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        row = response.json()["results"][0]
+        self.assertEqual(row["book_title"], "Бесы")
+        self.assertEqual(row["status"], "reserved")
+
+        etag = response["ETag"]
+        reservation = Reservation.objects.get(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.release_copy(reservation, "returned")
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class BookStatsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("reader", password="pass")
+        cls.other = User.objects.create_user("other", password="pass")
+        cls.book = Book.objects.create(title="Обломов", author="Гончаров", available_copies=5)
+        cls.vip = Book.objects.create(
+            title="Хоббит", author="Толкин", is_vip=True, price=Decimal("8.49")
+        )
+
+    def test_counters_follow_reservations_and_purchases(self):
+        inventory.reserve_copy(self.user, self.book)
+        inventory.reserve_copy(self.other, self.book)
+        inventory.release_copy(Reservation.objects.get(user=self.user), "returned")
+        inventory.reserve_copy(self.user, self.book)
+        self.client.force_login(self.user)
+        self.client.get(reverse("purchase_book", args=[self.vip.pk]))
+        self.client.get(reverse("purchase_book", args=[self.vip.pk]))
+
+        book_stats = BookStats.objects.get(book=self.book)
+        self.assertEqual(book_stats.active_reservations, 2)
+        self.assertEqual(book_stats.total_reservations, 3)
+        vip_stats = BookStats.objects.get(book=self.vip)
+        self.assertEqual(vip_stats.total_purchases, 1)
+        self.assertEqual(vip_stats.revenue, Decimal("8.49"))
+        self.assertEqual(stats.reconcile(repair=False), [])
+
+    def test_reconcile_repairs_drift(self):
+        inventory.reserve_copy(self.user, self.book)
+        # Changes made behind inventory's back, e.g. in the admin.
+        Reservation.objects.update(status="cancelled")
+        Purchase.objects.create(user=self.user, book=self.vip, price=Decimal("8.49"))
+        out = io.StringIO()
+        call_command("reconcilestats", dry_run=True, stdout=out)
+        self.assertIn("Расхождений: 3 у 2 книг", out.getvalue())
+        self.assertEqual(BookStats.objects.get(book=self.book).active_reservations, 1)
+
+        call_command("reconcilestats", stdout=io.StringIO())
+        self.assertEqual(BookStats.objects.get(book=self.book).active_reservations, 0)
+        self.assertEqual(BookStats.objects.get(book=self.vip).total_purchases, 1)
+        self.assertEqual(stats.reconcile(repair=False), [])
+
+    def test_popular_page_lists_books_by_counter(self):
+        BookStats.objects.create(book=self.book, total_reservations=3)
+        BookStats.objects.create(book=self.vip, total_reservations=7, total_purchases=1)
+        response = self.client.get(reverse("popular"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["most_reserved"], [self.vip, self.book])
+        self.assertEqual(response.context["best_sellers"], [self.vip])
+
+
+# Jobs used by JobQueueTests; they never touch the database.
+ran = []
+
+
+@jobs.task
+def record(value):
+    ran.append((value, threading.current_thread().name))
+
+
+@jobs.task
+def explode():
+    raise RuntimeError("boom")
+
+
+@override_settings(CACHES=TEST_CACHES)
+class JobQueueTests(TestCase):
+    def setUp(self):
+        ran.clear()
+
+    def test_claim_takes_due_jobs_once_in_batches(self):
+        first = record.enqueue(1)
+        second = record.enqueue(2)
+        record.enqueue(3, delay=60)
+        batch = jobs.claim(1, "w1")
+        self.assertEqual([job.id for job in batch], [first.pk])
+        self.assertEqual(batch[0].args, [1])
+        self.assertEqual([job.id for job in jobs.claim(10, "w2")], [second.pk])
+        self.assertEqual(jobs.claim(10, "w3"), [])
+        self.assertEqual(Job.objects.get(pk=first.pk).claimed_by, "w1")
+
+        # A claim abandoned by a dead worker is handed out again.
+        Job.objects.filter(pk=first.pk).update(
+            claimed_at=Job.objects.get(pk=first.pk).claimed_at
+            - timedelta(seconds=jobs.STALE_AFTER + 1)
+        )
+        [job] = jobs.claim(10, "w4")
+        self.assertEqual((job.id, job.attempts), (first.pk, 2))
+
+    def test_abandoned_last_attempt_fails(self):
+        job = record.enqueue(1, max_attempts=1)
+        jobs.claim(10, "w1")
+        Job.objects.filter(pk=job.pk).update(
+            claimed_at=timezone.now() - timedelta(seconds=jobs.STALE_AFTER + 1)
+        )
+        self.assertEqual(jobs.claim(10, "w2"), [])
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.last_error, jobs.STALE_ERROR)
+
+    def test_worker_runs_jobs_in_a_pool_and_deletes_them(self):
+        for value in range(5):
+            record.enqueue(value)
+        out = io.StringIO()
+        call_command("runworker", once=True, batch_size=2, concurrency=2, stdout=out)
+        self.assertIn("Выполнено задач: 5", out.getvalue())
+        self.assertEqual(sorted(value for value, _ in ran), [0, 1, 2, 3, 4])
+        self.assertTrue(all(name.startswith("library-job") for _, name in ran))
+        self.assertFalse(Job.objects.exists())
+
+    def test_failures_back_off_then_fail(self):
+        job = explode.enqueue(max_attempts=2)
+        self.assertEqual(jobs.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertIn("RuntimeError: boom", job.last_error)
+        self.assertGreater(job.run_after, timezone.now())
+
+        # Not due yet; make it due and let it use up its last attempt.
+        self.assertEqual(jobs.run_pending(), 0)
+        Job.objects.update(run_after=timezone.now())
+        jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertEqual(jobs.run_pending(), 0)
+
+    def test_unknown_jobs_are_rejected(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue("library.tests.missing")
+
+    def test_reservation_and_registration_emails_are_deferred(self):
+        book = Book.objects.create(title="Обломов", author="Гончаров")
+        self.client.post(
+            reverse("register"),
+            {
+                "username": "reader",
+                "email": "reader@example.com",
+                "password1": "Sl0w-and-steady",
+                "password2": "Sl0w-and-steady",
+            },
+        )
+        self.client.get(reverse("reserve_book", args=[book.pk]))
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(Job.objects.count(), 2)
+
+        # Run inline: pool threads cannot see this test's uncommitted rows.
+        self.assertEqual(jobs.run_pending(), 2)
+        self.assertEqual(
+            [message.subject for message in mail.outbox],
+            ["Добро пожаловать в библиотеку", "Бронирование книги"],
+        )
+        self.assertIn("«Обломов»", mail.outbox[1].body)
+
+
+@override_settings(CACHES=TEST_CACHES, LIBRARY_RESERVATION_DAYS=14)
+class ReservationExpiryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(f"u{i}", password="pass") for i in range(3)
+        ]
+        cls.book = Book.objects.create(
+            title="Обломов", author="Гончаров", available_copies=5
+        )
+        cls.other = Book.objects.create(title="Нос", author="Гоголь", available_copies=5)
+
+    def reserve(self, user, book, days_ago):
+        inventory.reserve_copy(user, book)
+        reservation = Reservation.objects.get(user=user, book=book, status="reserved")
+        Reservation.objects.filter(pk=reservation.pk).update(
+            reserved_at=timezone.now() - timedelta(days=days_ago)
+        )
+        return reservation
+
+    def test_overdue_reservations_expire_in_grouped_batches(self):
+        late = [
+            self.reserve(self.users[0], self.book, 30),
+            self.reserve(self.users[1], self.book, 20),
+            self.reserve(self.users[2], self.other, 15),
+        ]
+        current = self.reserve(self.users[2], self.book, 3)
+        out = io.StringIO()
+        call_command("expirereservations", dry_run=True, stdout=out)
+        self.assertIn("Просроченных бронирований: 3", out.getvalue())
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(inventory.expire_overdue(batch_size=2), 3)
+        book_updates = [
+            q["sql"] for q in queries if q["sql"].startswith('UPDATE "library_book"')
+        ]
+        # Batch one holds both copies of self.book: one UPDATE for them.
+        self.assertEqual(len(book_updates), 2)
+
+        for reservation in late:
+            reservation.refresh_from_db()
+            self.assertEqual(reservation.status, "expired")
+        current.refresh_from_db()
+        self.assertEqual(current.status, "reserved")
+        self.book.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 4)
+        self.assertEqual(self.other.available_copies, 5)
+        self.assertEqual(stats.reconcile(repair=False), [])
+
+        # Returning an expired reservation does not add a second copy.
+        self.assertFalse(inventory.release_copy(late[0], "returned"))
+        self.assertEqual(inventory.expire_overdue(), 0)
+
+    def test_due_date_is_shown_and_expiry_can_be_turned_off(self):
+        self.reserve(self.users[0], self.book, 20)
+        self.client.force_login(self.users[0])
+        response = self.client.get(reverse("user_reservations"))
+        due = response.context["reservations"][0].due_date
+        self.assertContains(response, f"до {due:%d.%m.%Y}")
+        with self.settings(LIBRARY_RESERVATION_DAYS=None):
+            self.assertEqual(inventory.expire_overdue(), 0)
+        self.assertEqual(inventory.expire_overdue(), 1)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class PageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("reader", password="pass")
+        cls.book = Book.objects.create(title="Обломов", author="Гончаров", available_copies=2)
+        cls.other = Book.objects.create(title="Нос", author="Гоголь", available_copies=2)
+
+    def setUp(self):
+        # Pages from earlier test runs share the stamps of setUpTestData.
+        caching.bump_book_versions([self.book.pk, self.other.pk])
+
+    def test_anonymous_pages_are_cached_and_revalidated(self):
+        for url in (reverse("home"), reverse("book_detail", args=[self.book.pk])):
+            with self.subTest(url=url):
+                first = self.client.get(url)
+                self.assertEqual(first.status_code, 200)
+                self.assertIn("Cookie", first["Vary"])
+                with self.assertNumQueries(0):
+                    second = self.client.get(url)
+                self.assertEqual(second.content, first.content)
+                self.assertEqual(second["ETag"], first["ETag"])
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"])
+                self.assertEqual(response.status_code, 304)
+                response = self.client.get(
+                    url, HTTP_IF_MODIFIED_SINCE=first["Last-Modified"]
+                )
+                self.assertEqual(response.status_code, 304)
+
+    def test_a_reservation_invalidates_only_its_book(self):
+        book_url = reverse("book_detail", args=[self.book.pk])
+        other_url = reverse("book_detail", args=[self.other.pk])
+        before = {url: self.client.get(url) for url in (reverse("home"), book_url, other_url)}
+        updated_at = self.book.updated_at
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.reserve_copy(self.user, self.book)
+        self.book.refresh_from_db()
+        self.assertGreater(self.book.updated_at, updated_at)
+
+        response = self.client.get(book_url, HTTP_IF_NONE_MATCH=before[book_url]["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, f'data-book-copies="{self.book.pk}">1<')
+        self.assertNotEqual(
+            self.client.get(reverse("home"))["ETag"], before[reverse("home")]["ETag"]
+        )
+        with self.assertNumQueries(0):
+            response = self.client.get(other_url, HTTP_IF_NONE_MATCH=before[other_url]["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_logged_in_users_and_pending_messages_bypass_the_cache(self):
+        url = reverse("book_detail", args=[self.book.pk])
+        self.client.get(url)
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertNotIn("ETag", response)
+        self.assertContains(response, "Зарезервировать")
+
+        request = RequestFactory().get(url)
+        request.user = AnonymousUser()
+
+        async def auser():
+            return request.user
+
+        request.auser = auser
+        request._messages = CookieStorage(request)
+        self.assertTrue(async_to_sync(pagecache.is_cacheable)(request))
+        request._messages.add(messages.INFO, "Привет")
+        self.assertFalse(async_to_sync(pagecache.is_cacheable)(request))
+
+
+@override_settings(CACHES=TEST_CACHES, LIBRARY_EVENTS_POLL_INTERVAL=0.05)
+class AvailabilityEventsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("reader", password="pass")
+        cls.book = Book.objects.create(title="Обломов", author="Гончаров", available_copies=2)
+        cls.other = Book.objects.create(title="Нос", author="Гоголь", available_copies=3)
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_stream_sends_a_snapshot_then_the_changes(self):
+        stream = events.stream({self.book.pk}, lifetime=5)
+        self.assertEqual(await anext(stream), f"retry: {events.RETRY_MS}\n\n")
+        snapshot = await anext(stream)
+        self.assertIn(f'"book": {self.book.pk}, "available_copies": 2', snapshot)
+        # No on_commit wake-up inside the test transaction: the change is
+        # found by polling, the way another process's change would be.
+        await sync_to_async(inventory.reserve_copy)(self.user, self.other)
+        await sync_to_async(inventory.reserve_copy)(self.user, self.book)
+        change = await asyncio.wait_for(anext(stream), 2)
+        self.assertEqual(
+            change,
+            "event: availability\n"
+            f'data: {{"book": {self.book.pk}, "available_copies": 1}}\n\n',
+        )
+        hub = events.broker()
+        self.assertEqual(len(hub.subscribers), 1)
+        await stream.aclose()
+        self.assertEqual(hub.subscribers, set())
+
+    async def test_endpoint_validates_and_streams(self):
+        url = reverse("book_events")
+        response = await self.async_client.get(
+            url, {"book": f"{self.book.pk},{self.other.pk}", "timeout": 0}
+        )
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        body = b"".join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(body.count(b"event: availability"), 2)
+        for query in ({}, {"book": "x"}, {"book": "1", "timeout": "soon"}):
+            response = await self.async_client.get(url, query)
+            self.assertEqual(response.status_code, 400)
+
+    @override_settings(LIBRARY_EVENTS_MAX_AGE=3)
+    def test_wsgi_gets_only_the_snapshot(self):
+        started = time.perf_counter()
+        response = self.client.get(reverse("book_events"), {"book": self.book.pk})
+        with self.assertWarnsRegex(Warning, "consume asynchronous iterators"):
+            body = b"".join(response)
+        self.assertLess(time.perf_counter() - started, 1.0)
+        self.assertEqual(body.count(b"event: availability"), 1)
+        # Nor does the book page subscribe to a stream it cannot hold.
+        page = self.client.get(reverse("book_detail", args=[self.book.pk]))
+        self.assertNotContains(page, "availability.js")
+
+    async def test_asgi_book_page_subscribes(self):
+        response = await self.async_client.get(reverse("book_detail", args=[self.book.pk]))
+        self.assertContains(response, "availability.js")
+
+    def test_changes_are_shared_through_the_event_table(self):
+        last = events.latest_id()
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.reserve_copy(self.user, self.other)
+        changes, newest = events.changes_since(last, {self.other.pk})
+        self.assertEqual(changes, {self.other.pk: 2})
+        self.assertGreater(newest, last)
+        self.assertEqual(events.changes_since(newest, {self.other.pk}), ({}, newest))
+        self.assertEqual(events.prune(timezone.now() + timedelta(hours=1)), 1)
+
+    def test_writers_prune_old_events(self):
+        old = AvailabilityEvent.objects.bulk_create(
+            AvailabilityEvent(book=self.book) for _ in range(3)
+        )
+        AvailabilityEvent.objects.filter(pk__in=[e.pk for e in old]).update(
+            created_at=timezone.now() - timedelta(seconds=events.RETENTION + 1)
+        )
+        with mock.patch.object(events, "_pruned_at", None):
+            with self.captureOnCommitCallbacks(execute=True):
+                inventory.reserve_copy(self.user, self.book)
+            self.assertEqual(AvailabilityEvent.objects.count(), 1)
+            # At most once per PRUNE_EVERY seconds in a process.
+            self.assertFalse(events._prune_due())
+
+
+@override_settings(CACHES=TEST_CACHES, LIBRARY_HISTORY_PAGE_SIZE=4)
+class ArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("reader", password="pass")
+        cls.other = User.objects.create_user("other", password="pass")
+        cls.books = Book.objects.bulk_create(
+            Book(title=f"Книга {i}", author="Автор") for i in range(3)
+        )
+        now = timezone.now()
+        # Ten old closed reservations over several months, one old active
+        # loan and one recent closed one: only the ten are archived.
+        ages = [200 + 31 * i for i in range(10)] + [300, 10]
+        statuses = ["returned", "cancelled", "expired"] * 4
+        statuses[10] = "reserved"
+        for i, (age, status) in enumerate(zip(ages, statuses)):
+            reservation = Reservation.objects.create(
+                user=cls.user, book=cls.books[i % 3], status=status
+            )
+            Reservation.objects.filter(pk=reservation.pk).update(
+                reserved_at=now - timedelta(days=age)
+            )
+        Reservation.objects.create(user=cls.other, book=cls.books[0], status="returned")
+        Reservation.objects.filter(user=cls.other).update(
+            reserved_at=now - timedelta(days=400)
+        )
+        stats.reconcile()
+
+    def setUp(self):
+        cache.delete(archive.PARTITIONS_KEY)
+        self.addCleanup(cache.delete, archive.PARTITIONS_KEY)
+
+    def history_ids(self):
+        ids, number = [], 1
+        while True:
+            page = archive.history_page(self.user, number)
+            ids += [row.pk for row in page]
+            if not page.has_next():
+                return ids
+            number += 1
+
+    def archive(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return archive.archive_closed(**kwargs)
+
+    def test_closed_rows_move_to_month_tables_and_history_is_merged(self):
+        before = self.history_ids()
+        self.assertEqual(len(before), 12)
+        self.assertEqual(self.archive(batch_size=4), 11)
+
+        self.assertEqual(Reservation.objects.count(), 2)
+        self.assertEqual(
+            set(Reservation.objects.values_list("status", flat=True)),
+            {"reserved", "expired"},
+        )
+        found = archive.partitions()
+        months = [partition.month for partition in found]
+        self.assertEqual(months, sorted(months, reverse=True))
+        self.assertTrue(all(month.day == 1 for month in months))
+        self.assertEqual(
+            sum(ArchivePartition.objects.values_list("rows", flat=True)), 11
+        )
+        self.assertEqual(self.history_ids(), before)
+        self.assertEqual(stats.reconcile(repair=False), [])
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("user_reservations"), {"page": 3})
+        rows = response.context["reservations"]
+        self.assertEqual([row.pk for row in rows], before[8:])
+        self.assertContains(response, rows[0].book.title)
+        self.assertContains(response, "3 из 3")
+        self.assertEqual(self.archive(), 0)
+
+    def test_an_interrupted_run_resumes_where_it_stopped(self):
+        with mock.patch("library.archive.time.sleep", side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self.archive(batch_size=3, pause=1)
+        self.assertEqual(archive.candidates().count(), 8)
+        self.assertEqual(self.archive(batch_size=3), 8)
+        self.assertEqual(Reservation.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(
+            sum(ArchivePartition.objects.values_list("rows", flat=True)), 11
+        )
+
+    def test_api_cursor_pages_through_archived_rows(self):
+        url = reverse("api_reservations")
+        self.client.force_login(self.user)
+        before = self.client.get(url, {"limit": 50}).json()["results"]
+        self.archive()
+        results, page = [], url + "?limit=5"
+        while page:
+            body = self.client.get(page).json()
+            results += body["results"]
+            page = body["next"]
+        self.assertEqual(results, before)
+        self.assertEqual(self.client.get(url, {"cursor": "bad"}).status_code, 400)
+
+    def test_deleting_a_user_deletes_the_archived_rows(self):
+        self.archive()
+        self.other.delete()
+        self.assertEqual(archive.book_totals()[self.books[0].pk], 4)
+        self.assertEqual(
+            sum(ArchivePartition.objects.values_list("rows", flat=True)), 10
+        )
+
+
+@override_settings(
+    CACHES=TEST_CACHES,
+    LIBRARY_STATIC_IMAGES={"images/hero.png": (64, 128)},
+)
+class StaticPipelineTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.root = tempfile.mkdtemp(prefix="library-static-")
+        cls.addClassCleanup(shutil.rmtree, cls.root)
+        cls.enterClassContext(override_settings(STATIC_ROOT=cls.root))
+        call_command("collectstatic", interactive=False, verbosity=0)
+
+    def environ(self, path, **headers):
+        return {"REQUEST_METHOD": "GET", "PATH_INFO": path, **headers}
+
+    def call(self, app, environ):
+        captured = {}
+
+        def start_response(status, headers):
+            captured["status"] = status
+            captured["headers"] = dict(headers)
+
+        body = b"".join(app(environ, start_response))
+        return captured["status"], captured["headers"], body
+
+    def test_collectstatic_hashes_compresses_and_makes_variants(self):
+        from django.contrib.staticfiles.storage import staticfiles_storage
+
+        hashed = staticfiles_storage.stored_name("css/styles.css")
+        self.assertRegex(hashed, r"^css/styles\.[0-9a-f]{12}\.css$")
+        path = os.path.join(self.root, hashed)
+        with open(path, "rb") as f, open(path + ".gz", "rb") as packed:
+            self.assertEqual(gzip.decompress(packed.read()), f.read())
+        # Images are not compressed again.
+        hero = os.path.join(self.root, "images", "hero.png")
+        self.assertFalse(os.path.exists(hero + ".gz"))
+
+        html = Template(
+            "{% load library_static %}"
+            '{% static_picture "images/hero.png" priority=True %}'
+        ).render(Context())
+        self.assertIn('type="image/webp"', html)
+        self.assertRegex(
+            html, r"/static/images/thumbs/hero-128\.[0-9a-f]{12}\.jpg 128w"
+        )
+        self.assertIn('fetchpriority="high"', html)
+
+    def test_middleware_serves_precompressed_files(self):
+        from django.contrib.staticfiles.storage import staticfiles_storage
+
+        def django_app(environ, start_response):
+            start_response("200 OK", [])
+            return [b"django"]
+
+        app = StaticFilesMiddleware(django_app, root=self.root)
+        url = staticfiles_storage.url("vendor_bootstrap.min.css")
+        status, headers, body = self.call(
+            app, self.environ(url, HTTP_ACCEPT_ENCODING="br;q=0, gzip, deflate")
+        )
+        self.assertEqual(status, "200 OK")
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+        self.assertEqual(headers["Vary"], "Accept-Encoding")
+        self.assertIn("immutable", headers["Cache-Control"])
+        self.assertEqual(int(headers["Content-Length"]), len(body))
+        self.assertTrue(gzip.decompress(body).startswith(b"@charset"))
+
+        status, plain, body = self.call(app, self.environ(url))
+        self.assertNotIn("Content-Encoding", plain)
+        self.assertNotEqual(plain["ETag"], headers["ETag"])
+        status, _, _ = self.call(
+            app,
+            self.environ(
+                url, HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=headers["ETag"]
+            ),
+        )
+        self.assertEqual(status, "304 Not Modified")
+
+        # Unhashed names get a short lifetime; other paths reach Django.
+        _, headers, _ = self.call(app, self.environ("/static/css/styles.css"))
+        self.assertNotIn("immutable", headers["Cache-Control"])
+        for path in ("/static/missing.css", "/books/"):
+            self.assertEqual(self.call(app, self.environ(path))[2], b"django")
+
+
+@override_settings(CACHES=TEST_CACHES)
+class StartupTests(TestCase):
+    def test_tag_libraries_are_imported_on_first_load(self):
+        params = {**settings.TEMPLATES[0], "NAME": "lazy"}
+        del params["BACKEND"]
+        backend = timing.TimedDjangoTemplates(params)
+        libraries = backend.engine.template_libraries
+        self.assertIn("crispy_forms_tags", libraries)
+        self.assertFalse(dict.__contains__(libraries, "crispy_forms_tags"))
+
+        backend.from_string("{% load crispy_forms_tags %}")
+        self.assertTrue(dict.__contains__(libraries, "crispy_forms_tags"))
+        self.assertFalse(dict.__contains__(libraries, "admin_list"))
+
+    def test_warm_up_compiles_project_templates(self):
+        # Closing the connections would break the test transaction.
+        with mock.patch.object(warmup, "connections"):
+            timings = warmup.warm_up()
+        self.assertEqual(
+            list(timings),
+            ["urls", "middleware", "templates", "static", "cache", "database"],
+        )
+        names = set(warmup.template_names(engines.all()[0]))
+        self.assertIn("library/home.html", names)
+
+    def test_parse_importtime(self):
+        rows = startup.parse_importtime(
+            "import time: self [us] | cumulative | imported package\n"
+            "import time:       120 |        120 |   _io\n"
+            "import time:      2500 |       4000 | django.db\n"
+            "import time:      1500 |       1500 |     django.db.models\n"
+            "unrelated line\n"
+        )
+        self.assertEqual(
+            rows,
+            [
+                startup.ImportTime("_io", 120, 120),
+                startup.ImportTime("django.db", 2500, 4000),
+                startup.ImportTime("django.db.models", 1500, 1500),
+            ],
+        )
+        self.assertEqual(
+            startup.package_totals(rows), {"django": 4000, "_io": 120}
+        )
+
+
+@override_settings(CACHES=SESSION_TEST_CACHES)
+class SessionCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("reader", password="pass")
+
+    def setUp(self):
+        # User ids are reused between tests; the cache directory is not.
+        caches["sessions"].clear()
+        self.client.force_login(self.user)
+        self.client.get(reverse("home"))
+
+    def auth_queries(self, path):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        return response, [
+            query["sql"]
+            for query in queries
+            if "django_session" in query["sql"] or "auth_user" in query["sql"]
+        ]
+
+    def test_warm_authenticated_request_runs_no_auth_queries(self):
+        response, queries = self.auth_queries(reverse("home"))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Мои бронирования")
+        self.assertEqual(queries, [])
+
+    def test_password_change_logs_other_sessions_out(self):
+        self.assertIsNotNone(caches["sessions"].get(user_key(self.user.pk)))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.set_password("new-pass")
+            self.user.save()
+        self.assertIsNone(caches["sessions"].get(user_key(self.user.pk)))
+        response = self.client.get(reverse("user_reservations"))
+        self.assertEqual(response.status_code, 302)
+
+    def test_row_read_before_a_change_is_never_served(self):
+        stale_key = user_key(self.user.pk)
+        stale = User.objects.get(pk=self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = "Илья"
+            self.user.save()
+        # A request that read the row before the commit caches it late.
+        caches["sessions"].set(stale_key, stale)
+        user = CachedModelBackend().get_user(self.user.pk)
+        self.assertEqual(user.first_name, "Илья")
+
+    def test_logout_drops_session_and_user(self):
+        session_key = self.client.session.session_key
+        self.client.post(reverse("logout"))
+        self.assertIsNone(caches["sessions"].get(user_key(self.user.pk)))
+        self.assertFalse(Session.objects.filter(pk=session_key).exists())
+        response = self.client.get(reverse("home"))
+        self.assertNotContains(response, "Мои бронирования")
+
+    def test_purge_deletes_only_expired_sessions_in_batches(self):
+        now = timezone.now()
+        for i in range(5):
+            Session.objects.create(
+                session_key=f"expired{i}",
+                session_data="",
+                expire_date=now - timedelta(days=1),
+            )
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(purge_expired(now=now, batch_size=2), 5)
+        deletes = [q for q in queries if q["sql"].startswith("DELETE")]
+        self.assertEqual(len(deletes), 3)
+        self.assertEqual(Session.objects.count(), 1)  # the live login
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ReplicaRoutingTests(TransactionTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # The aliases benchmark.replica_copies() registers while it runs.
+        cls.databases = cls.databases | {"bench_replica1", "bench_replica2"}
+
+    def test_reads_use_replicas_until_the_request_writes(self):
+        book = Book.objects.create(title="Обломов", author="Гончаров")
+        directory = tempfile.mkdtemp(prefix="library-replicas-")
+        # A long interval: the copy is refreshed by hand below.
+        with benchmark.replica_copies(2, directory, interval=60) as aliases:
+            Book.objects.filter(pk=book.pk).update(title="Обрыв")
+            # Outside a request everything reads the primary.
+            self.assertEqual(Book.objects.get(pk=book.pk).title, "Обрыв")
+            with replicas.routing() as state:
+                stale = Book.objects.get(pk=book.pk)
+                self.assertIn(stale._state.db, aliases)
+                self.assertEqual(stale.title, "Обломов")
+                with replicas.use_primary():
+                    self.assertEqual(Book.objects.get(pk=book.pk).title, "Обрыв")
+                stale.save(update_fields=["available_copies"])
+                self.assertTrue(state.wrote)
+                # Read-your-writes: the rest of the request stays on the primary.
+                self.assertEqual(Book.objects.get(pk=book.pk)._state.db, "default")
+            with replicas.routing(pinned=True):
+                self.assertEqual(Book.objects.get(pk=book.pk).title, "Обрыв")
+            replicas.refresh()
+            with replicas.routing():
+                self.assertEqual(Book.objects.get(pk=book.pk).title, "Обрыв")
+            self.assertEqual(set(replicas.snapshot_times(aliases)), set(aliases))
+        self.assertNotIn(aliases[0], connections)
+
+    def test_writing_request_pins_the_client(self):
+        book = Book.objects.create(title="Обломов", author="Гончаров")
+        user = User.objects.create_user("reader", password="pass")
+        self.client.force_login(user)
+        directory = tempfile.mkdtemp(prefix="library-replicas-")
+        with benchmark.replica_copies(1, directory, interval=60):
+            response = self.client.get(reverse("book_detail", args=[book.pk]))
+            self.assertNotIn(replicas.PIN_COOKIE, response.cookies)
+            response = self.client.get(reverse("reserve_book", args=[book.pk]))
+            cookie = response.cookies[replicas.PIN_COOKIE]
+            self.assertEqual(cookie["max-age"], settings.LIBRARY_REPLICA_PIN_SECONDS)
+            # The page reserve_book redirects to reads the primary.
+            response = self.client.get(response.url)
+            self.assertContains(response, "Обломов")
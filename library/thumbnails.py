@@ -0,0 +1,129 @@
+"""
+Уменьшенные копии обложек книг.
+
+Для каждой обложки создаются копии нескольких ширин в форматах WebP и
+JPEG рядом с оригиналом, в подкаталоге ``thumbs``::
+
+    book_covers/cover1.png
+    book_covers/thumbs/cover1-160.webp
+    book_covers/thumbs/cover1-160.jpg
+    ...
+
+Копии шире исходного изображения не создаются.  Копия считается
+актуальной, если она новее оригинала, поэтому повторный запуск ничего
+не пересчитывает.  Копии создаются фоновой задачей, которую ставит в
+очередь сохранение книги (см. ``signals.py`` и ``tasks.py``), а для уже
+загруженных обложек — командой ``python manage.py makethumbnails``.  В шаблонах их выводит тег
+``{% cover_image %}`` из ``library_covers``.
+"""
+
+import io
+import posixpath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+# Target widths in pixels; the catalog cards are about 300px wide.
+DEFAULT_WIDTHS = (160, 320, 480)
+
+# Pillow format name, file extension and save options for each variant.
+FORMATS = (
+    ("WEBP", "webp", {"quality": 80, "method": 4}),
+    ("JPEG", "jpg", {"quality": 82, "optimize": True, "progressive": True}),
+)
+
+
+def cover_widths():
+    return tuple(getattr(settings, "LIBRARY_COVER_WIDTHS", DEFAULT_WIDTHS))
+
+
+def derivative_name(name: str, width: int, ext: str) -> str:
+    """``book_covers/cover1.png`` → ``book_covers/thumbs/cover1-160.webp``."""
+    folder, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(folder, "thumbs", f"{stem}-{width}.{ext}")
+
+
+def derivatives(name: str, storage=default_storage):
+    """
+    Return ``{ext: [(width, name), ...]}`` for the derivatives of ``name``
+    that exist in ``storage``, narrowest first.
+    """
+    found = {}
+    for _, ext, _ in FORMATS:
+        found[ext] = [
+            (width, derivative_name(name, width, ext))
+            for width in cover_widths()
+            if storage.exists(derivative_name(name, width, ext))
+        ]
+    return found
+
+
+def _is_fresh(name: str, target: str, storage) -> bool:
+    try:
+        return storage.get_modified_time(target) >= storage.get_modified_time(name)
+    except (FileNotFoundError, NotImplementedError):
+        return False
+
+
+def _flatten(image):
+    """JPEG has no alpha channel: put transparent covers on white."""
+    from PIL import Image
+
+    if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def generate_derivatives(
+    name: str,
+    force: bool = False,
+    storage=default_storage,
+    widths=None,
+    formats=FORMATS,
+) -> int:
+    """
+    Create the missing or outdated derivatives of the cover ``name``.
+    Returns how many files were written.  Unreadable or empty images are
+    skipped rather than raising, so one broken upload does not stop a
+    backfill.  ``widths`` and ``formats`` default to the cover settings;
+    the static pipeline passes its own.
+    """
+    # Pillow is imported here, not at module level: web processes load
+    # this module (through the signals) but never resize anything.
+    from PIL import Image, UnidentifiedImageError
+
+    if not name or not storage.exists(name):
+        return 0
+    try:
+        with storage.open(name, "rb") as source:
+            image = Image.open(source)
+            image.load()
+    except (UnidentifiedImageError, OSError):
+        return 0
+    image = _flatten(image)
+
+    written = 0
+    for width in widths or cover_widths():
+        if width > image.width:
+            continue
+        targets = [
+            (fmt, derivative_name(name, width, ext), options)
+            for fmt, ext, options in formats
+        ]
+        if not force and all(_is_fresh(name, t, storage) for _, t, _ in targets):
+            continue
+        height = round(image.height * width / image.width)
+        resized = image.resize((width, height), Image.LANCZOS)
+        for fmt, target, options in targets:
+            buffer = io.BytesIO()
+            resized.save(buffer, fmt, **options)
+            if storage.exists(target):
+                storage.delete(target)
+            storage.save(target, ContentFile(buffer.getvalue()))
+            written += 1
+    return written
@@ -0,0 +1,235 @@
+"""
+Замер времени обработки запросов.
+
+``RequestTimingMiddleware`` для каждого запроса (или для случайной их
+доли, см. ``LIBRARY_TIMING_SAMPLE_RATE``) считает:
+
+* полное время обработки;
+* число SQL-запросов и время, проведённое в базе;
+* повторяющиеся запросы — один и тот же SQL, выполненный несколько раз,
+  обычно означает N+1 (например, ``res.book.title`` в цикле);
+* время отрисовки шаблонов (через бэкенд ``TimedDjangoTemplates``).
+
+Итог уходит в заголовок ``Server-Timing`` (его показывают инструменты
+разработчика браузера) и одной JSON-строкой в логгер ``library.timing``,
+который в настройках пишет в файл (см. ``library.logfiles``).
+
+Запросы считаются обёрткой из ``connection.execute_wrappers``, шаблоны — через
+обёртку над обычным бэкендом Django, поэтому накладные расходы — пара
+вызовов ``perf_counter`` на запрос к базе и на шаблон.
+"""
+
+import json
+import logging
+import random
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import Template
+
+from .templating import LazyDjangoTemplates
+
+logger = logging.getLogger("library.timing")
+
+# Statements longer than this are cut in the log.
+SQL_PREVIEW = 200
+# How many of the most repeated statements to log.
+TOP_REPEATED = 3
+
+_current = ContextVar("library_request_timings", default=None)
+
+
+class RequestTimings:
+    """Counters collected while one request is being handled."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_time = 0.0
+        self.statements = Counter()
+        self.template_time = 0.0
+        self._template_depth = 0
+
+    @property
+    def queries(self) -> int:
+        return sum(self.statements.values())
+
+    @property
+    def duplicate_queries(self) -> int:
+        """Queries whose SQL had already run earlier in the request."""
+        return self.queries - len(self.statements)
+
+    def repeated(self):
+        """The most repeated statements as ``[(sql, count), ...]``."""
+        return [
+            (sql[:SQL_PREVIEW], count)
+            for sql, count in self.statements.most_common(TOP_REPEATED)
+            if count > 1
+        ]
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.statements[sql] += 1
+
+    @contextmanager
+    def template(self):
+        # Included templates render inside their parent; time only the
+        # outermost one so nothing is counted twice.
+        self._template_depth += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._template_depth -= 1
+            if not self._template_depth:
+                self.template_time += time.perf_counter() - started
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        timings = _current.get()
+        if timings is None:
+            return super().render(context, request)
+        with timings.template():
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(LazyDjangoTemplates):
+    """The Django template backend that reports render time (see templating.py)."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 2)
+
+
+def _sample_rate():
+    """The configured rate if this request is measured, else ``None``."""
+    rate = getattr(settings, "LIBRARY_TIMING_SAMPLE_RATE", 1.0)
+    if rate <= 0 or (rate < 1 and random.random() >= rate):
+        return None
+    return rate
+
+
+def _record_query(execute, sql, params, many, context):
+    """Execute wrapper that reports to the current request, if measured."""
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    return timings.execute_wrapper(execute, sql, params, many, context)
+
+
+def _install(connection):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+@receiver(connection_created, dispatch_uid="library.timing")
+def _install_on_connect(sender, connection, **kwargs):
+    # Connections belong to threads, and an async view runs its queries
+    # in the sync_to_async thread rather than in the one running this
+    # middleware, so every connection gets the wrapper when it opens.
+    _install(connection)
+
+
+@contextmanager
+def _measuring(timings):
+    # The wrapper stays installed: under ASGI concurrent requests can
+    # share a connection, and each of them finds its own timings through
+    # the context variable.  Connections opened before this module was
+    # imported are covered here, for the current thread.
+    for connection in connections.all(initialized_only=True):
+        _install(connection)
+    token = _current.set(timings)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+class RequestTimingMiddleware:
+    """
+    Add ``Server-Timing`` and log a JSON line for sampled requests.
+    Should be first in ``MIDDLEWARE`` so that the time includes sessions
+    and authentication.  Works in both sync and async stacks.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        rate = _sample_rate()
+        if rate is None:
+            return self.get_response(request)
+        timings = RequestTimings()
+        with _measuring(timings):
+            response = self.get_response(request)
+        return self._report(request, response, timings, rate)
+
+    async def __acall__(self, request):
+        rate = _sample_rate()
+        if rate is None:
+            return await self.get_response(request)
+        timings = RequestTimings()
+        with _measuring(timings):
+            response = await self.get_response(request)
+        return self._report(request, response, timings, rate)
+
+    def _report(self, request, response, timings, rate):
+        total = time.perf_counter() - timings.started
+        response["Server-Timing"] = ", ".join(
+            [
+                f"app;dur={_ms(total)}",
+                f'db;dur={_ms(timings.db_time)};desc="{timings.queries} queries, '
+                f'{timings.duplicate_queries} repeated"',
+                f"tpl;dur={_ms(timings.template_time)}",
+            ]
+        )
+        if logger.isEnabledFor(logging.INFO):
+            self._log(request, response, timings, total, rate)
+        return response
+
+    def _log(self, request, response, timings, total, rate):
+        match = request.resolver_match
+        logger.info(
+            json.dumps(
+                {
+                    "ts": round(time.time(), 3),
+                    "method": request.method,
+                    "path": request.path,
+                    "view": match.view_name if match else None,
+                    "status": response.status_code,
+                    "total_ms": _ms(total),
+                    "db_ms": _ms(timings.db_time),
+                    "queries": timings.queries,
+                    "duplicate_queries": timings.duplicate_queries,
+                    "repeated": timings.repeated(),
+                    "template_ms": _ms(timings.template_time),
+                    "sample_rate": rate,
+                },
+                ensure_ascii=False,
+            )
+        )
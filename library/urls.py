@@ -7,12 +7,16 @@ dispatch requests to the corresponding view functions defined in
 
 from django.urls import path
 
-from . import views
+from . import api, views
 
 
 urlpatterns = [
     path("", views.home, name="home"),
+    path("search/", views.search, name="search"),
+    path("popular/", views.popular, name="popular"),
     path("books/<int:pk>/", views.book_detail, name="book_detail"),
+    # Server-sent events with the availability of ?book=... (library/events.py).
+    path("books/events/", views.book_events, name="book_events"),
     path("books/<int:pk>/reserve/", views.reserve_book, name="reserve_book"),
     path(
         "books/<int:pk>/purchase/", views.purchase_book, name="purchase_book"
@@ -30,4 +34,9 @@ urlpatterns = [
         name="return_book",
     ),
     path("register/", views.register, name="register"),
+    # Read-only JSON API (see library/api.py).
+    path("api/books/", api.books, name="api_books"),
+    path("api/books/<int:pk>/", api.book, name="api_book"),
+    path("api/reservations/", api.reservations, name="api_reservations"),
+    path("api/purchases/", api.purchases, name="api_purchases"),
 ]
\ No newline at end of file
@@ -4,47 +4,164 @@
 Здесь определены функции, которые отвечают за отображение страниц,
 создание бронирований, покупок и регистрацию пользователей.  Код
 написан максимально просто — без сложных классов и миксинов.
+
+Страницы только для чтения (каталог, карточка книги, история)
+асинхронные: под ASGI они работают прямо в цикле событий и не
+переходят в поток на каждый запрос.  Остальные представления
+синхронные.
+
+Поток наличия книг (``book_events``) — тоже асинхронный: соединение
+ждёт событий в цикле событий, не занимая поток.
+
+Каталог и карточку книги анонимным посетителям отдаёт кэш целых страниц
+с ``ETag``/``Last-Modified`` (``library.pagecache``).
+
+Письма и прочая работа, без которой можно ответить пользователю,
+ставятся в очередь фоновых задач (``library.tasks``) и выполняются
+командой ``runworker``.
 """
 
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.decorators import login_required
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
-from django.utils import timezone
 
-from .forms import UserRegistrationForm
-from .models import Book, Reservation
+from . import archive, caching, events, inventory, tasks
+from .pagecache import anonymous_page
+from .models import Book, BookStats, Reservation
 from .models import Purchase
+from .pagination import akeyset_page
+from .search import search_books
+
+
+async def _load_user(request):
+    """
+    Resolve ``request.user`` on the event loop.  Templates and context
+    processors then read a plain user object instead of a lazy one that
+    would query the session synchronously.
+    """
+    request.user = await request.auser()
+    return request.user
+
+
+async def _catalog_stamp(request):
+    generation = await caching.acatalog_generation()
+    # The generation is the time_ns of the last change to any book.
+    return generation, generation // 1_000_000_000
 
 
-def home(request):
-    """Display a list of all books."""
+async def _book_stamp(request, pk: int):
+    version = await caching.abook_version(pk)
+    book = await caching.aget_book(pk)
+    return version, book.updated_at.timestamp()
+
+
+@anonymous_page(_catalog_stamp)
+async def home(request):
+    """
+    Display the book catalog.  When ``LIBRARY_CATALOG_PAGE_SIZE`` is set
+    the catalog is split into pages addressed by ``?after=`` / ``?before=``
+    cursors; otherwise every book is shown on one page.
+    """
     books = Book.objects.all()
+    per_page = getattr(settings, "LIBRARY_CATALOG_PAGE_SIZE", None)
+    if per_page:
+        books = await akeyset_page(
+            books,
+            per_page,
+            after=request.GET.get("after", ""),
+            before=request.GET.get("before", ""),
+        )
+    else:
+        books = [book async for book in books]
+    await _load_user(request)
     return render(request, "library/home.html", {"books": books})
 
 
-def book_detail(request, pk: int):
+@anonymous_page(_book_stamp)
+async def book_detail(request, pk: int):
     """Display detailed information for a single book."""
-    book = get_object_or_404(Book, pk=pk)
-    # Determine if the current user has already purchased this VIP book
-    user_has_purchased = False
-    if request.user.is_authenticated and book.is_vip:
-        user_has_purchased = Purchase.objects.filter(
-            user=request.user, book=book
-        ).exists()
+    user = await _load_user(request)
+    book = await caching.aget_book(pk)
+    # Only VIP books can be purchased.
+    user_has_purchased = (
+        book.is_vip
+        and user.is_authenticated
+        and await Purchase.objects.filter(user=user, book_id=pk).aexists()
+    )
     context = {
         "book": book,
         "user_has_purchased": user_has_purchased,
+        "live_availability": events.streams_supported(request),
     }
     return render(request, "library/book_detail.html", context)
 
 
+async def book_events(request):
+    """
+    Stream the availability of the books in ``?book=`` (repeated or
+    comma-separated) as server-sent events; see ``library.events``.
+    """
+    try:
+        book_ids = {
+            int(part)
+            for value in request.GET.getlist("book")
+            for part in value.split(",")
+            if part.strip()
+        }
+        lifetime = min(float(request.GET.get("timeout", events.max_age())), events.max_age())
+    except ValueError:
+        return HttpResponseBadRequest("book and timeout must be numbers")
+    if not 1 <= len(book_ids) <= events.MAX_BOOKS:
+        return HttpResponseBadRequest(f"pass 1 to {events.MAX_BOOKS} books")
+    if not events.streams_supported(request):
+        # A WSGI worker would be held until the stream ends.
+        lifetime = 0
+    response = StreamingHttpResponse(
+        events.stream(book_ids, lifetime), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    # Ask nginx and similar proxies not to buffer the stream.
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def popular(request):
+    """The most reserved and the best-selling books."""
+    size = getattr(settings, "LIBRARY_POPULAR_SIZE", 12)
+    context = {
+        "most_reserved": [
+            row.book for row in BookStats.objects.popular(size, "total_reservations")
+        ],
+        "best_sellers": [
+            row.book for row in BookStats.objects.popular(size, "total_purchases")
+        ],
+    }
+    return render(request, "library/popular.html", context)
+
+
+def search(request):
+    """Show books matching the ``q`` query, best matches first."""
+    query = request.GET.get("q", "").strip()
+    books = search_books(query) if query else []
+    return render(
+        request, "library/search.html", {"books": books, "query": query}
+    )
+
+
 def register(request):
     """Handle user registration and automatically log the new user in."""
+    # Imported on first use: auth forms pull in password hashing and
+    # validation modules that the other pages never need.
+    from .forms import UserRegistrationForm
+
     if request.method == "POST":
         form = UserRegistrationForm(request.POST)
         if form.is_valid():
             user = form.save()
+            tasks.send_welcome_email.enqueue(user.pk)
             # Automatically log in the new user
             login(request, user)
             messages.success(request, "Регистрация прошла успешно!")
@@ -60,27 +177,22 @@ def reserve_book(request, pk: int):
     Reserve a book for the logged‑in user.  If no copies are available or
     the user already has an active reservation, display an error.
     """
-    book = get_object_or_404(Book, pk=pk)
+    book = caching.get_book(pk)
     # Disallow reservations for VIP books
     if book.is_vip:
         messages.error(
             request, "Эту книгу нельзя бронировать, она находится в VIP разделе."
         )
         return redirect("book_detail", pk=pk)
-    if not book.is_available():
+    # Take a copy and create the reservation in one atomic step
+    outcome = inventory.reserve_copy(request.user, book)
+    if outcome == inventory.OUT_OF_STOCK:
         messages.error(request, "Нет доступных экземпляров этой книги.")
         return redirect("book_detail", pk=pk)
-    # Prevent multiple active reservations for the same book
-    existing_res = Reservation.objects.filter(
-        user=request.user, book=book, status="reserved"
-    )
-    if existing_res.exists():
+    if outcome == inventory.ALREADY_RESERVED:
         messages.error(request, "Вы уже зарезервировали эту книгу.")
         return redirect("book_detail", pk=pk)
-    # Create reservation and reduce available copies
-    Reservation.objects.create(user=request.user, book=book)
-    book.available_copies -= 1
-    book.save()
+    tasks.send_reservation_email.enqueue(request.user.pk, book.pk)
     messages.success(request, "Книга успешно зарезервирована.")
     return redirect("user_reservations")
 
@@ -100,17 +212,21 @@ def purchase_book(request, pk: int):
     if Purchase.objects.filter(user=request.user, book=book).exists():
         messages.info(request, "Вы уже приобрели эту книгу.")
         return redirect("book_detail", pk=pk)
-    # Create purchase record with the book's price (or zero if not set)
-    price = book.price or 0
-    Purchase.objects.create(user=request.user, book=book, price=price)
+    # Record the purchase at the book's price (or zero if not set)
+    if inventory.purchase_copy(request.user, book) == inventory.ALREADY_PURCHASED:
+        # A parallel request already recorded this purchase
+        messages.info(request, "Вы уже приобрели эту книгу.")
+        return redirect("book_detail", pk=pk)
     messages.success(request, "Книга успешно куплена!")
     return redirect("user_purchases")
 
 
 @login_required
-def user_purchases(request):
+async def user_purchases(request):
     """List all VIP book purchases for the logged‑in user."""
-    purchases = request.user.purchases.order_by("-purchased_at")
+    purchases = await Purchase.objects.ahistory_page(
+        await _load_user(request), request.GET.get("page")
+    )
     return render(
         request,
         "library/user_purchases.html",
@@ -119,9 +235,11 @@ def user_purchases(request):
 
 
 @login_required
-def user_reservations(request):
-    """List all reservations for the logged‑in user."""
-    reservations = request.user.reservations.order_by("-reserved_at")
+async def user_reservations(request):
+    """List all reservations for the logged‑in user, archived ones included."""
+    reservations = await archive.ahistory_page(
+        await _load_user(request), request.GET.get("page")
+    )
     return render(
         request,
         "library/user_reservations.html",
@@ -135,12 +253,8 @@ def cancel_reservation(request, res_id: int):
     reservation = get_object_or_404(
         Reservation, pk=res_id, user=request.user
     )
-    if reservation.status == "reserved":
-        reservation.status = "cancelled"
-        reservation.save()
-        # Return the book copy to availability
-        reservation.book.available_copies += 1
-        reservation.book.save()
+    # Close the reservation and return the copy to availability
+    if inventory.release_copy(reservation, "cancelled"):
         messages.success(request, "Бронирование отменено.")
     else:
         messages.info(request, "Это бронирование уже закрыто.")
@@ -153,12 +267,7 @@ def return_book(request, res_id: int):
     reservation = get_object_or_404(
         Reservation, pk=res_id, user=request.user
     )
-    if reservation.status == "reserved":
-        reservation.status = "returned"
-        reservation.return_date = timezone.now().date()
-        reservation.save()
-        reservation.book.available_copies += 1
-        reservation.book.save()
+    if inventory.release_copy(reservation, "returned"):
         messages.success(request, "Книга успешно возвращена. Спасибо!")
     else:
         messages.info(request, "Эту книгу вернуть нельзя, бронирование уже закрыто.")
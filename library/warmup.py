@@ -0,0 +1,84 @@
+"""
+Прогрев процесса перед первым запросом.
+
+Django многое загружает лениво: модули представлений — при первом
+разборе URL, шаблоны — при первой отрисовке, манифест статических
+файлов — при первом ``{% static %}``, модуль драйвера базы — при первом
+запросе к ней.  Всё это достаётся первому посетителю нового процесса.
+:func:`warm_up` делает эту работу заранее.  Она вызывается в
+``library_site/wsgi.py``, если задана переменная окружения
+``LIBRARY_WARM_UP=1``: в сервере с предварительным форком
+(``python manage.py runprefork`` ставит её сам, для
+``gunicorn --preload`` её нужно задать) — один раз в родительском
+процессе, и дочерние процессы стартуют уже прогретыми.  Без форка
+прогрев лишь замедлил бы старт каждого процесса.
+
+Соединения с базой после прогрева закрываются: открытое соединение
+нельзя делить между процессами, каждый дочерний откроет своё.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
+from django.db import connections
+from django.template import engines
+from django.urls import get_resolver
+from django.utils import translation
+from django.utils.module_loading import import_string
+
+
+@contextmanager
+def _step(timings, name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = round((time.perf_counter() - started) * 1000, 2)
+
+
+def template_names(engine):
+    """Names of the project templates (``DIRS``, not the app templates)."""
+    for directory in engine.engine.dirs:
+        for folder, _, filenames in os.walk(directory):
+            for filename in filenames:
+                if filename.endswith(".html"):
+                    path = os.path.join(folder, filename)
+                    yield os.path.relpath(path, directory).replace(os.sep, "/")
+
+
+def warm_up() -> dict:
+    """Load URLs, templates, static manifest, cache and DB; returns ms per step."""
+    timings = {}
+    with _step(timings, "urls"):
+        resolver = get_resolver()
+        # Imports every view module and builds the reverse() lookup.
+        resolver.reverse_dict
+    with _step(timings, "middleware"):
+        # Modules the session and message middleware import per request.
+        import_module(settings.SESSION_ENGINE)
+        import_string(settings.MESSAGE_STORAGE)
+        # Loads the translation catalogs of every installed app.
+        translation.activate(settings.LANGUAGE_CODE)
+        translation.gettext("Home")
+        translation.deactivate()
+    with _step(timings, "templates"):
+        # Compiled templates stay in the cached loader.
+        for engine in engines.all():
+            for name in template_names(engine):
+                engine.get_template(name)
+    with _step(timings, "static"):
+        # Any attribute access creates the storage, which loads the manifest.
+        staticfiles_storage.location
+    with _step(timings, "cache"):
+        cache.get("library:warm-up")
+    with _step(timings, "database"):
+        for connection in connections.all():
+            connection.ensure_connection()
+        # Children must open their own connections.
+        connections.close_all()
+    return timings
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -51,6 +52,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so that its timings include everything below it.
+    'library.timing.RequestTimingMiddleware',
+    # Before sessions, so that session writes pin the client too.
+    'library.replicas.PrimaryPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -64,7 +69,8 @@ ROOT_URLCONF = 'library_site.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # The standard Django backend, plus render time for Server-Timing.
+        'BACKEND': 'library.timing.TimedDjangoTemplates',
         # Add a project‑level templates directory so templates can live outside
         # individual apps.  This allows us to store base.html in
         # BASE_DIR / "templates".
@@ -86,14 +92,135 @@ WSGI_APPLICATION = 'library_site.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# SQLite connection profiles, chosen with the LIBRARY_DB_PROFILE
+# environment variable.
+#
+# "development" is SQLite's stock behaviour: rollback journal, a new
+# connection per request and deferred transactions.
+#
+# "production" is tuned for several workers writing at once:
+# * WAL lets readers and a writer work at the same time, and
+#   synchronous=NORMAL is safe under WAL (only the last transactions can
+#   be lost on power failure, never corrupted);
+# * a 20 s busy timeout makes a writer wait for the lock instead of
+#   failing with "database is locked";
+# * IMMEDIATE transactions take the write lock at BEGIN.  A deferred
+#   transaction that reads first and then writes has to upgrade its lock,
+#   and SQLite fails such upgrades at once rather than waiting;
+# * mmap and a 64 MB page cache keep hot pages in memory;
+# * connections are reused between requests (CONN_MAX_AGE), so the
+#   pragmas above run once per connection, not once per request.
+#
+# WAL mode is stored in the database file and stays on once set.
+SQLITE_PROFILES = {
+    'development': {},
+    'production': {
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA mmap_size=268435456;'
+                'PRAGMA cache_size=-65536;'
+            ),
+        },
+    },
+}
+
+LIBRARY_DB_PROFILE = os.environ.get('LIBRARY_DB_PROFILE', 'development')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Tests use a file rather than SQLite's shared in-memory database:
+        # shared-cache tables fail with "table is locked" instead of
+        # waiting, which breaks the multi-threaded inventory tests.
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+        **SQLITE_PROFILES[LIBRARY_DB_PROFILE],
+    }
+}
+
+# Read replicas: LIBRARY_DB_REPLICAS=N adds the aliases replica1..N, local
+# copies of db.sqlite3 that "python manage.py refreshreplicas" keeps
+# up to date.  Requests read from them, except right after a write; see
+# library/replicas.py.  Replicas never take the write lock themselves.
+LIBRARY_DB_REPLICAS = int(os.environ.get('LIBRARY_DB_REPLICAS', '0'))
+for _number in range(1, LIBRARY_DB_REPLICAS + 1):
+    DATABASES[f'replica{_number}'] = {
+        **DATABASES['default'],
+        'NAME': BASE_DIR / f'db.replica{_number}.sqlite3',
+        'OPTIONS': {
+            key: value
+            for key, value in DATABASES['default'].get('OPTIONS', {}).items()
+            if key != 'transaction_mode'
+        },
+        'TEST': {'MIRROR': 'default'},
     }
+LIBRARY_READ_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+# A client that has just written reads the primary for this long; keep it
+# above the refresh interval of the replicas.
+LIBRARY_REPLICA_PIN_SECONDS = 10
+DATABASE_ROUTERS = ['library.replicas.ReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+# Two tiers, no external services: a per-process LRU (bounded by entries
+# and bytes) in front of a file-based cache shared by all workers.  Local
+# copies live at most LOCAL_TIMEOUT seconds, which bounds how long another
+# worker's change can stay invisible in this one.  Version stamps
+# (library.caching) are never copied locally, so a change is seen at once.
+CACHES = {
+    'default': {
+        'BACKEND': 'library.cache_backends.TieredCache',
+        'LOCATION': BASE_DIR / 'cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'LOCAL_MAX_ENTRIES': 20000,
+            'LOCAL_MAX_BYTES': 64 * 1024 * 1024,
+            'LOCAL_TIMEOUT': 5,
+            'SHARED_ONLY_PREFIXES': ('library:stamp:',),
+        },
+    },
+    # Sessions and logged-in users (library.auth_backends), kept apart so
+    # that catalog churn never culls them.  A session ended in another
+    # worker is seen here within LOCAL_TIMEOUT; a change to the user at
+    # once, through its stamp.
+    'sessions': {
+        'BACKEND': 'library.cache_backends.TieredCache',
+        'LOCATION': BASE_DIR / 'cache' / 'sessions',
+        'OPTIONS': {
+            'MAX_ENTRIES': 200000,
+            'LOCAL_MAX_ENTRIES': 20000,
+            'LOCAL_MAX_BYTES': 16 * 1024 * 1024,
+            'LOCAL_TIMEOUT': 1,
+            'SHARED_ONLY_PREFIXES': ('library:stamp:',),
+        },
+    },
 }
 
 
+# Sessions and authentication
+# https://docs.djangoproject.com/en/5.2/topics/http/sessions/
+
+# Write-through sessions: reads come from the cache, writes go to both the
+# database and the cache.  Expired rows are removed by
+# "python manage.py purgesessions".
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'sessions'
+
+# ModelBackend that caches the User between requests.  Sessions created
+# with another backend are asked to log in again.
+AUTHENTICATION_BACKENDS = ['library.auth_backends.CachedModelBackend']
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -142,18 +269,113 @@ STATICFILES_DIRS = [
 # necessary in development but included for completeness.
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# collectstatic writes content-hashed copies plus a manifest (so browsers
+# may cache them for a year), resized AVIF/WebP/JPEG variants of the
+# images below and .gz/.br copies of text files.  Until it has run,
+# {% static %} uses the plain file names.  Serving is done by
+# library.static_wsgi.StaticFilesMiddleware in wsgi.py.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'library.staticfiles.CompressedManifestStaticFilesStorage',
+    },
+}
+
+# Static images that get resized variants: name -> widths in pixels.
+LIBRARY_STATIC_IMAGES = {
+    'images/hero.png': (640, 1024, 1536),
+}
+
 # Media files (e.g. uploaded book cover images) configuration.  During
 # development these will be served by the development server when
 # ``DEBUG`` is True.
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Email
+# https://docs.djangoproject.com/en/5.2/topics/email/
+#
+# Reservation and welcome emails are sent by background jobs (see
+# ``python manage.py runworker``).  The console backend prints them to the
+# worker's output; configure SMTP for a real deployment.
+EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+DEFAULT_FROM_EMAIL = 'library@localhost'
+
 # Configuration for django‑crispy‑forms
 CRISPY_ALLOWED_TEMPLATE_PACKS = [
     'bootstrap5',
 ]
 CRISPY_TEMPLATE_PACK = 'bootstrap5'
 
+# Number of books per catalog page on the home view.  Pages are addressed
+# by keyset cursors, so deep pages cost the same as the first one.  Set to
+# ``None`` to render the whole catalog on a single page.
+LIBRARY_CATALOG_PAGE_SIZE = 24
+
+# Rows per page on the "my reservations" and "my purchases" pages.
+LIBRARY_HISTORY_PAGE_SIZE = 50
+
+# Days a reserved book may be kept.  Overdue reservations are closed as
+# "expired" and their copies put back by ``python manage.py
+# expirereservations`` (run it from cron).  ``None`` turns expiry off.
+LIBRARY_RESERVATION_DAYS = 14
+
+# Closed reservations older than this many days are moved to the monthly
+# archive tables by ``python manage.py archivereservations`` (run it from
+# cron); history pages read both.  See library/archive.py.
+LIBRARY_ARCHIVE_AFTER_DAYS = 180
+
+# Availability streams (library/events.py): how often each process looks
+# for changes made by the other processes, and how long one connection
+# lives before the browser reconnects.
+LIBRARY_EVENTS_POLL_INTERVAL = 1.0
+LIBRARY_EVENTS_MAX_AGE = 300
+
+# Books in each list on the "popular" page.
+LIBRARY_POPULAR_SIZE = 12
+
+# Default page size of the JSON API (clients may ask for up to 200).
+LIBRARY_API_PAGE_SIZE = 50
+
+# Share of requests that RequestTimingMiddleware measures: it adds a
+# Server-Timing header and logs one JSON line per measured request.
+# 1.0 measures everything; lower it (e.g. 0.05) on busy servers.
+LIBRARY_TIMING_SAMPLE_RATE = 1.0
+
+# Logging
+# https://docs.djangoproject.com/en/5.2/topics/logging/
+
+LOG_DIR = BASE_DIR / 'logs'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        # One JSON object per line, appended by every worker process.
+        # Rotate it with logrotate; the handler reopens a moved file and
+        # creates LOG_DIR on first write (library/logfiles.py).
+        'timing_file': {
+            'class': 'library.logfiles.WatchedFileHandler',
+            'filename': LOG_DIR / 'timing.log',
+            'encoding': 'utf-8',
+            'delay': True,
+            'formatter': 'message',
+        },
+    },
+    'loggers': {
+        'library.timing': {
+            'handlers': ['timing_file'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
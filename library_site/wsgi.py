@@ -13,4 +13,18 @@ from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'library_site.settings')
 
-application = get_wsgi_application()
+django_application = get_wsgi_application()
+
+# Collected static files (with their gzip/brotli copies) are answered
+# before Django sees the request; see library/static_wsgi.py.
+from library.static_wsgi import StaticFilesMiddleware  # noqa: E402
+from library.warmup import warm_up  # noqa: E402
+
+application = StaticFilesMiddleware(django_application)
+
+# Do the lazy first-request work now, but only where it pays off: under a
+# preforking server it runs once, before fork.  manage.py runprefork sets
+# LIBRARY_WARM_UP=1; set it yourself for gunicorn --preload.
+warm_up_timings = {}
+if os.environ.get('LIBRARY_WARM_UP') == '1':
+    warm_up_timings = warm_up()
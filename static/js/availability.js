@@ -0,0 +1,22 @@
+// Live "available copies" counters: every element with a data-book-copies
+// attribute is updated from the server-sent events of library/events.py.
+(function () {
+  var script = document.currentScript;
+  var counters = document.querySelectorAll("[data-book-copies]");
+  if (!window.EventSource || !counters.length) {
+    return;
+  }
+  var ids = Array.prototype.map.call(counters, function (el) {
+    return el.getAttribute("data-book-copies");
+  });
+  var url = script.getAttribute("data-events-url") + "?book=" + ids.join(",");
+  var source = new EventSource(url);
+  source.addEventListener("availability", function (event) {
+    var data = JSON.parse(event.data);
+    Array.prototype.forEach.call(counters, function (el) {
+      if (el.getAttribute("data-book-copies") === String(data.book)) {
+        el.textContent = data.available_copies;
+      }
+    });
+  });
+})();